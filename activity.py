@@ -0,0 +1,217 @@
+# This file counts active players with HyperLogLog sketches, so that daily,
+# weekly and monthly active players, and distinct players per map, can be
+# read for any date range without a `COUNT(DISTINCT player_id)` over the
+# runs table. Every run that is started adds its player to the sketch for
+# its day and map, and to the sketch for its day across all maps.
+#
+# A sketch is 2**precision one-byte registers (4 KB by default) and counts
+# distinct players with a standard error of about 1.6%. Sketches for
+# different days and maps merge by taking the larger of each register,
+# which is done on whole sketches at once as big-integer arithmetic: a
+# handful of sketches merge in microseconds and a year of days in a few
+# milliseconds.
+#
+# Changed sketches are saved to `activity_sketches` every
+# `activity_persist_interval_seconds` and at shutdown. Adding a player
+# twice changes nothing, so after a restart the most recent runs are
+# simply replayed over the saved sketches. Sketches cannot forget a
+# player, so deleted runs and players still count as past activity.
+
+import datetime
+import hashlib
+import math
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import indexes
+import models
+import schemas
+from config import settings
+
+# The map key of the sketches that cover every map.
+ALL_MAPS = "*"
+
+# Runs this far below the saved watermark are replayed after a restart, in
+# case they committed after runs with higher IDs.
+REPLAY_MARGIN = 1000
+
+_high_bits: Dict[int, int] = {}
+
+def _lane_high_bits(size: int) -> int:
+    if size not in _high_bits:
+        _high_bits[size] = int.from_bytes(b"\x80" * size, "little")
+    return _high_bits[size]
+
+def merge_registers(sketches: Iterable[bytes]) -> Optional[bytes]:
+    """
+    Returns the register-wise maximum of equally sized sketches. Registers
+    never exceed 64, so each byte is treated as a lane of one big integer:
+    setting a lane's top bit and subtracting leaves it set exactly where
+    the second value is at least the first, with no borrow between lanes.
+    """
+    merged = None
+    size = 0
+    for registers in sketches:
+        value = int.from_bytes(registers, "little")
+        if merged is None:
+            merged, size = value, len(registers)
+            continue
+        high = _lane_high_bits(size)
+        at_least = ((value | high) - merged) & high
+        mask = (at_least >> 7) * 0xFF
+        merged ^= (merged ^ value) & mask
+    return merged.to_bytes(size, "little") if merged is not None else None
+
+def estimate(registers: Optional[bytes]) -> int:
+    """
+    Estimates the number of distinct items added to a sketch.
+    """
+    if not registers:
+        return 0
+    size = len(registers)
+    total = sum(registers.count(rank) * 2.0 ** -rank for rank in range(max(registers) + 1))
+    alpha = 0.7213 / (1 + 1.079 / size)
+    raw = alpha * size * size / total
+    zeros = registers.count(0)
+    if raw <= 2.5 * size and zeros:
+        # Linear counting is more accurate while many registers are empty.
+        return round(size * math.log(size / zeros))
+    return round(raw)
+
+def add(registers: bytearray, item: int) -> bool:
+    """
+    Adds an item to a sketch, returning True if any register changed.
+    """
+    precision = (len(registers) - 1).bit_length()
+    digest = int.from_bytes(hashlib.blake2b(str(item).encode("utf-8"), digest_size=8).digest(), "big")
+    index = digest >> (64 - precision)
+    remaining = digest & ((1 << (64 - precision)) - 1)
+    rank = (64 - precision) - remaining.bit_length() + 1
+    if rank > registers[index]:
+        registers[index] = rank
+        return True
+    return False
+
+class ActivityIndex(indexes.DerivedIndex):
+    """
+    Holds a sketch of active players for each (day, map) pair, and for
+    each day across all maps.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._clear()
+
+    def _clear(self):
+        self._sketches: Dict[Tuple[datetime.date, str], bytearray] = {}
+        self._dirty: Set[Tuple[datetime.date, str]] = set()
+        self._watermark = 0
+        self._persisted_at = time.monotonic()
+
+    def _add(self, player_id: int, map_id: Optional[str], started_at: Optional[datetime.datetime]):
+        day = (started_at or datetime.datetime.now()).date()
+        for key in ((day, map_id or ""), (day, ALL_MAPS)):
+            registers = self._sketches.get(key)
+            if registers is None:
+                registers = self._sketches[key] = bytearray(1 << settings.activity_precision)
+            if add(registers, player_id):
+                self._dirty.add(key)
+
+    def _load(self, db: Session):
+        for row in db.query(models.ActivitySketch):
+            self._sketches[(row.day, row.map_id)] = bytearray(row.registers)
+            self._watermark = max(self._watermark, row.last_run_id)
+        replay_from = max(self._watermark - REPLAY_MARGIN, 0)
+        runs = (
+            db.query(models.Run.id, models.Run.player_id, models.Run.map_id, models.Run.started_at)
+            .filter(models.Run.id > replay_from)
+            .yield_per(5000)
+        )
+        for run_id, player_id, map_id, started_at in runs:
+            self._add(player_id, map_id, started_at)
+            self._watermark = max(self._watermark, run_id)
+
+    def record(self, run: models.Run):
+        """
+        Counts the player of a newly started run.
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            self._add(run.player_id, run.map_id, run.started_at)
+            self._watermark = max(self._watermark, run.id)
+
+    def persist_if_due(self, bind):
+        """
+        Saves the changed sketches if the persist interval has passed.
+        """
+        if self._dirty and time.monotonic() - self._persisted_at >= settings.activity_persist_interval_seconds:
+            self.persist(bind)
+
+    def persist(self, bind):
+        """
+        Saves every changed sketch, with the run ID they are complete up to.
+        """
+        with self._lock:
+            if not self._loaded or not self._dirty:
+                return
+            rows = [
+                {"day": day, "map_id": map_id, "registers": bytes(self._sketches[(day, map_id)]), "last_run_id": self._watermark}
+                for day, map_id in self._dirty
+            ]
+            self._dirty = set()
+            self._persisted_at = time.monotonic()
+        table = models.ActivitySketch.__table__
+        with bind.begin() as connection:
+            for row in rows:
+                connection.execute(table.delete().where(table.c.day == row["day"], table.c.map_id == row["map_id"]))
+            connection.execute(table.insert(), rows)
+
+    def _estimate(self, start: datetime.date, end: datetime.date, map_key: str) -> int:
+        with self._lock:
+            sketches = [bytes(registers) for (day, map_id), registers in self._sketches.items()
+                        if map_id == map_key and start <= day <= end]
+        return estimate(merge_registers(sketches))
+
+    def active_players(self, db: Session, start: datetime.date, end: datetime.date) -> schemas.ActivePlayers:
+        """
+        Estimates the distinct players who started a run between `start`
+        and `end` inclusive, overall and on each map.
+        """
+        self.ensure_loaded(db)
+        with self._lock:
+            by_map: Dict[str, List[bytes]] = {}
+            for (day, map_id), registers in self._sketches.items():
+                if start <= day <= end:
+                    by_map.setdefault(map_id, []).append(bytes(registers))
+        overall = by_map.pop(ALL_MAPS, [])
+        return schemas.ActivePlayers(
+            start=start,
+            end=end,
+            players=estimate(merge_registers(overall)),
+            by_map={map_id: estimate(merge_registers(sketches)) for map_id, sketches in sorted(by_map.items())},
+        )
+
+    def engagement(self, db: Session, day: datetime.date, map_id: Optional[str] = None) -> schemas.Engagement:
+        """
+        Estimates the players active on `day` and in the 7 and 30 days
+        ending on it, on one map or all of them.
+        """
+        self.ensure_loaded(db)
+        map_key = ALL_MAPS if map_id is None else map_id
+        daily = self._estimate(day, day, map_key)
+        weekly = self._estimate(day - datetime.timedelta(days=6), day, map_key)
+        monthly = self._estimate(day - datetime.timedelta(days=29), day, map_key)
+        return schemas.Engagement(
+            day=day,
+            map_id=map_id,
+            daily=daily,
+            weekly=weekly,
+            monthly=monthly,
+            stickiness=round(daily / monthly, 4) if monthly else 0.0,
+        )
+
+index = indexes.register(ActivityIndex())
@@ -10,6 +10,7 @@ from typing import Optional
 
 import models 
 import crud
+import metrics
 
 # Use bcrypt for password hashing, which is a strong and widely-used algorithm.
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -19,13 +20,15 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
     Verifies a plain-text password against a hashed password.
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    with metrics.timed("bcrypt"):
+        return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     """
     Generates a hash for a plain-text password.
     """
-    return pwd_context.hash(password)
+    with metrics.timed("bcrypt"):
+        return pwd_context.hash(password)
 
 def authenticate_player(db: Session, name: str, password: str) -> Optional[models.Player]:
     """
@@ -48,10 +51,9 @@ admin_credentials_exception = HTTPException(
     headers={"WWW-Authenticate": "Basic"},
 )
 
-def get_current_admin(credentials: HTTPBasicCredentials = Depends(HTTPBasic(realm="admin"))):
+def is_admin(username: str, password: str) -> bool:
     """
-    A dependency that protects admin-only endpoints. It uses Basic Authentication
-    to verify admin credentials.
+    Checks whether the given username and password are the admin credentials.
     """
     # In a real-world application, these credentials should be stored securely,
     # for example, in environment variables or a secrets management service.
@@ -59,10 +61,16 @@ def get_current_admin(credentials: HTTPBasicCredentials = Depends(HTTPBasic(real
     correct_password = "admin"
     
     # Use `secrets.compare_digest` to prevent timing attacks.
-    is_user_correct = secrets.compare_digest(credentials.username, correct_username)
-    is_pass_correct = secrets.compare_digest(credentials.password, correct_password)
-    
-    if not (is_user_correct and is_pass_correct):
+    is_user_correct = secrets.compare_digest(username, correct_username)
+    is_pass_correct = secrets.compare_digest(password, correct_password)
+    return is_user_correct and is_pass_correct
+
+def get_current_admin(credentials: HTTPBasicCredentials = Depends(HTTPBasic(realm="admin"))):
+    """
+    A dependency that protects admin-only endpoints. It uses Basic Authentication
+    to verify admin credentials.
+    """
+    if not is_admin(credentials.username, credentials.password):
         raise admin_credentials_exception
     
     return credentials.username
\ No newline at end of file
@@ -0,0 +1,239 @@
+# This file takes online backups of the SQLite database. The copy is made
+# with SQLite's backup API a few pages at a time, sleeping between steps,
+# so the database stays available and gameplay writes are only ever held
+# up for one short step. A write made while the copy is running makes
+# SQLite restart it, so the result is always a consistent snapshot.
+#
+# Each backup is gzipped into `backup_dir` with a SHA-256 checksum beside
+# it (in `sha256sum` format), and only the newest `backup_keep` are kept.
+# Backups are taken from `/admin/backups`, on the `backup_interval_hours`
+# schedule, or with `python -m backup`. With `replica_from_backups` set,
+# the newest backup also serves as the analytics read replica.
+
+import datetime
+import gzip
+import hashlib
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from typing import Callable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+_FILE_NAME = re.compile(r"^backup-(\d{8}T\d{12})\.db\.gz$")
+_TIMESTAMP_FORMAT = "%Y%m%dT%H%M%S%f"
+
+def copy_database(bind, path: str, pages: Optional[int] = None, progress: Optional[Callable[[int], None]] = None):
+    """
+    Copies the live SQLite database behind `bind` to `path`, a step of
+    `pages` (by default `backup_pages`) pages at a time. `progress` is
+    called with the number of pages copied by each step.
+    """
+    if bind.dialect.name != "sqlite":
+        raise ValueError("Online backups need a SQLite database")
+    copied = {"pages": 0}
+
+    def report(status, remaining, total):
+        # A copy restarted by a concurrent write starts counting again.
+        if progress and total - remaining > copied["pages"]:
+            progress(total - remaining - copied["pages"])
+        copied["pages"] = total - remaining
+
+    source = bind.raw_connection()
+    try:
+        target = sqlite3.connect(path)
+        try:
+            source.driver_connection.backup(
+                target, pages=pages or settings.backup_pages, progress=report, sleep=settings.backup_sleep_seconds
+            )
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+def sync_file(file):
+    """
+    Flushes an open file to the disk, so that it survives a crash.
+    """
+    file.flush()
+    os.fsync(file.fileno())
+
+def sync_directory(path: str):
+    """
+    Flushes a directory to the disk, so that files created, renamed or
+    removed in it stay that way after a crash. Windows cannot open a
+    directory, and does not need this.
+    """
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    descriptor = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _checksum_path(path: str) -> str:
+    return f"{path}.sha256"
+
+def create_backup(db: Session, progress: Optional[Callable[[int], None]] = None) -> str:
+    """
+    Takes a compressed, checksummed backup of the database, removes the
+    backups beyond `backup_keep`, and returns the new backup's path.
+    `progress` is called with the number of pages copied once the copy is
+    done, since a job writing its progress to the database mid-copy would
+    make SQLite restart it.
+    """
+    os.makedirs(settings.backup_dir, exist_ok=True)
+    name = f"backup-{datetime.datetime.now().strftime(_TIMESTAMP_FORMAT)}.db.gz"
+    path = os.path.join(settings.backup_dir, name)
+    copy = f"{path}.partial.db"
+    pages = []
+    try:
+        copy_database(db.get_bind(), copy, progress=pages.append)
+        if progress:
+            progress(sum(pages))
+        with open(copy, "rb") as source, open(f"{path}.partial", "wb") as partial:
+            with gzip.GzipFile(fileobj=partial, mode="wb") as target:
+                shutil.copyfileobj(source, target, 1 << 20)
+            sync_file(partial)
+    finally:
+        if os.path.exists(copy):
+            os.remove(copy)
+    with open(_checksum_path(path), "w") as checksum:
+        checksum.write(f"{_sha256(f'{path}.partial')}  {name}\n")
+        sync_file(checksum)
+    # The backup only appears under its final name once it is complete and
+    # on the disk, and the rename is flushed before older backups go.
+    os.replace(f"{path}.partial", path)
+    sync_directory(settings.backup_dir)
+    rotate()
+    return path
+
+def list_backups() -> List[dict]:
+    """
+    Returns every complete backup, newest first.
+    """
+    if not os.path.isdir(settings.backup_dir):
+        return []
+    backups = []
+    for name in os.listdir(settings.backup_dir):
+        match = _FILE_NAME.match(name)
+        if not match:
+            continue
+        path = os.path.join(settings.backup_dir, name)
+        try:
+            with open(_checksum_path(path)) as checksum:
+                sha256 = checksum.read().split()[0]
+        except (FileNotFoundError, IndexError):
+            sha256 = None
+        backups.append({
+            "name": name,
+            "path": path,
+            "size_bytes": os.path.getsize(path),
+            "sha256": sha256,
+            "created_at": datetime.datetime.strptime(match.group(1), _TIMESTAMP_FORMAT),
+        })
+    backups.sort(key=lambda backup: backup["created_at"], reverse=True)
+    return backups
+
+def rotate() -> List[str]:
+    """
+    Deletes the backups beyond the newest `backup_keep`, and returns their names.
+    """
+    removed = []
+    for backup in list_backups()[settings.backup_keep:]:
+        os.remove(backup["path"])
+        if os.path.exists(_checksum_path(backup["path"])):
+            os.remove(_checksum_path(backup["path"]))
+        removed.append(backup["name"])
+    return removed
+
+def verify(path: str) -> bool:
+    """
+    Checks a backup against its recorded checksum.
+    """
+    try:
+        with open(_checksum_path(path)) as checksum:
+            expected = checksum.read().split()[0]
+    except (FileNotFoundError, IndexError):
+        return False
+    return _sha256(path) == expected
+
+def restore(path: str, target: str):
+    """
+    Decompresses a backup into a database file at `target`, after checking
+    its checksum.
+    """
+    if not verify(path):
+        raise ValueError(f"Backup {path} does not match its checksum")
+    with gzip.open(path, "rb") as source, open(target, "wb") as restored:
+        shutil.copyfileobj(source, restored, 1 << 20)
+
+class Scheduler:
+    """
+    Takes a backup whenever the newest one is older than
+    `backup_interval_hours`. As it goes by the backups on disk, several
+    workers running it do not each take their own.
+    """
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self, session_factory):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(session_factory,), name="backup", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def due(self) -> bool:
+        backups = list_backups()
+        interval = datetime.timedelta(hours=settings.backup_interval_hours)
+        return not backups or datetime.datetime.now() - backups[0]["created_at"] >= interval
+
+    def _run(self, session_factory):
+        while not self._stop.is_set():
+            try:
+                if self.due():
+                    with session_factory() as db:
+                        logger.info("Took scheduled backup %s", create_backup(db))
+            except Exception:
+                logger.exception("Scheduled backup failed")
+            self._stop.wait(60)
+
+scheduler = Scheduler()
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) == 3 and sys.argv[1] == "verify":
+        valid = verify(sys.argv[2])
+        print("Checksum matches" if valid else "Checksum does not match")
+        sys.exit(0 if valid else 1)
+    elif len(sys.argv) == 4 and sys.argv[1] == "restore":
+        restore(sys.argv[2], sys.argv[3])
+        print(f"Restored to {sys.argv[3]}")
+    else:
+        from database import SessionLocal
+
+        with SessionLocal() as session:
+            print(f"Backed up to {create_backup(session)}")
@@ -0,0 +1,3 @@
+# This package contains the benchmark harness: a seeder that fills a
+# database with realistic data and a load generator that replays the
+# game client's traffic against the API.
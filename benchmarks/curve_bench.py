@@ -0,0 +1,77 @@
+# This file measures the map curves kept by `timeseries.MapCurveIndex`:
+# how long it takes to decode generated progress series, to add them to
+# the index (as a load at startup does, a run at a time), and to read a
+# map's curves from the index once it is built, both as they stand and
+# with a run finishing before each read. The series are generated
+# like a game sends them, a sample every 30 seconds, so the kill and XP
+# deltas take one or two bytes each.
+#
+# Usage:
+#   python -m benchmarks.curve_bench --runs 20000 --samples 60
+
+import argparse
+import random
+import time
+
+import timeseries
+from event_store import write_varint, zigzag
+
+def generate_series(rng: random.Random, samples: int) -> bytes:
+    """
+    Returns the encoded series of one run with the given number of samples.
+    """
+    out = bytearray()
+    last = values = (0, 0, 0, 0)
+    for _ in range(samples):
+        duration, kills, xp, level = values
+        values = (duration + 30, kills + rng.randint(0, 12), xp + rng.randint(0, 400), level + (rng.random() < 0.2))
+        for value, previous in zip(values, last):
+            write_varint(out, zigzag(value - previous))
+        last = values
+    return bytes(out)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure building and reading the in-memory map curves.")
+    parser.add_argument("--runs", type=int, default=20_000)
+    parser.add_argument("--samples", type=int, default=60)
+    parser.add_argument("--reads", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    series = [generate_series(rng, rng.randint(1, args.samples)) for _ in range(args.runs)]
+    sample_count = sum(len(timeseries.decode(data)["duration_seconds"]) for data in series)
+
+    started = time.perf_counter()
+    for data in series:
+        timeseries.decode(data)
+    decode_seconds = time.perf_counter() - started
+
+    # Built directly rather than from a database, so only the index is timed.
+    index = timeseries.MapCurveIndex()
+    started = time.perf_counter()
+    for data in series:
+        index._add("bench", None, data)
+    add_seconds = time.perf_counter() - started
+    index._loaded = True
+
+    # A different bucket size each time, as dashboards ask for.
+    started = time.perf_counter()
+    for read in range(args.reads):
+        index.curve(None, "bench", bucket_seconds=10 + read % 50, buckets=120)
+    read_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for read in range(args.reads):
+        # A run finishing between reads, as on a live server.
+        index._add("bench", None, series[read])
+        index.curve(None, "bench", bucket_seconds=10 + read % 50, buckets=120)
+    live_read_seconds = time.perf_counter() - started
+
+    print(f"{args.runs} runs, {sample_count} samples")
+    print(f"decode: {decode_seconds / sample_count * 1e6:.2f} us/sample")
+    print(f"   add: {add_seconds / sample_count * 1e6:.2f} us/sample ({add_seconds:.2f} s to load)")
+    print(f"  read: {read_seconds / args.reads * 1e3:.2f} ms/curve, "
+          f"{live_read_seconds / args.reads * 1e3:.2f} ms/curve with a run added before each read")
+
+if __name__ == "__main__":
+    main()
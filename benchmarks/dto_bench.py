@@ -0,0 +1,99 @@
+# This file compares the two ways of serving run listings, end to end
+# through the `/runs` endpoint: loading full ORM objects (with their
+# players) and having FastAPI validate them against `response_model`, as
+# the list endpoints used to, against reading only the needed columns,
+# constructing the schemas without validation and serializing them
+# straight to JSON, as `/runs` now does. It reports the time and peak
+# memory per row of one large page.
+#
+# Usage:
+#   python -m benchmarks.dto_bench --rows 100000
+
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import joinedload, sessionmaker
+
+import models
+import schemas
+from benchmarks.seed import seed
+from database import get_db
+from main import app
+
+def orm_app(session_factory) -> FastAPI:
+    """
+    Serves `/runs` the old way: ORM objects, validated by FastAPI.
+    """
+    orm = FastAPI()
+
+    @orm.get("/runs", response_model=List[schemas.Run])
+    def get_runs(limit: int = 100):
+        with session_factory() as db:
+            return db.query(models.Run).options(joinedload(models.Run.player)).order_by(models.Run.id).limit(limit).all()
+
+    return orm
+
+def measure(client: TestClient, limit: int, repeats: int) -> Dict[str, float]:
+    """
+    Returns the best time over `repeats` requests for one page, and the
+    peak memory held while serving it, each per row.
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        gc.collect()
+        started = time.perf_counter()
+        response = client.get("/runs", params={"limit": limit})
+        best = min(best, time.perf_counter() - started)
+    gc.collect()
+    tracemalloc.start()
+    client.get("/runs", params={"limit": limit})
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rows = len(response.json())
+    return {"rows": rows, "microseconds_per_row": best / rows * 1e6, "bytes_per_row": peak / rows}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare ORM and row listings through the /runs endpoint.")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'dto_bench.db')}")
+        models.Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+        players = max(args.rows // 100, 1)
+        with session_factory() as db:
+            seed(db, players=players, runs_per_player=-(-args.rows // players), events_per_run=0)
+
+        def override_get_db():
+            with session_factory() as db:
+                yield db
+
+        app.dependency_overrides[get_db] = override_get_db
+        try:
+            results = {
+                "orm": measure(TestClient(orm_app(session_factory)), args.rows, args.repeats),
+                "rows": measure(TestClient(app), args.rows, args.repeats),
+            }
+        finally:
+            app.dependency_overrides.pop(get_db, None)
+        engine.dispose()
+
+    for name, result in results.items():
+        print(f"{name:>5}: {result['rows']} rows, {result['microseconds_per_row']:.1f} us/row, "
+              f"{result['bytes_per_row']:.0f} bytes/row")
+    orm, rows = results["orm"], results["rows"]
+    print(f"rows are {orm['microseconds_per_row'] / rows['microseconds_per_row']:.1f}x faster and use "
+          f"{orm['bytes_per_row'] / rows['bytes_per_row']:.1f}x less memory")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+# This file replays the game client's traffic against the API and reports
+# per-endpoint latency percentiles and throughput. The traffic mix follows
+# `Network.gd`: each simulated session starts a run, sends a progress
+# update every 30 in-game seconds, ends the run, and then polls the
+# leaderboard and the players summary as the menus do.
+#
+# Results can be saved as a JSON baseline and later runs compared against
+# it, so that latency regressions are caught.
+#
+# Usage:
+#   python -m benchmarks.seed --database-url sqlite:///./bench.db --players 1000
+#   python -m benchmarks.load --database-url sqlite:///./bench.db --concurrency 8 \
+#       --duration 30 --output benchmarks/baselines/local.json
+#   python -m benchmarks.load --base-url http://127.0.0.1:8000 --compare benchmarks/baselines/local.json
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+# The game sends a progress update every 30 seconds of play.
+UPDATE_INTERVAL_SECONDS = 30
+
+class Recorder:
+    """
+    Collects the latency and outcome of every request, keyed by endpoint.
+    """
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float, ok: bool):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """
+    Returns the nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+class Session:
+    """
+    Simulates one player session, issuing the same requests in the same
+    order as the Godot client.
+    """
+
+    def __init__(self, client, recorder: Recorder, rng: random.Random, player_names: List[str], password: str):
+        self.client = client
+        self.recorder = recorder
+        self.rng = rng
+        self.player_names = player_names
+        self.password = password
+
+    def request(self, endpoint: str, method: str, path: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.client.request(method, path, **kwargs)
+            ok = response.status_code < 400
+        except Exception:
+            response, ok = None, False
+        self.recorder.record(endpoint, time.perf_counter() - started, ok)
+        return response if ok else None
+
+    def play(self):
+        # Pick one of the seeded players and start a run for them.
+        player_name = self.rng.choice(self.player_names)
+        response = self.request("POST /runs/start", "POST", "/runs/start", json={
+            "player_name": player_name, "password": self.password, "map_id": "default_map",
+        })
+        if response is None:
+            return
+        run_id = response.json()["run_id"]
+
+        # Send a progress update for every 30 seconds survived.
+        survived = self.rng.randint(UPDATE_INTERVAL_SECONDS, 20 * UPDATE_INTERVAL_SECONDS)
+        upgrades = {}
+        for elapsed in range(UPDATE_INTERVAL_SECONDS, survived + 1, UPDATE_INTERVAL_SECONDS):
+            upgrade = self.rng.choice(["damage", "speed", "health", "fire_rate"])
+            upgrades[upgrade] = upgrades.get(upgrade, 0) + 1
+            self.request("PATCH /runs/{run_id}/update", "PATCH", f"/runs/{run_id}/update", json={
+                "duration_seconds": elapsed, "kills_total": elapsed // 3, "xp": elapsed * 7,
+                "upgrades": upgrades, "level": elapsed // 60,
+            })
+
+        # End the run, then look at the leaderboard and the players list.
+        self.request("PATCH /runs/{run_id}/update", "PATCH", f"/runs/{run_id}/update", json={
+            "duration_seconds": survived, "kills_total": survived // 3, "xp": survived * 7,
+            "upgrades": upgrades, "level": survived // 60, "status": "completed", "cause_of_death": "Skeleton",
+        })
+        self.request("GET /analytics/leaderboard", "GET", "/analytics/leaderboard")
+        self.request("GET /analytics/players-summary", "GET", "/analytics/players-summary")
+
+def find_players(client, prefix: str, limit: int) -> List[str]:
+    """
+    Returns the names of up to `limit` players whose names start with
+    `prefix`, as listed by the API, so that only players that exist are
+    picked whatever else the database holds.
+    """
+    names: List[str] = []
+    skip = 0
+    while len(names) < limit:
+        page = client.get("/players", params={"skip": skip, "limit": 100}).json()
+        if not page:
+            break
+        names.extend(player["name"] for player in page if player["name"].startswith(prefix))
+        skip += len(page)
+    return names[:limit]
+
+def run_load(client, concurrency: int, duration: float, player_names: List[str], password: str, random_seed: int = 0) -> dict:
+    """
+    Runs simulated sessions as the given players on `concurrency` threads,
+    sharing one client, for `duration` seconds and returns the
+    per-endpoint report.
+    """
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+
+    def worker(index: int):
+        rng = random.Random(random_seed + index)
+        while time.perf_counter() < deadline:
+            Session(client, recorder, rng, player_names, password).play()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        latencies.sort()
+        endpoints[endpoint] = {
+            "requests": len(latencies),
+            "errors": recorder.errors[endpoint],
+            "throughput_rps": len(latencies) / elapsed,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+        }
+    return {
+        "concurrency": concurrency,
+        "duration_seconds": elapsed,
+        "endpoints": endpoints,
+    }
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Returns a description of every endpoint whose p95 latency has regressed
+    by more than `tolerance` (a fraction) against the baseline.
+    """
+    regressions = []
+    for endpoint, result in report["endpoints"].items():
+        previous = baseline["endpoints"].get(endpoint)
+        if previous is None:
+            continue
+        if result["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{endpoint}: p95 {result['p95_ms']:.1f} ms vs baseline {previous['p95_ms']:.1f} ms"
+            )
+    return regressions
+
+def print_report(report: dict):
+    print(f"{'endpoint':<36}{'reqs':>8}{'errs':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for endpoint, result in report["endpoints"].items():
+        print(
+            f"{endpoint:<36}{result['requests']:>8}{result['errors']:>6}{result['throughput_rps']:>9.1f}"
+            f"{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+        )
+
+def _in_process_client(database_url: str):
+    """
+    Builds a client that calls the app in-process against `database_url`.
+    Entering it runs the app's startup, as a server would: the database is
+    migrated and the in-memory indexes are built from it.
+    """
+    # The app reads the database URL from its settings when it is first
+    # imported, so it must be set before then.
+    os.environ["DATABASE_URL"] = database_url
+    from fastapi.testclient import TestClient
+
+    from main import app
+
+    return TestClient(app)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay game client traffic against the API.")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--base-url", help="Benchmark a running server instead of the app in-process.")
+    target.add_argument("--database-url", default="sqlite:///./bench.db",
+                        help="Database used when benchmarking the app in-process.")
+    parser.add_argument("--players", type=int, default=1000, help="Most seeded players to pick from.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run for.")
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report to this JSON file as a baseline.")
+    parser.add_argument("--compare", help="Compare against a previously saved baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed p95 regression against the baseline, as a fraction.")
+    args = parser.parse_args(argv)
+
+    if args.base_url:
+        import httpx
+        client = httpx.Client(base_url=args.base_url, timeout=30)
+    else:
+        client = _in_process_client(args.database_url)
+    # Imported after the in-process client, which sets the database URL.
+    from benchmarks.seed import SEED_NAME_PREFIX, SEED_PASSWORD
+
+    with client:
+        player_names = find_players(client, SEED_NAME_PREFIX, args.players)
+        if not player_names:
+            print("No seeded players found; run benchmarks.seed first")
+            return 1
+        report = run_load(client, args.concurrency, args.duration, player_names, SEED_PASSWORD, args.random_seed)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
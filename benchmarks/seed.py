@@ -0,0 +1,146 @@
+# This file seeds a database with a configurable number of players, runs,
+# upgrades and events, so that the API can be benchmarked against a
+# realistically sized data set. Rows are bulk inserted in batches rather
+# than created one at a time through the ORM.
+#
+# Usage:
+#   python -m benchmarks.seed --database-url sqlite:///./bench.db --players 1000
+
+import argparse
+import datetime
+import itertools
+import random
+from typing import Dict, List
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session, sessionmaker
+
+import crud
+import models
+
+# Every seeded player shares this password, so that only one bcrypt hash
+# has to be computed however many players are created.
+SEED_PASSWORD = "benchmark-password"
+SEED_NAME_PREFIX = "bench_player_"
+
+MAP_IDS = ["default_map", "map1", "map2"]
+UPGRADES = ["damage", "speed", "health", "fire_rate", "pickup_radius", "armour"]
+EVENT_TYPES = ["level_up", "upgrade_chosen", "boss_defeated", "item_picked_up"]
+CAUSES_OF_DEATH = ["Skeleton", "Vampire", "Skull", "Fell off a cliff"]
+
+# The number of rows sent to the database in each bulk insert.
+BATCH_SIZE = 5000
+
+def _insert_batched(db: Session, model, rows) -> List[int]:
+    """
+    Bulk inserts rows for a model, a batch at a time, and returns the IDs
+    the database gave them, in the same order.
+    """
+    ids = []
+    statement = insert(model).returning(model.id, sort_by_parameter_order=True)
+    for start in range(0, len(rows), BATCH_SIZE):
+        ids.extend(db.scalars(statement, rows[start:start + BATCH_SIZE]).all())
+    return ids
+
+def seed(
+    db: Session,
+    players: int = 100,
+    runs_per_player: int = 10,
+    upgrades_per_run: int = 3,
+    events_per_run: int = 20,
+    random_seed: int = 0,
+) -> Dict[str, int]:
+    """
+    Fills the database with generated players, runs and events and returns
+    the number of rows created for each table. Player names are
+    `bench_player_<n>`, skipping any names already taken, and all players
+    use `SEED_PASSWORD`. IDs are left to the database, so a
+    database that already holds data can be seeded too.
+    """
+    rng = random.Random(random_seed)
+    now = datetime.datetime.now()
+    hashed_password = crud.get_password_hash(SEED_PASSWORD)
+
+    taken = {
+        name for name, in db.query(models.Player.name).filter(models.Player.name.startswith(SEED_NAME_PREFIX, autoescape=True))
+    }
+    names = (f"{SEED_NAME_PREFIX}{number}" for number in itertools.count(1))
+    player_rows = [
+        {
+            "name": name,
+            "hashed_password": hashed_password,
+            "created_at": now - datetime.timedelta(days=rng.randint(0, 365)),
+        }
+        for name in itertools.islice((name for name in names if name not in taken), players)
+    ]
+    player_ids = _insert_batched(db, models.Player, player_rows)
+
+    run_rows = []
+    # The start and duration of each run, for generating its events.
+    run_times = []
+    for player_id in player_ids:
+        for _ in range(runs_per_player):
+            started_at = now - datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+            duration = rng.randint(10, 1800)
+            run_times.append((started_at, duration))
+            run_rows.append({
+                "player_id": player_id,
+                "map_id": rng.choice(MAP_IDS),
+                "started_at": started_at,
+                "ended_at": started_at + datetime.timedelta(seconds=duration),
+                "status": rng.choice([models.RunStatus.died, models.RunStatus.completed]),
+                "duration_seconds": duration,
+                "level": duration // 60,
+                "xp": duration * 7,
+                "kills_total": duration // 3,
+                "upgrades": {
+                    upgrade: rng.randint(1, 5)
+                    for upgrade in rng.sample(UPGRADES, min(upgrades_per_run, len(UPGRADES)))
+                },
+                "cause_of_death": rng.choice(CAUSES_OF_DEATH),
+            })
+    run_ids = _insert_batched(db, models.Run, run_rows)
+
+    event_rows = [
+        {
+            "run_id": run_id,
+            "event_type": rng.choice(EVENT_TYPES),
+            "value": str(rng.randint(1, 10)),
+            "timestamp": started_at + datetime.timedelta(seconds=rng.randint(0, duration)),
+        }
+        for run_id, (started_at, duration) in zip(run_ids, run_times)
+        for _ in range(events_per_run)
+    ]
+    _insert_batched(db, models.RunEvent, event_rows)
+    db.commit()
+    return {"players": len(player_rows), "runs": len(run_rows), "events": len(event_rows)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a database with benchmark data.")
+    parser.add_argument("--database-url", default="sqlite:///./bench.db")
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--runs-per-player", type=int, default=10)
+    parser.add_argument("--upgrades-per-run", type=int, default=3)
+    parser.add_argument("--events-per-run", type=int, default=20)
+    parser.add_argument("--random-seed", type=int, default=0)
+    args = parser.parse_args()
+
+    connect_args = {"check_same_thread": False} if args.database_url.startswith("sqlite") else {}
+    engine = create_engine(args.database_url, connect_args=connect_args)
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    try:
+        counts = seed(
+            db,
+            players=args.players,
+            runs_per_player=args.runs_per_player,
+            upgrades_per_run=args.upgrades_per_run,
+            events_per_run=args.events_per_run,
+            random_seed=args.random_seed,
+        )
+    finally:
+        db.close()
+    print(f"Seeded {counts['players']} players, {counts['runs']} runs and {counts['events']} events")
+
+if __name__ == "__main__":
+    main()
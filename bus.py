@@ -0,0 +1,153 @@
+# This file provides the change bus that keeps the in-memory state of
+# several worker processes coherent. Each worker builds its own indexes
+# (leaderboards, rankings, name filters, sketches) and caches, and shares
+# nothing else with the others. Whenever a worker commits a write that
+# those indexes depend on, the `crud` write path publishes a message in the
+# same transaction, as a row of the `change_log` table. Every worker polls
+# the table and applies the messages of the other workers through the
+# handlers `crud` registers, which are the same hooks that update the
+# publishing worker's own indexes.
+#
+# The bus is off unless `change_bus_enabled` is set, so a single process
+# pays nothing for it. It relies on SQLite committing one writer at a time,
+# so message IDs become visible in order and a poller never skips one.
+
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, sessionmaker
+
+import indexes
+import models
+import swr
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Session, dict], None]
+
+_handlers: Dict[str, Handler] = {}
+
+def handler(topic: str) -> Callable[[Handler], Handler]:
+    """
+    Registers the function that applies a topic's messages from other workers.
+    """
+    def register(func: Handler) -> Handler:
+        _handlers[topic] = func
+        return func
+    return register
+
+def worker_id() -> str:
+    """
+    Identifies this worker process. Worked out on each call, since workers
+    forked from a preloaded app share the parent's module state.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def publish(db: Session, topic: str, payload: dict):
+    """
+    Adds a message to the session's transaction, so that other workers see
+    it exactly when, and only if, the change itself commits.
+    """
+    if settings.change_bus_enabled:
+        db.add(models.ChangeMessage(topic=topic, payload=payload, origin=worker_id()))
+
+class Listener:
+    """
+    Polls the change log on a background thread and applies the messages
+    published by other workers.
+    """
+
+    def __init__(self):
+        self._session_factory: Optional[sessionmaker] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._last_id = 0
+        self._polled_at = time.monotonic()
+        self._pruned_at = 0.0
+
+    def start(self, bind):
+        """
+        Starts polling from the newest message. Called before the indexes
+        are built, so no change is missed between building and polling; a
+        change seen by both is harmless, as applying it again leaves the
+        indexes as they were (the quantile sketches, which are estimates
+        anyway, may count such a run twice).
+        """
+        self._session_factory = sessionmaker(bind=bind)
+        with self._session_factory() as db:
+            self._last_id = db.query(func.max(models.ChangeMessage.id)).scalar() or 0
+        self._polled_at = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="change-bus", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(settings.change_bus_poll_interval_seconds):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Polling the change bus failed")
+
+    def poll(self) -> int:
+        """
+        Applies every message other workers have published since the last
+        poll, and returns how many were applied.
+        """
+        now = time.monotonic()
+        if now - self._polled_at > settings.change_bus_retention_seconds / 2:
+            # Messages may have been pruned before this worker saw them, so
+            # its state is rebuilt from the database instead.
+            logger.warning("Change bus fell behind; rebuilding in-memory indexes")
+            indexes.reset_all()
+            swr.invalidate_all()
+        self._polled_at = now
+
+        applied = 0
+        own = worker_id()
+        with self._session_factory() as db:
+            while True:
+                messages = (
+                    db.query(models.ChangeMessage)
+                    .filter(models.ChangeMessage.id > self._last_id)
+                    .order_by(models.ChangeMessage.id)
+                    .limit(1000)
+                    .all()
+                )
+                if not messages:
+                    break
+                for message in messages:
+                    self._last_id = message.id
+                    if message.origin == own or message.topic not in _handlers:
+                        continue
+                    try:
+                        _handlers[message.topic](db, message.payload)
+                    except Exception:
+                        logger.exception("Applying change %s (%s) failed", message.id, message.topic)
+                    applied += 1
+            if applied:
+                swr.invalidate_all()
+            self._prune_if_due(db, now)
+        return applied
+
+    def _prune_if_due(self, db: Session, now: float):
+        if now - self._pruned_at < settings.change_bus_retention_seconds / 10:
+            return
+        self._pruned_at = now
+        cutoff = datetime.datetime.now() - datetime.timedelta(seconds=settings.change_bus_retention_seconds)
+        db.query(models.ChangeMessage).filter(models.ChangeMessage.created_at < cutoff).delete(synchronize_session=False)
+        db.commit()
+
+listener = Listener()
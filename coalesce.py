@@ -0,0 +1,125 @@
+# This file coalesces identical concurrent reads. When many clients ask
+# for the same thing at once, such as the leaderboard right after a popular
+# run ends, the first request (the leader) runs the query and every request
+# that arrives while it is in flight waits for and shares its result, so a
+# thundering herd costs one database query instead of hundreds.
+#
+# Results are only shared while a computation is in flight; nothing is
+# cached once it finishes, so a read never sees data older than itself.
+
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from fastapi import Request
+
+import metrics
+from config import settings
+
+class SingleFlight:
+    """
+    Runs at most one computation per key at a time. Safe to use from the
+    threadpool (`do`) and from the event loop (`do_async`) together.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, concurrent.futures.Future] = {}
+
+    def _join(self, key: Hashable):
+        """
+        Returns the in-flight future for a key, and whether the caller has
+        just created it and so must compute the result.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = self._calls[key] = concurrent.futures.Future()
+            return future, True
+
+    def _finish(self, key: Hashable, future: concurrent.futures.Future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def do(self, key: Hashable, func: Callable[[], Any], timeout: Optional[float] = None, on_shared: Optional[Callable[[], None]] = None):
+        """
+        Returns `func()`, sharing the result with identical concurrent
+        calls. A caller that waits longer than `timeout` seconds for
+        another caller's result stops waiting and computes its own.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            try:
+                result = future.result(timeout=timeout)
+            except concurrent.futures.TimeoutError:
+                return func()
+            if on_shared:
+                on_shared()
+            return result
+        try:
+            result = func()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._finish(key, future)
+
+    async def do_async(self, key: Hashable, func: Callable[[], Awaitable[Any]], timeout: Optional[float] = None, on_shared: Optional[Callable[[], None]] = None):
+        """
+        The same as `do`, for a coroutine function.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            try:
+                result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+            except asyncio.TimeoutError:
+                return await func()
+            if on_shared:
+                on_shared()
+            return result
+        try:
+            result = await func()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._finish(key, future)
+
+flights = SingleFlight()
+
+def request_key(request: Request) -> tuple:
+    """
+    Identifies a read by its route, path and query parameters, so requests
+    only share a result if they asked for exactly the same thing.
+    """
+    return (request.method, request.url.path, tuple(sorted(request.query_params.multi_items())))
+
+def _count_shared(request: Request):
+    route = getattr(request.scope.get("route"), "path", request.url.path)
+    return lambda: metrics.record_coalesced(request.method, route)
+
+def coalesced(request: Request, func: Callable[[], Any], timeout: Optional[float] = None):
+    """
+    Runs `func` for a request, sharing the result with identical requests
+    in flight. `timeout` defaults to `coalesce_timeout_seconds`.
+    """
+    if timeout is None:
+        timeout = settings.coalesce_timeout_seconds
+    return flights.do(request_key(request), func, timeout, on_shared=_count_shared(request))
+
+async def coalesced_async(request: Request, func: Callable[[], Awaitable[Any]], timeout: Optional[float] = None):
+    """
+    The same as `coalesced`, for async endpoints.
+    """
+    if timeout is None:
+        timeout = settings.coalesce_timeout_seconds
+    return await flights.do_async(request_key(request), func, timeout, on_shared=_count_shared(request))
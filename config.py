@@ -1,9 +1,153 @@
 from pydantic_settings import BaseSettings
 from pydantic import ConfigDict
+from typing import Dict, Optional
 
 class Settings(BaseSettings):
     database_url: str = "sqlite:///./coursework1.db"
 
+    # Create and upgrade the tables when the app starts. Turn this off when
+    # running several workers, and run `python migrate.py` once beforehand.
+    migrate_on_startup: bool = True
+
+    # Bulk deletes are split into chunks, each committed in its own short
+    # transaction, with a pause in between so other writers can get in.
+    bulk_delete_chunk_size: int = 500
+    bulk_delete_pause_seconds: float = 0.01
+
+    # Finished runs older than `retention_max_age_days`, or beyond a player's
+    # `retention_max_runs_per_player` most recent runs, are moved into
+    # compressed files under `archive_dir`. Either limit may be left unset.
+    # The longest `retention_keep_top_runs` runs, overall and on each map,
+    # and runs from the current week are never archived, so the
+    # leaderboards are unaffected.
+    retention_max_age_days: Optional[int] = None
+    retention_max_runs_per_player: Optional[int] = None
+    retention_keep_top_runs: int = 100
+    archive_dir: str = "./archive"
+
+    # With `archive_partitioned`, archived runs are moved into one SQLite
+    # file per month under `partition_dir` instead, where they can still be
+    # queried by date range, and months that ended more than
+    # `partition_max_age_months` months ago are dropped by the retention job.
+    archive_partitioned: bool = False
+    partition_dir: str = "./partitions"
+    partition_max_age_months: Optional[int] = None
+    # With `partition_live_events`, the packed events of finished runs are
+    # kept in the partition of the month each run started, rather than in
+    # the database. Only archived runs and these packs are partitioned:
+    # live runs and the events of runs in progress stay in the database,
+    # and a month is not dropped while it holds the packs of live runs.
+    partition_live_events: bool = False
+
+    # The number of runs kept in memory for each windowed leaderboard.
+    leaderboard_capacity: int = 100
+
+    # The Bloom filter behind the username check is sized for at least
+    # `name_filter_capacity` names, and rebuilt once deleted or renamed
+    # names make up more than `name_filter_max_stale_fraction` of it.
+    name_filter_capacity: int = 100_000
+    name_filter_error_rate: float = 0.01
+    name_filter_max_stale_fraction: float = 0.1
+
+    # How long a request waits for an identical in-flight request's result
+    # before giving up and running its own query.
+    coalesce_timeout_seconds: float = 5.0
+
+    # Requests are served in lanes by route group. Each lane admits at most
+    # its limit of requests at once and has a database pool of that size;
+    # a request that queues for longer than its lane's timeout gets a 503.
+    lane_limits: Dict[str, int] = {"gameplay": 16, "auth": 4, "analytics": 8, "admin": 2}
+    lane_queue_timeouts: Dict[str, float] = {"gameplay": 5.0, "auth": 10.0, "analytics": 3.0, "admin": 30.0}
+
+    # Token-bucket rate limits per route group: each client IP (or client
+    # IP and player name, for "player") may make `rate_limit_bursts`
+    # requests at once, refilled at `rate_limit_rates` per second. The
+    # buckets are kept in memory, or shared between workers in
+    # `rate_limit_sqlite_path` with the "sqlite" backend.
+    rate_limit_enabled: bool = True
+    rate_limit_rates: Dict[str, float] = {"name_check": 5.0, "generate_name": 1.0, "auth": 2.0, "player": 1.0}
+    rate_limit_bursts: Dict[str, int] = {"name_check": 20, "generate_name": 10, "auth": 30, "player": 10}
+    rate_limit_backend: str = "memory"
+    rate_limit_sqlite_path: str = "./ratelimit.db"
+
+    # Analytics results served stale-while-revalidate: a result is fresh for
+    # `swr_fresh_seconds`, after which it is served while being refreshed in
+    # the background, up to `swr_max_stale_seconds` old. Keyed by endpoint.
+    swr_fresh_seconds: Dict[str, float] = {"leaderboard": 5.0, "players_summary": 30.0}
+    swr_max_stale_seconds: Dict[str, float] = {"leaderboard": 300.0, "players_summary": 600.0}
+    # How long those reads and refreshes wait for a locked database before
+    # giving up, leaving the stale result in place.
+    swr_lock_timeout_seconds: float = 0.5
+
+    # Tombstones of deleted players and runs are kept this long for delta
+    # sync clients, and pruned by the retention job.
+    sync_tombstone_max_age_days: int = 30
+
+    # Pack the events of finished runs into one compressed blob per run.
+    pack_finished_run_events: bool = True
+
+    # Quantile sketches keep about `sketch_k` values per level (larger is
+    # more accurate), are saved every `sketch_persist_interval_seconds`,
+    # and are cached for at most `sketch_player_cache_size` players.
+    sketch_k: int = 200
+    sketch_persist_interval_seconds: float = 60.0
+    sketch_player_cache_size: int = 10_000
+
+    # Active-player sketches have 2 ** `activity_precision` registers
+    # (about 1.6% error at 12) and are saved every
+    # `activity_persist_interval_seconds`.
+    activity_precision: int = 12
+    activity_persist_interval_seconds: float = 60.0
+
+    # Multi-worker mode: each worker publishes its writes to the change log
+    # and polls it every `change_bus_poll_interval_seconds` to keep its
+    # in-memory indexes and caches coherent. Messages are kept for
+    # `change_bus_retention_seconds`.
+    change_bus_enabled: bool = False
+    change_bus_poll_interval_seconds: float = 0.5
+    change_bus_retention_seconds: float = 3600.0
+
+    # SQLite journal mode set on every connection, such as "wal", which lets
+    # several worker processes read while one of them writes.
+    sqlite_journal_mode: Optional[str] = None
+
+    # Analytics and list endpoints read from `replica_database_url`, or from
+    # a copy of the SQLite database at `replica_snapshot_path` refreshed
+    # every `replica_snapshot_interval_seconds` (copying
+    # `replica_snapshot_pages` pages at a time, or restoring the newest
+    # backup with `replica_from_backups`). They fall back to the
+    # primary when the replica is more than `replica_max_lag_seconds`
+    # behind, which is checked every `replica_lag_check_interval_seconds`.
+    replica_database_url: Optional[str] = None
+    replica_snapshot_path: Optional[str] = None
+    replica_snapshot_interval_seconds: float = 30.0
+    replica_snapshot_pages: int = 1024
+    replica_from_backups: bool = False
+    replica_max_lag_seconds: float = 60.0
+    replica_lag_check_interval_seconds: float = 1.0
+
+    # Online backups are copied `backup_pages` pages at a time, pausing
+    # `backup_sleep_seconds` between steps so writers are not held up, and
+    # stored gzipped with a checksum in `backup_dir`, keeping the newest
+    # `backup_keep`. With `backup_interval_hours`, they are also taken on
+    # that schedule.
+    backup_dir: str = "./backups"
+    backup_pages: int = 256
+    backup_sleep_seconds: float = 0.005
+    backup_keep: int = 7
+    backup_interval_hours: Optional[float] = None
+
+    # Runs longer than this share the top rank bucket in the rank index,
+    # which bounds its memory use.
+    rank_max_duration_seconds: int = 24 * 60 * 60
+
+    # Diagnostics mode logs every query slower than the threshold and lets
+    # admins profile a request by sending an `X-Profile` header. It can
+    # also be switched on at runtime through `/admin/diagnostics`.
+    diagnostics_enabled: bool = False
+    slow_query_threshold_ms: float = 100.0
+    profile_interval_seconds: float = 0.002
+
     model_config = ConfigDict(env_file=".env")
 
 settings = Settings()
\ No newline at end of file
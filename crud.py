@@ -2,18 +2,34 @@
 # operations for interacting with the database. It acts as a bridge
 # between the API endpoints and the database models.
 
-from sqlalchemy.orm import Session, joinedload
-from typing import List, Optional
+from sqlalchemy import exists, func, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from typing import Callable, Iterator, List, Optional
 from collections import Counter
 import datetime
+import time
 from datetime import timezone
 
+import activity
+import bus
+import event_store
+import indexes
+import leaderboards
 import models
+import name_filter
+import name_search
+import partitions
+import rankings
 import schemas
+import sketches
+import sync
+import timeseries
 import name_pool
 import secrets
 import string
 from auth import get_password_hash
+from config import settings
 
 def generate_random_password(length: int = 12) -> str:
     """
@@ -27,15 +43,23 @@ def generate_random_password(length: int = 12) -> str:
 def create_player(db: Session, player: schemas.PlayerCreate):
     """
     Creates a new player with a randomly generated password.
-    The password is then hashed before being stored.
+    The password is then hashed before being stored. Raises IntegrityError
+    if the name is taken.
     """
     plain_password = generate_random_password()
     hashed_password = get_password_hash(plain_password)
     
     db_player = models.Player(name=player.name, hashed_password=hashed_password)
     db.add(db_player)
+    try:
+        db.flush()
+    except IntegrityError:
+        _on_name_conflict(db, player.name)
+        raise
+    bus.publish(db, "player_saved", {"player_id": db_player.id, "name": db_player.name})
     db.commit()
     db.refresh(db_player)
+    _on_player_saved(db_player.id, db_player.name)
     
     # Return a response object that includes the plain-text password
     return schemas.PlayerCreateResponse(
@@ -48,14 +72,22 @@ def create_player(db: Session, player: schemas.PlayerCreate):
 def create_player_with_password(db: Session, player_name: str, plain_password: str):
     """
     Creates a new player with a user-provided password.
-    The password is hashed before being stored.
+    The password is hashed before being stored. Raises IntegrityError if
+    the name is taken.
     """
     hashed_password = get_password_hash(plain_password)
     
     db_player = models.Player(name=player_name, hashed_password=hashed_password)
     db.add(db_player)
+    try:
+        db.flush()
+    except IntegrityError:
+        _on_name_conflict(db, player_name)
+        raise
+    bus.publish(db, "player_saved", {"player_id": db_player.id, "name": db_player.name})
     db.commit()
     db.refresh(db_player)
+    _on_player_saved(db_player.id, db_player.name)
     
     return db_player
 
@@ -65,50 +97,96 @@ def get_player(db: Session, player_id: int):
     """
     return db.query(models.Player).filter(models.Player.id == player_id).first()
 
+def get_players(db: Session, skip: int = 0, limit: int = 100):
+    """
+    Retrieves a list of all players with pagination.
+    """
+    return db.query(models.Player).offset(skip).limit(limit).all()
+
 def get_player_by_name(db: Session, name: str):
     """
     Retrieves a single player by their unique name.
     """
     return db.query(models.Player).filter(models.Player.name == name).first()
 
+def player_name_exists(db: Session, name: str) -> bool:
+    """
+    Checks whether a player name is taken. Most free names are ruled out
+    by the in-memory name filter; the rest are confirmed with an indexed
+    EXISTS query rather than by loading the player.
+    """
+    if not name_filter.index.might_exist(db, name):
+        return False
+    return db.query(exists().where(models.Player.name == name)).scalar()
+
 def update_player_name(db: Session, player_id: int, new_name: str):
     """
-    Updates a player's name.
+    Updates a player's name. Raises IntegrityError if the name is taken.
     """
     db_player = db.query(models.Player).filter(models.Player.id == player_id).first()
     if db_player:
         db_player.name = new_name
+        try:
+            db.flush()
+        except IntegrityError:
+            _on_name_conflict(db, new_name)
+            raise
+        bus.publish(db, "player_renamed", {"player_id": player_id, "name": new_name})
         db.commit()
         db.refresh(db_player)
+        _on_player_renamed(player_id, new_name)
         return db_player
     return None
 
 def delete_player(db: Session, player_id: int):
     """
     Deletes a player and all of their associated runs and run events.
-    This ensures that no orphaned data is left in the database.
+    This ensures that no orphaned data is left in the database. Everything
+    is removed in one transaction, so a failure never leaves the player
+    with only some of their runs; the chunked, paused deletes are left to
+    the background bulk jobs.
     """
     db_player = db.query(models.Player).filter(models.Player.id == player_id).first()
     if db_player:
-        # Cascade delete to runs and their events
-        db.query(models.Run).filter(models.Run.player_id == player_id).delete()
+        run_ids = [run_id for run_id, in db.query(models.Run.id).filter(models.Run.player_id == player_id)]
+        # Chunked only to bound the number of bound parameters per statement.
+        for chunk in _chunked(run_ids, settings.bulk_delete_chunk_size):
+            _delete_runs_by_ids(db, chunk)
         db.delete(db_player)
+        bus.publish(db, "players_deleted", {"player_ids": [player_id], "removed": 1})
         db.commit()
+        _on_players_deleted([player_id], 1)
         return db_player
     return None
 
+def _on_name_conflict(db: Session, name: str):
+    """
+    Rolls back an insert or rename that hit the unique constraint on
+    `players.name`. This happens when another worker took the name after
+    it was checked, before the change bus told this worker's name filter,
+    so the filter is told here.
+    """
+    db.rollback()
+    name_filter.index.add(name)
+
 # --- Name Generation and Validation ---
 
 def check_player_name(db: Session, player_name: str):
     """
     Checks if a player name already exists in the database.
     """
-    player = get_player_by_name(db, name=player_name)
-    if player:
+    if player_name_exists(db, player_name):
         return {"exists": True, "message": "This username is already taken."}
     else:
         return {"exists": False, "message": "This username is available."}
 
+def search_player_names(db: Session, query: str, limit: int = 10) -> List[schemas.PlayerMatch]:
+    """
+    Returns players whose names, or a word within them, start with the
+    query, for typeahead search.
+    """
+    return [schemas.PlayerMatch(id=player_id, name=name) for player_id, name in name_search.index.search(db, query, limit)]
+
 def get_all_player_names(db: Session) -> list[str]:
     """
     Returns a list of all player names currently in the database.
@@ -127,45 +205,74 @@ def generate_available_player_name(db: Session) -> str:
 def get_players_summary(db: Session, search: Optional[str] = None):
     """
     Retrieves a summary for each player, including their total number of runs
-    and their best run time. Can be filtered by a search term.
-    """
-    query = db.query(models.Player).options(joinedload(models.Player.runs))
-    
+    and their best run time. Can be filtered by a search term. Runs are
+    aggregated by the database and only the needed columns are read, so no
+    ORM objects are loaded.
+    """
+    run_totals = (
+        db.query(
+            models.Run.player_id,
+            func.count(models.Run.id).label("runs"),
+            func.max(models.Run.duration_seconds).label("longest_run"),
+        )
+        .group_by(models.Run.player_id)
+        .subquery()
+    )
+    query = (
+        db.query(
+            models.Player.id,
+            models.Player.name,
+            models.Player.created_at,
+            run_totals.c.runs,
+            run_totals.c.longest_run,
+            models.PlayerArchiveStats.runs.label("archived_runs"),
+            models.PlayerArchiveStats.longest_run.label("archived_longest_run"),
+        )
+        .outerjoin(run_totals, run_totals.c.player_id == models.Player.id)
+        .outerjoin(models.PlayerArchiveStats, models.PlayerArchiveStats.player_id == models.Player.id)
+        .order_by(models.Player.id)
+    )
+
     if search:
         query = query.filter(models.Player.name.contains(search))
-        
-    players = query.all()
-    
-    summaries = []
-    for player in players:
-        total_runs = len(player.runs)
-        best_run_time = 0
-        if player.runs:
-            best_run_time = max(run.duration_seconds for run in player.runs)
-            
-        summary = schemas.PlayerSummary(
-            id=player.id,
-            name=player.name,
-            created_at=player.created_at,
-            total_runs=total_runs,
-            best_run_time=best_run_time
+
+    # Rows are trusted database values, so the schemas are built without
+    # validation.
+    return [
+        schemas.PlayerSummary.model_construct(
+            name=row.name,
+            id=row.id,
+            created_at=row.created_at,
+            # Fold in the runs that have been moved to the archive.
+            total_runs=(row.runs or 0) + (row.archived_runs or 0),
+            best_run_time=max(row.longest_run or 0, row.archived_longest_run or 0),
         )
-        summaries.append(summary)
-        
-    return summaries
+        for row in query
+    ]
 
 def get_player_stats(db: Session, player_id: int):
     """
     Calculates and retrieves detailed statistics for a single player,
     including total runs, time played, average survival time, longest run,
-    total kills, and their most frequently chosen upgrade.
+    total kills, and their most frequently chosen upgrade. Everything is
+    computed with SQL aggregates, so no run rows are loaded.
     """
-    player = db.query(models.Player).options(joinedload(models.Player.runs)).filter(models.Player.id == player_id).first()
+    player = db.query(models.Player).filter(models.Player.id == player_id).first()
     if not player:
         return None
 
-    runs = player.runs
-    total_runs = len(runs)
+    run_count, total_time_played, longest_run, total_monsters_slain = (
+        db.query(
+            func.count(models.Run.id),
+            func.coalesce(func.sum(models.Run.duration_seconds), 0),
+            func.coalesce(func.max(models.Run.duration_seconds), 0),
+            func.coalesce(func.sum(models.Run.kills_total), 0),
+        )
+        .filter(models.Run.player_id == player_id)
+        .one()
+    )
+    archived = player.archive_stats
+    total_runs = run_count + (archived.runs if archived else 0)
     if total_runs == 0:
         # Return a default stats object if the player has no runs
         return schemas.PlayerStats(
@@ -178,21 +285,28 @@ def get_player_stats(db: Session, player_id: int):
             favourite_upgrade=None
         )
 
-    total_time_played = sum(run.duration_seconds for run in runs)
+    if archived:
+        total_time_played += archived.total_duration_seconds
+        longest_run = max(longest_run, archived.longest_run)
+        total_monsters_slain += archived.total_kills
     average_time_survived = total_time_played / total_runs
-    longest_run = max(run.duration_seconds for run in runs)
-    total_monsters_slain = sum(run.kills_total for run in runs)
 
-    # Determine the player's favorite upgrade by counting all upgrades across all runs
-    all_upgrades = []
-    for run in runs:
-        if run.upgrades:
-            for upgrade, level in run.upgrades.items():
-                all_upgrades.extend([upgrade] * level)
+    # Determine the player's favorite upgrade by summing the levels of each
+    # upgrade across all of their runs, including archived ones.
+    all_upgrades = Counter(dict(
+        db.query(models.RunUpgrade.upgrade, func.sum(models.RunUpgrade.level))
+        .join(models.Run, models.Run.id == models.RunUpgrade.run_id)
+        .filter(models.Run.player_id == player_id, models.RunUpgrade.level > 0)
+        .group_by(models.RunUpgrade.upgrade)
+        .all()
+    ))
+    for archived_upgrade in player.archive_upgrades:
+        all_upgrades[archived_upgrade.upgrade] += archived_upgrade.levels
     
     favourite_upgrade = None
     if all_upgrades:
-        favourite_upgrade = Counter(all_upgrades).most_common(1)[0][0]
+        # Ties are broken alphabetically so the result is stable.
+        favourite_upgrade = min(all_upgrades, key=lambda upgrade: (-all_upgrades[upgrade], upgrade))
 
     return schemas.PlayerStats(
         player_name=player.name,
@@ -204,23 +318,94 @@ def get_player_stats(db: Session, player_id: int):
         favourite_upgrade=favourite_upgrade
     )
 
+def get_upgrade_effectiveness(db: Session, player_id: Optional[int] = None) -> List[schemas.UpgradeEffectiveness]:
+    """
+    Summarizes how runs went for each upgrade: how many runs picked it, the
+    average level it reached, and the average survival time and kills of
+    those runs. Can be limited to a single player's runs.
+    """
+    query = (
+        db.query(
+            models.RunUpgrade.upgrade,
+            func.count(models.RunUpgrade.run_id),
+            func.avg(models.RunUpgrade.level),
+            func.avg(models.Run.duration_seconds),
+            func.avg(models.Run.kills_total),
+        )
+        .join(models.Run, models.Run.id == models.RunUpgrade.run_id)
+        .filter(models.RunUpgrade.level > 0)
+    )
+    if player_id is not None:
+        query = query.filter(models.Run.player_id == player_id)
+    rows = query.group_by(models.RunUpgrade.upgrade).order_by(func.count(models.RunUpgrade.run_id).desc(), models.RunUpgrade.upgrade)
+
+    return [
+        schemas.UpgradeEffectiveness(
+            upgrade=upgrade,
+            runs=runs,
+            average_level=average_level,
+            average_duration_seconds=average_duration or 0.0,
+            average_kills=average_kills or 0.0,
+        )
+        for upgrade, runs, average_level, average_duration, average_kills in rows
+    ]
+
+def get_windowed_leaderboard(
+    db: Session,
+    window: schemas.LeaderboardWindow,
+    map_id: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 10,
+) -> List[schemas.RunLeaderboard]:
+    """
+    Retrieves the best finished runs of the current day, week or all time,
+    on a single map or across all maps. These are served from the
+    in-memory leaderboards rather than by sorting the `runs` table.
+    """
+    return leaderboards.index.top(db, window, map_id=map_id, skip=skip, limit=limit)
+
+def get_run_rank(db: Session, run_id: int) -> Optional[schemas.RunRank]:
+    """
+    Retrieves where a finished run places by duration, overall and on its
+    map, from the in-memory rank index.
+    """
+    return rankings.index.run_rank(db, run_id)
+
+def get_player_rank(db: Session, player_id: int) -> Optional[schemas.PlayerRank]:
+    """
+    Retrieves where a player's best finished run places them among all
+    players, overall and on each map, from the in-memory rank index.
+    """
+    return rankings.index.player_rank(db, player_id)
+
 def get_leaderboard(db: Session, skip: int = 0, limit: int = 10) -> List[schemas.RunLeaderboard]:
     """
     Retrieves the top runs for the leaderboard, sorted by duration in
     descending order.
     """
-    runs = db.query(models.Run).order_by(models.Run.duration_seconds.desc()).offset(skip).limit(limit).all()
-    
-    leaderboard_entries = []
-    for run in runs:
-        leaderboard_entries.append(schemas.RunLeaderboard(
-            player_id=run.player.id,
-            run_id=run.id,
-            player_name=run.player.name,
-            duration_seconds=run.duration_seconds,
-            total_kills=run.kills_total
-        ))
-    return leaderboard_entries
+    rows = (
+        db.query(
+            models.Run.player_id,
+            models.Run.id,
+            models.Player.name,
+            models.Run.duration_seconds,
+            models.Run.kills_total,
+        )
+        .join(models.Player, models.Player.id == models.Run.player_id)
+        .order_by(models.Run.duration_seconds.desc())
+        .offset(skip)
+        .limit(limit)
+    )
+    return [
+        schemas.RunLeaderboard.model_construct(
+            player_id=player_id,
+            run_id=run_id,
+            player_name=player_name,
+            duration_seconds=duration_seconds,
+            total_kills=kills_total,
+        )
+        for player_id, run_id, player_name, duration_seconds, kills_total in rows
+    ]
 
 # --- Run Operations ---
 
@@ -230,8 +415,52 @@ def create_run(db: Session, run: schemas.RunCreate):
     """
     db_run = models.Run(player_id=run.player_id, map_id=run.map_id)
     db.add(db_run)
+    db.flush()
+    bus.publish(db, "run_started", {"run_id": db_run.id})
     db.commit()
     db.refresh(db_run)
+    _on_run_started(db, db_run)
+    return db_run
+
+def submit_run(db: Session, player: models.Player, submission: schemas.RunSubmit) -> models.Run:
+    """
+    Records a complete, finished run with its upgrades and events in a
+    single transaction. The events are written with one bulk insert.
+    """
+    ended_at = submission.ended_at or datetime.datetime.now(timezone.utc)
+    # Like runs started live, a run is dated by the server's local clock.
+    started_at = submission.started_at or datetime.datetime.now() - datetime.timedelta(seconds=submission.duration_seconds)
+    db_run = models.Run(
+        player_id=player.id,
+        map_id=submission.map_id,
+        started_at=started_at,
+        ended_at=ended_at,
+        status=submission.status,
+        duration_seconds=submission.duration_seconds,
+        level=submission.level,
+        xp=submission.xp,
+        kills_total=submission.kills_total,
+        upgrades=submission.upgrades,
+        cause_of_death=submission.cause_of_death,
+    )
+    db.add(db_run)
+    db.flush()
+    for upgrade, level in (submission.upgrades or {}).items():
+        db.add(models.RunUpgrade(run_id=db_run.id, upgrade=upgrade, level=level))
+    timeseries.record_sample(db, db_run)
+    if submission.events:
+        db.execute(insert(models.RunEvent), [
+            {"run_id": db_run.id, "event_type": event.event_type, "value": event.value, "timestamp": event.timestamp or ended_at}
+            for event in submission.events
+        ])
+        event_store.pack_run_events(db, db_run)
+    bus.publish(db, "run_started", {"run_id": db_run.id})
+    bus.publish(db, "run_finished", {"run_id": db_run.id, "ended": True})
+    db.commit()
+    db.refresh(db_run)
+    _on_run_started(db, db_run)
+    _on_run_finished(db_run)
+    _on_run_ended(db, db_run)
     return db_run
 
 def get_run(db: Session, run_id: int):
@@ -240,17 +469,64 @@ def get_run(db: Session, run_id: int):
     """
     return db.query(models.Run).filter(models.Run.id == run_id).first()
 
-def get_runs(db: Session, skip: int = 0, limit: int = 100):
+# The columns read for run listings, in the order `_run_from_row` expects.
+_RUN_LIST_COLUMNS = (
+    models.Run.id,
+    models.Run.player_id,
+    models.Run.map_id,
+    models.Run.started_at,
+    models.Run.status,
+    models.Run.duration_seconds,
+    models.Run.level,
+    models.Run.xp,
+    models.Run.kills_total,
+    models.Run.upgrades,
+    models.Run.ended_at,
+    models.Run.cause_of_death,
+    models.Player.name,
+    models.Player.created_at,
+)
+
+def _run_from_row(row) -> schemas.Run:
+    """
+    Builds a run schema from a row of `_RUN_LIST_COLUMNS` without
+    validation, as the values come straight from the database.
+    """
+    (run_id, player_id, map_id, started_at, status, duration_seconds, level, xp,
+     kills_total, upgrades, ended_at, cause_of_death, player_name, player_created_at) = row
+    player = schemas.Player.model_construct(name=player_name, id=player_id, created_at=player_created_at)
+    return schemas.Run.model_construct(
+        player_id=player_id,
+        map_id=map_id,
+        id=run_id,
+        player=player,
+        started_at=started_at,
+        status=status,
+        duration_seconds=duration_seconds,
+        level=level,
+        xp=xp,
+        kills_total=kills_total,
+        upgrades=upgrades,
+        ended_at=ended_at,
+        cause_of_death=cause_of_death,
+    )
+
+def _run_list_query(db: Session):
+    return db.query(*_RUN_LIST_COLUMNS).join(models.Player, models.Player.id == models.Run.player_id).order_by(models.Run.id)
+
+def get_runs(db: Session, skip: int = 0, limit: int = 100) -> List[schemas.Run]:
     """
-    Retrieves a list of all runs with pagination.
+    Retrieves a list of all runs with pagination. Only the listed columns
+    are read, rather than loading each run and its player into the session.
     """
-    return db.query(models.Run).offset(skip).limit(limit).all()
+    return [_run_from_row(row) for row in _run_list_query(db).offset(skip).limit(limit)]
 
-def get_runs_by_player(db: Session, player_id: int, skip: int = 0, limit: int = 100):
+def get_runs_by_player(db: Session, player_id: int, skip: int = 0, limit: int = 100) -> List[schemas.Run]:
     """
     Retrieves all runs for a specific player with pagination.
     """
-    return db.query(models.Run).filter(models.Run.player_id == player_id).offset(skip).limit(limit).all()
+    query = _run_list_query(db).filter(models.Run.player_id == player_id)
+    return [_run_from_row(row) for row in query.offset(skip).limit(limit)]
 
 def update_run(db: Session, run_id: int, run_update: schemas.RunUpdate):
     """
@@ -259,15 +535,166 @@ def update_run(db: Session, run_id: int, run_update: schemas.RunUpdate):
     """
     db_run = get_run(db, run_id)
     if db_run:
+        was_finished = db_run.status in models.TERMINAL_STATUSES
         update_data = run_update.model_dump(exclude_unset=True)
         for key, value in update_data.items():
             setattr(db_run, key, value)
+        if 'upgrades' in update_data:
+            _sync_run_upgrades(db, db_run.id, update_data['upgrades'] or {})
         if 'status' in update_data and update_data['status'] in ['died', 'completed']:
             db_run.ended_at = datetime.datetime.now(timezone.utc)
+        timeseries.record_sample(db, db_run)
+        if db_run.status in models.TERMINAL_STATUSES:
+            event_store.pack_run_events(db, db_run)
+            bus.publish(db, "run_finished", {"run_id": db_run.id, "ended": not was_finished})
         db.commit()
         db.refresh(db_run)
+        if db_run.status in models.TERMINAL_STATUSES:
+            _on_run_finished(db_run)
+            if not was_finished:
+                _on_run_ended(db, db_run)
     return db_run
 
+def _on_run_finished(db_run: models.Run):
+    """
+    Tells the in-memory indexes about a run that has finished, or a
+    finished run whose stats have changed. Called after committing.
+    """
+    leaderboards.index.record(db_run)
+    rankings.index.record(db_run)
+
+def _on_run_started(db: Session, db_run: models.Run):
+    """
+    Counts the run's player as active on its day and map. Called after
+    committing.
+    """
+    activity.index.record(db_run)
+    activity.index.persist_if_due(db.get_bind())
+
+def _on_run_ended(db: Session, db_run: models.Run):
+    """
+    Tells the quantile sketches and map curves about a run that has just
+    reached a terminal status, which happens once per run. Called after
+    committing.
+    """
+    sketches.index.record(db_run)
+    timeseries.curves.record(db_run)
+    sketches.index.persist_if_due(db.get_bind())
+
+def _on_runs_deleted(run_ids: List[int]):
+    """
+    Tells the in-memory indexes about deleted runs. Called after committing.
+    """
+    leaderboards.index.discard_runs(run_ids)
+    rankings.index.discard_runs(run_ids)
+    timeseries.curves.reset()
+
+def _on_player_saved(player_id: int, name: str):
+    """
+    Tells the name indexes about a new player. Called after committing.
+    """
+    name_filter.index.add(name)
+    name_search.index.add(player_id, name)
+
+def _on_player_renamed(player_id: int, new_name: str):
+    """
+    Tells the in-memory indexes about a renamed player. Called after
+    committing.
+    """
+    leaderboards.index.rename_player(player_id, new_name)
+    name_filter.index.add(new_name)
+    name_filter.index.discard()
+    name_search.index.add(player_id, new_name)
+
+def _on_players_deleted(player_ids: List[int], removed: int):
+    """
+    Tells the in-memory indexes about deleted players, `removed` of which
+    actually existed. Called after committing.
+    """
+    name_filter.index.discard(removed)
+    name_search.index.discard_players(player_ids)
+    for player_id in player_ids:
+        sketches.index.discard_player(player_id)
+
+# --- Change Bus Handlers ---
+# In multi-worker mode, each write above is also published on the change
+# bus, and the other workers apply it through the same hooks, reloading any
+# run from the database.
+
+@bus.handler("player_saved")
+def _apply_player_saved(db: Session, payload: dict):
+    _on_player_saved(payload["player_id"], payload["name"])
+
+@bus.handler("player_renamed")
+def _apply_player_renamed(db: Session, payload: dict):
+    _on_player_renamed(payload["player_id"], payload["name"])
+
+@bus.handler("players_deleted")
+def _apply_players_deleted(db: Session, payload: dict):
+    _on_players_deleted(payload["player_ids"], payload["removed"])
+
+@bus.handler("run_started")
+def _apply_run_started(db: Session, payload: dict):
+    db_run = get_run(db, payload["run_id"])
+    if db_run:
+        _on_run_started(db, db_run)
+
+@bus.handler("run_finished")
+def _apply_run_finished(db: Session, payload: dict):
+    db_run = get_run(db, payload["run_id"])
+    if db_run and db_run.status in models.TERMINAL_STATUSES:
+        _on_run_finished(db_run)
+        if payload["ended"]:
+            _on_run_ended(db, db_run)
+
+@bus.handler("runs_deleted")
+def _apply_runs_deleted(db: Session, payload: dict):
+    _on_runs_deleted(payload["run_ids"])
+
+def _sync_run_upgrades(db: Session, run_id: int, upgrades: dict):
+    """
+    Brings a run's `run_upgrades` rows in line with its upgrades dictionary,
+    touching only the rows whose level has changed.
+    """
+    existing = {row.upgrade: row for row in db.query(models.RunUpgrade).filter(models.RunUpgrade.run_id == run_id)}
+    for upgrade, level in upgrades.items():
+        row = existing.pop(upgrade, None)
+        if row is None:
+            db.add(models.RunUpgrade(run_id=run_id, upgrade=upgrade, level=level))
+        elif row.level != level:
+            row.level = level
+    for row in existing.values():
+        db.delete(row)
+
+def backfill_run_upgrades(db: Session) -> int:
+    """
+    Fills `run_upgrades` from the upgrades JSON of runs that do not have any
+    rows yet, one chunk per transaction. Returns the number of runs copied.
+    """
+    has_rows = exists().where(models.RunUpgrade.run_id == models.Run.id)
+    copied = 0
+    last_run_id = 0
+    while True:
+        runs = (
+            db.query(models.Run.id, models.Run.upgrades)
+            .filter(models.Run.id > last_run_id, models.Run.upgrades.isnot(None), ~has_rows)
+            .order_by(models.Run.id)
+            .limit(settings.bulk_delete_chunk_size)
+            .all()
+        )
+        if not runs:
+            return copied
+        rows = [
+            {"run_id": run_id, "upgrade": upgrade, "level": level}
+            for run_id, upgrades in runs
+            for upgrade, level in (upgrades or {}).items()
+        ]
+        if rows:
+            db.execute(insert(models.RunUpgrade), rows)
+        db.commit()
+        copied += len(runs)
+        last_run_id = runs[-1].id
+
 def delete_run(db: Session, run_id: int):
     """
     Deletes a single run and all of its associated events.
@@ -275,11 +702,192 @@ def delete_run(db: Session, run_id: int):
     db_run = get_run(db, run_id)
     if db_run:
         # Cascade delete to associated run events
-        db.query(models.RunEvent).filter(models.RunEvent.run_id == run_id).delete()
-        db.delete(db_run)
+        _delete_runs_by_ids(db, [run_id])
         db.commit()
     return db_run
 
+# --- Run Event Operations ---
+
+def create_run_event(db: Session, run_id: int, event: schemas.RunEventCreate):
+    """
+    Records a new event against an existing run.
+    """
+    db_event = models.RunEvent(run_id=run_id, event_type=event.event_type, value=event.value)
+    db.add(db_event)
+    db.commit()
+    db.refresh(db_event)
+    return db_event
+
+def get_run_events(db: Session, run_id: int) -> List[schemas.RunEvent]:
+    """
+    Retrieves all events for a run in the order they were recorded,
+    unpacking them if the run has finished.
+    """
+    return event_store.get_run_events(db, run_id)
+
+# --- Retention ---
+
+def fold_and_delete_runs(db: Session, runs: List[models.Run]):
+    """
+    Folds the given runs into their players' archive totals and then
+    deletes them, so that player statistics are unchanged once the runs
+    have left the `runs` table. The caller is responsible for committing.
+    """
+    stats_by_player = {}
+    upgrades_by_key = {}
+    for run in runs:
+        if run.player_id is None:
+            continue
+        stats = stats_by_player.get(run.player_id)
+        if stats is None:
+            stats = db.get(models.PlayerArchiveStats, run.player_id)
+            if stats is None:
+                stats = models.PlayerArchiveStats(
+                    player_id=run.player_id, runs=0, total_duration_seconds=0, longest_run=0, total_kills=0
+                )
+                db.add(stats)
+            stats_by_player[run.player_id] = stats
+        stats.runs += 1
+        stats.total_duration_seconds += run.duration_seconds or 0
+        stats.longest_run = max(stats.longest_run, run.duration_seconds or 0)
+        stats.total_kills += run.kills_total or 0
+
+        for upgrade, level in (run.upgrades or {}).items():
+            if level <= 0:
+                continue
+            key = (run.player_id, upgrade)
+            archived_upgrade = upgrades_by_key.get(key)
+            if archived_upgrade is None:
+                archived_upgrade = db.get(models.PlayerArchiveUpgrade, key)
+                if archived_upgrade is None:
+                    archived_upgrade = models.PlayerArchiveUpgrade(player_id=run.player_id, upgrade=upgrade, levels=0)
+                    db.add(archived_upgrade)
+                upgrades_by_key[key] = archived_upgrade
+            archived_upgrade.levels += level
+    db.flush()
+    _delete_runs_by_ids(db, [run.id for run in runs])
+
+def get_archived_runs(
+    start: datetime.datetime,
+    end: datetime.datetime,
+    player_id: Optional[int] = None,
+    limit: int = 100,
+) -> List[schemas.ArchivedRun]:
+    """
+    Retrieves archived runs that started between `start` and `end`, oldest
+    first, reading only the monthly partitions that overlap the range.
+    """
+    return [schemas.ArchivedRun(**run) for run in partitions.query_runs(start, end, player_id=player_id, limit=limit)]
+
+# --- Bulk Operations ---
+# These functions back the admin bulk endpoints. They work through their
+# targets in bounded chunks, committing after each one, so that SQLite's
+# write lock is only ever held for a short time.
+
+def _chunked(ids: List[int], size: int) -> Iterator[List[int]]:
+    """
+    Splits a list of IDs into consecutive chunks of at most `size` items.
+    """
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+def _delete_runs_by_ids(db: Session, run_ids: List[int]):
+    """
+    Deletes the given runs along with everything that hangs off them.
+    Bulk query deletes bypass the ORM cascade, so the children are
+    removed explicitly first. The caller is responsible for committing.
+    """
+    if settings.partition_live_events:
+        # Packs kept in the partitions are deleted once the runs are gone.
+        started = db.query(models.Run.id, models.Run.started_at).filter(
+            models.Run.id.in_(run_ids), models.Run.started_at.isnot(None)
+        ).all()
+        indexes.after_commit(db, lambda: partitions.delete_packs(started))
+    db.query(models.RunEvent).filter(models.RunEvent.run_id.in_(run_ids)).delete(synchronize_session=False)
+    db.query(models.RunUpgrade).filter(models.RunUpgrade.run_id.in_(run_ids)).delete(synchronize_session=False)
+    db.query(models.RunEventPack).filter(models.RunEventPack.run_id.in_(run_ids)).delete(synchronize_session=False)
+    db.query(models.RunProgress).filter(models.RunProgress.run_id.in_(run_ids)).delete(synchronize_session=False)
+    db.query(models.Run).filter(models.Run.id.in_(run_ids)).delete(synchronize_session=False)
+    sync.record_deletions(db, models.Run, run_ids)
+    bus.publish(db, "runs_deleted", {"run_ids": run_ids})
+    indexes.after_commit(db, lambda: _on_runs_deleted(run_ids))
+
+def find_run_ids(
+    db: Session,
+    run_ids: Optional[List[int]] = None,
+    started_after: Optional[datetime.datetime] = None,
+    started_before: Optional[datetime.datetime] = None,
+    status: Optional[models.RunStatus] = None,
+) -> List[int]:
+    """
+    Returns the IDs of all runs matching every given criterion.
+    """
+    query = db.query(models.Run.id)
+    if run_ids is not None:
+        query = query.filter(models.Run.id.in_(run_ids))
+    if started_after is not None:
+        query = query.filter(models.Run.started_at >= started_after)
+    if started_before is not None:
+        query = query.filter(models.Run.started_at < started_before)
+    if status is not None:
+        query = query.filter(models.Run.status == status)
+    return [run_id for run_id, in query.order_by(models.Run.id)]
+
+def find_player_ids(
+    db: Session,
+    player_ids: Optional[List[int]] = None,
+    created_after: Optional[datetime.datetime] = None,
+    created_before: Optional[datetime.datetime] = None,
+) -> List[int]:
+    """
+    Returns the IDs of all players matching every given criterion.
+    """
+    query = db.query(models.Player.id)
+    if player_ids is not None:
+        query = query.filter(models.Player.id.in_(player_ids))
+    if created_after is not None:
+        query = query.filter(models.Player.created_at >= created_after)
+    if created_before is not None:
+        query = query.filter(models.Player.created_at < created_before)
+    return [player_id for player_id, in query.order_by(models.Player.id)]
+
+def bulk_delete_runs(db: Session, run_ids: List[int], progress: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Deletes the given runs and their events, one chunk per transaction.
+    `progress` is called with the number of runs removed after each chunk.
+    """
+    deleted = 0
+    for chunk in _chunked(run_ids, settings.bulk_delete_chunk_size):
+        _delete_runs_by_ids(db, chunk)
+        db.commit()
+        deleted += len(chunk)
+        if progress:
+            progress(len(chunk))
+        # Give other writers a chance to take the lock between chunks.
+        time.sleep(settings.bulk_delete_pause_seconds)
+    return deleted
+
+def bulk_delete_players(db: Session, player_ids: List[int], progress: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Deletes the given players together with all of their runs and events.
+    `progress` is called with the number of players removed after each chunk.
+    """
+    deleted = 0
+    for chunk in _chunked(player_ids, settings.bulk_delete_chunk_size):
+        run_ids = [run_id for run_id, in db.query(models.Run.id).filter(models.Run.player_id.in_(chunk))]
+        bulk_delete_runs(db, run_ids)
+        db.query(models.PlayerArchiveStats).filter(models.PlayerArchiveStats.player_id.in_(chunk)).delete(synchronize_session=False)
+        db.query(models.PlayerArchiveUpgrade).filter(models.PlayerArchiveUpgrade.player_id.in_(chunk)).delete(synchronize_session=False)
+        removed = db.query(models.Player).filter(models.Player.id.in_(chunk)).delete(synchronize_session=False)
+        sync.record_deletions(db, models.Player, chunk)
+        bus.publish(db, "players_deleted", {"player_ids": chunk, "removed": removed})
+        db.commit()
+        _on_players_deleted(chunk, removed)
+        deleted += len(chunk)
+        if progress:
+            progress(len(chunk))
+    return deleted
+
 # --- Deprecated Functions ---
 # The function below is deprecated and will be removed in a future version.
 # `update_run` should be used instead.
@@ -291,6 +899,7 @@ def update_run_stats(db: Session, run_id: int, run_update: schemas.RunUpdate):
     """
     db_run = get_run(db, run_id)
     if db_run:
+        was_finished = db_run.status in models.TERMINAL_STATUSES
         if run_update.duration_seconds is not None:
             db_run.duration_seconds = run_update.duration_seconds
         if run_update.kills_total is not None:
@@ -307,7 +916,16 @@ def update_run_stats(db: Session, run_id: int, run_update: schemas.RunUpdate):
             db_run.cause_of_death = run_update.cause_of_death
         if run_update.upgrades is not None:
             db_run.upgrades = run_update.upgrades
+            _sync_run_upgrades(db, db_run.id, run_update.upgrades)
+        timeseries.record_sample(db, db_run)
+        if db_run.status in models.TERMINAL_STATUSES:
+            event_store.pack_run_events(db, db_run)
+            bus.publish(db, "run_finished", {"run_id": db_run.id, "ended": not was_finished})
         
         db.commit()
         db.refresh(db_run)
+        if db_run.status in models.TERMINAL_STATUSES:
+            _on_run_finished(db_run)
+            if not was_finished:
+                _on_run_ended(db, db_run)
     return db_run
\ No newline at end of file
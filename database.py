@@ -3,9 +3,13 @@
 # function that is used throughout the application to interact with
 # the database.
 
-from sqlalchemy import create_engine
+import sqlite3
+
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from config import settings
+import lanes
 
 # The database URL is read from the application's settings.
 SQLALCHEMY_DATABASE_URL = settings.database_url
@@ -20,6 +24,21 @@ engine = create_engine(
 # A sessionmaker is a factory for creating new Session objects.
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+_SQLITE_JOURNAL_MODES = {"delete", "truncate", "persist", "memory", "wal", "off"}
+
+@event.listens_for(Engine, "connect")
+def _set_sqlite_journal_mode(dbapi_connection, connection_record):
+    """
+    Applies the configured journal mode to every new SQLite connection,
+    including those of the lane engines.
+    """
+    mode = (settings.sqlite_journal_mode or "").lower()
+    if not mode or not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    if mode not in _SQLITE_JOURNAL_MODES:
+        raise ValueError(f"Unknown SQLite journal mode: {settings.sqlite_journal_mode}")
+    dbapi_connection.execute(f"PRAGMA journal_mode={mode}")
+
 # Base is a class that all of our models will inherit from.
 Base = declarative_base()
 
@@ -27,9 +46,33 @@ def get_db():
     """
     A dependency that provides a database session to the API endpoints.
     It ensures that the session is always closed after the request is finished.
+    Requests served in a lane get a session from that lane's own pool.
     """
-    db = SessionLocal()
+    lane = lanes.current_lane()
+    db = lane.sessionmaker() if lane else SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+def upgrade_schema(bind):
+    """
+    Brings an existing database up to date with the models. `create_all`
+    only creates missing tables, so any columns and indexes that have since
+    been added to existing tables are created here.
+    """
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_type = column.type.compile(dialect=bind.dialect)
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
@@ -0,0 +1,182 @@
+# This file implements the opt-in diagnostics mode. When it is enabled,
+# every SQL statement slower than a threshold is logged together with its
+# bound parameters and the `crud` function that issued it, and admins can
+# profile a single request by sending an `X-Profile` header. Profiles are
+# returned as collapsed stacks, ready to be turned into a flamegraph.
+
+import base64
+import binascii
+import inspect
+import logging
+import sys
+import threading
+from collections import Counter
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.security import HTTPBasicCredentials
+from starlette.routing import Match
+
+import auth
+import metrics
+from config import settings
+
+slow_query_logger = logging.getLogger("diagnostics.slow_query")
+
+PROFILE_HEADER = b"x-profile"
+
+class DiagnosticsState:
+    """
+    Holds the diagnostics settings, which admins can change at runtime.
+    """
+
+    def __init__(self):
+        self.enabled = settings.diagnostics_enabled
+        self.slow_query_threshold_ms = settings.slow_query_threshold_ms
+
+state = DiagnosticsState()
+
+# --- Slow-Query Log ---
+
+def _originating_crud_function() -> Optional[str]:
+    """
+    Walks up the current stack to find the `crud` function running the query.
+    """
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_globals.get("__name__") == "crud":
+            return f"crud.{frame.f_code.co_name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return None
+
+@metrics.on_query
+def _log_slow_query(statement, parameters, seconds):
+    elapsed_ms = seconds * 1000
+    if state.enabled and elapsed_ms >= state.slow_query_threshold_ms:
+        slow_query_logger.warning(
+            "Slow query (%.1f ms) from %s: %s | parameters: %r",
+            elapsed_ms, _originating_crud_function() or "unknown", statement, parameters,
+        )
+
+# --- Sampling Profiler ---
+
+def _frame_name(frame) -> str:
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}"
+
+class SamplingProfiler:
+    """
+    Periodically samples the stacks of every thread that is running a given
+    endpoint, counting identical stacks. Stacks are rooted at the endpoint,
+    so framework frames are left out.
+    """
+
+    def __init__(self, target_code, interval: float):
+        self.target_code = target_code
+        self.interval = interval
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="diagnostics-profiler", daemon=True)
+
+    def _sample(self):
+        own_thread = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                if frame.f_code is self.target_code:
+                    self.samples[";".join(reversed(stack))] += 1
+                    break
+                frame = frame.f_back
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> str:
+        """
+        Stops sampling and returns the samples in collapsed-stack format,
+        one `frame;frame;frame count` line per distinct stack.
+        """
+        self._stopped.set()
+        self._thread.join()
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+def _is_admin_request(scope) -> bool:
+    """
+    Checks the request's Basic credentials with `get_current_admin`.
+    """
+    headers = dict(scope["headers"])
+    scheme, _, encoded = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+    if scheme.lower() != "basic":
+        return False
+    try:
+        username, _, password = base64.b64decode(encoded).decode("utf-8").partition(":")
+    except (binascii.Error, UnicodeDecodeError):
+        return False
+    try:
+        auth.get_current_admin(HTTPBasicCredentials(username=username, password=password))
+    except HTTPException:
+        return False
+    return True
+
+def _matching_endpoint(scope):
+    for route in scope["app"].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "endpoint", None)
+    return None
+
+async def _send_text(send, status: int, body: str, extra_headers=()):
+    content = body.encode("utf-8")
+    headers = [
+        (b"content-type", b"text/plain; charset=utf-8"),
+        (b"content-length", str(len(content)).encode()),
+        *extra_headers,
+    ]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": content})
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles a request when diagnostics are enabled and
+    an admin sends an `X-Profile` header. The endpoint runs as usual, but
+    its response is replaced by the collapsed-stack profile; the original
+    status code is returned in the `X-Profiled-Status` header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not state.enabled or PROFILE_HEADER not in dict(scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+        if not _is_admin_request(scope):
+            await _send_text(send, 401, "Profiling requires admin credentials\n", [(b"www-authenticate", b"Basic")])
+            return
+        endpoint = _matching_endpoint(scope)
+        if endpoint is None:
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def discard_response(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+
+        profiler = SamplingProfiler(inspect.unwrap(endpoint).__code__, settings.profile_interval_seconds)
+        profiler.start()
+        try:
+            await self.app(scope, receive, discard_response)
+        finally:
+            collapsed = profiler.stop()
+        await _send_text(send, 200, collapsed, [
+            (b"x-profiled-status", str(status[0]).encode()),
+            (b"x-profile-samples", str(sum(profiler.samples.values())).encode()),
+        ])
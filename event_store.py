@@ -0,0 +1,326 @@
+# This file stores the events of finished runs in a compact packed form.
+# While a run is in progress its events are ordinary `run_events` rows;
+# once it finishes they are packed into a single compressed blob per run
+# in `run_event_packs` and the rows are removed. In a pack:
+#
+#   - event types are dictionary-encoded as IDs from the `event_types` table,
+#   - timestamps are millisecond offsets from the run's start, stored as
+#     differences from the previous event,
+#   - event IDs are stored as differences from the previous ID,
+#
+# and each of these is laid out as its own column of variable-length
+# integers before the whole pack is zlib-compressed. Events read back from
+# a pack are the same as they were as rows, except that timestamps are
+# rounded to the millisecond. With `partition_live_events`, packs are kept
+# in the monthly partitions instead (see `partitions`).
+
+import datetime
+import threading
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import event, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import indexes
+import models
+import partitions
+import schemas
+from config import settings
+from database import Base
+
+# The version byte at the start of every pack, so the format can change.
+PACK_VERSION = 1
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MILLISECOND = datetime.timedelta(milliseconds=1)
+
+# --- Encoding ---
+
+def write_varint(out: bytearray, value: int):
+    """Appends a non-negative integer as a little-endian base-128 varint."""
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(data: bytes, position: int) -> Tuple[int, int]:
+    """Reads a varint, returning it and the position just after it."""
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+def zigzag(value: int) -> int:
+    """Maps signed integers to unsigned ones, keeping small values small."""
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+def unzigzag(value: int) -> int:
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+def _to_ms(moment: Optional[datetime.datetime]) -> int:
+    # SQLite keeps no time zone, so neither do packed timestamps.
+    moment = moment.replace(tzinfo=None) if moment else _EPOCH
+    return (moment - _EPOCH) // _MILLISECOND
+
+def encode(started_at: Optional[datetime.datetime], events: List[Tuple[int, int, Optional[datetime.datetime], Optional[str]]]) -> bytes:
+    """
+    Packs (id, type_id, timestamp, value) tuples, in ID order, into a blob.
+    """
+    out = bytearray([PACK_VERSION])
+    base = _to_ms(started_at)
+    write_varint(out, zigzag(base))
+    write_varint(out, len(events))
+    previous = 0
+    for event_id, _, _, _ in events:
+        write_varint(out, event_id - previous)
+        previous = event_id
+    for _, type_id, _, _ in events:
+        write_varint(out, type_id)
+    previous = base
+    for _, _, timestamp, _ in events:
+        moment = _to_ms(timestamp) if timestamp else base
+        write_varint(out, zigzag(moment - previous))
+        previous = moment
+    for _, _, _, value in events:
+        if value is None:
+            write_varint(out, 0)
+        else:
+            encoded = value.encode("utf-8")
+            write_varint(out, len(encoded) + 1)
+            out += encoded
+    return zlib.compress(bytes(out), 6)
+
+def decode(blob: bytes) -> List[Tuple[int, int, datetime.datetime, Optional[str]]]:
+    """
+    Unpacks a blob written by `encode` into (id, type_id, timestamp, value) tuples.
+    """
+    data = zlib.decompress(blob)
+    if data[0] != PACK_VERSION:
+        raise ValueError(f"Unknown event pack version {data[0]}")
+    base, position = read_varint(data, 1)
+    count, position = read_varint(data, position)
+    columns = []
+    for _ in range(3):
+        column = []
+        for _ in range(count):
+            value, position = read_varint(data, position)
+            column.append(value)
+        columns.append(column)
+    id_deltas, type_ids, offset_deltas = columns
+
+    events = []
+    event_id = 0
+    moment = unzigzag(base)
+    for index in range(count):
+        event_id += id_deltas[index]
+        moment += unzigzag(offset_deltas[index])
+        length, position = read_varint(data, position)
+        value = None
+        if length:
+            value = data[position:position + length - 1].decode("utf-8")
+            position += length - 1
+        events.append((event_id, type_ids[index], _EPOCH + moment * _MILLISECOND, value))
+    return events
+
+# --- Event Types ---
+# Type IDs never change once assigned, so they are cached in memory, but
+# only once committed, so a rolled-back ID is never handed out again.
+
+_type_ids: Dict[str, int] = {}
+_type_names: Dict[int, str] = {}
+_types_lock = threading.Lock()
+
+def _load_types(db: Session):
+    for type_id, name in db.query(models.EventType.id, models.EventType.name):
+        _type_ids[name] = type_id
+        _type_names[type_id] = name
+
+def type_id(db: Session, name: str) -> int:
+    """
+    Returns the ID for an event type, adding it to `event_types` if new.
+    """
+    with _types_lock:
+        if name in _type_ids:
+            return _type_ids[name]
+    new_id = db.query(models.EventType.id).filter(models.EventType.name == name).scalar()
+    if new_id is None:
+        try:
+            # In a savepoint, so that losing a race to add the same type
+            # does not fail the whole transaction.
+            with db.begin_nested():
+                event_type = models.EventType(name=name)
+                db.add(event_type)
+            new_id = event_type.id
+        except IntegrityError:
+            new_id = db.query(models.EventType.id).filter(models.EventType.name == name).scalar()
+    indexes.after_commit(db, lambda: _remember_type(name, new_id))
+    return new_id
+
+def _remember_type(name: str, type_id: int):
+    with _types_lock:
+        _type_ids[name] = type_id
+        _type_names[type_id] = name
+
+def type_name(db: Session, type_id: int) -> str:
+    with _types_lock:
+        if type_id not in _type_names:
+            _load_types(db)
+        return _type_names[type_id]
+
+@event.listens_for(Base.metadata, "after_drop")
+def _clear_types_after_drop(target, connection, **kw):
+    with _types_lock:
+        _type_ids.clear()
+        _type_names.clear()
+
+def enable_event_id_autoincrement(bind):
+    """
+    Rebuilds a `run_events` table created before packing existed with
+    AUTOINCREMENT, which SQLite can only add by copying the table. Without
+    it, SQLite reuses the IDs of the newest rows once they are deleted.
+    This is a migration step, run by `migrate`, never on import.
+    """
+    if bind.dialect.name != "sqlite":
+        return
+    with bind.begin() as connection:
+        table_sql = connection.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'run_events'")
+        ).scalar()
+        if table_sql is None or "AUTOINCREMENT" in table_sql.upper():
+            return
+        index_names = connection.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'run_events' AND sql IS NOT NULL")
+        ).scalars().all()
+        for index_name in index_names:
+            connection.execute(text(f'DROP INDEX "{index_name}"'))
+        connection.execute(text("ALTER TABLE run_events RENAME TO run_events_old"))
+        models.RunEvent.__table__.create(connection)
+        connection.execute(text(
+            "INSERT INTO run_events (id, run_id, event_type, value, timestamp) "
+            "SELECT id, run_id, event_type, value, timestamp FROM run_events_old"
+        ))
+        connection.execute(text("DROP TABLE run_events_old"))
+
+# --- Packing and Reading ---
+
+def _unpack(db: Session, run_id: int, data: Optional[bytes]) -> List[schemas.RunEvent]:
+    if data is None:
+        return []
+    return [
+        schemas.RunEvent(id=event_id, run_id=run_id, event_type=type_name(db, type_id), value=value, timestamp=timestamp)
+        for event_id, type_id, timestamp, value in decode(data)
+    ]
+
+def _merge(packed: List[schemas.RunEvent], rows: List[models.RunEvent]) -> List[schemas.RunEvent]:
+    # A pack in a partition is written before the rows it holds are
+    # deleted, so an event can briefly be in both.
+    packed_ids = {event.id for event in packed}
+    rows = [row for row in rows if row.id not in packed_ids]
+    if not rows:
+        return packed
+    events = packed + [schemas.RunEvent.model_validate(row) for row in rows]
+    return sorted(events, key=lambda event: event.id)
+
+def _partitioned_pack(run: models.Run) -> Optional[bytes]:
+    if not settings.partition_live_events or run.started_at is None:
+        return None
+    return partitions.read_pack(run.id, run.started_at)
+
+def get_run_events(db: Session, run_id: int) -> List[schemas.RunEvent]:
+    """
+    Returns a run's events in the order they were recorded, whether they
+    are packed, still rows, or both (events sent after a run finished).
+    """
+    rows = db.query(models.RunEvent).filter(models.RunEvent.run_id == run_id).order_by(models.RunEvent.id).all()
+    run = db.get(models.Run, run_id)
+    data = _partitioned_pack(run) if run else None
+    if data is None:
+        pack = db.get(models.RunEventPack, run_id)
+        data = pack.data if pack else None
+    return _merge(_unpack(db, run_id, data), rows)
+
+def loaded_run_events(db: Session, run: models.Run) -> List[schemas.RunEvent]:
+    """
+    The same as `get_run_events`, for a run whose `events` and
+    `event_pack` have already been loaded.
+    """
+    data = _partitioned_pack(run)
+    if data is None and run.event_pack is not None:
+        data = run.event_pack.data
+    return _merge(_unpack(db, run.id, data), sorted(run.events, key=lambda row: row.id))
+
+def pack_run_events(db: Session, run: models.Run):
+    """
+    Moves a run's event rows into its pack, merging them with any events
+    already packed. The caller is responsible for committing.
+    """
+    if not settings.pack_finished_run_events:
+        return
+    rows = db.query(models.RunEvent).filter(models.RunEvent.run_id == run.id).order_by(models.RunEvent.id).all()
+    if not rows:
+        return
+    pack = db.get(models.RunEventPack, run.id)
+    packed = _partitioned_pack(run)
+    if packed is None and pack is not None:
+        packed = pack.data
+    events = {event[0]: event for event in decode(packed)} if packed else {}
+    for row in rows:
+        events[row.id] = (row.id, type_id(db, row.event_type or ""), row.timestamp, row.value)
+    ordered = sorted(events.values(), key=lambda event: event[0])
+    data = encode(run.started_at, ordered)
+    if settings.partition_live_events and run.started_at is not None:
+        # Written before the transaction that deletes the rows commits, so
+        # if it rolls back the events are in both places, never in neither.
+        partitions.write_pack(run.id, run.started_at, len(ordered), data)
+        if pack is not None:
+            db.delete(pack)
+    elif pack is None:
+        db.add(models.RunEventPack(run_id=run.id, event_count=len(ordered), data=data))
+    else:
+        pack.event_count = len(ordered)
+        pack.data = data
+    db.query(models.RunEvent).filter(models.RunEvent.run_id == run.id).delete(synchronize_session=False)
+    # The rows are gone, so do not let a loaded `run.events` keep them.
+    db.expire(run, ["events"])
+
+def pack_finished_runs(db: Session, progress: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Packs the events of every finished run that still has event rows, one
+    chunk of runs per transaction. Returns the number of runs packed.
+    """
+    if not settings.pack_finished_run_events:
+        return 0
+    packed = 0
+    while True:
+        runs = (
+            db.query(models.Run)
+            .filter(
+                models.Run.status.in_(models.TERMINAL_STATUSES),
+                models.Run.id.in_(db.query(models.RunEvent.run_id)),
+            )
+            .limit(settings.bulk_delete_chunk_size)
+            .all()
+        )
+        if not runs:
+            return packed
+        for run in runs:
+            pack_run_events(db, run)
+        db.commit()
+        packed += len(runs)
+        if progress:
+            progress(len(runs))
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        print(f"Packed the events of {pack_finished_runs(session)} finished runs")
+    finally:
+        session.close()
@@ -0,0 +1,114 @@
+# This file provides the shared plumbing for in-memory indexes that are
+# derived from the database, such as the leaderboards. Each index is built
+# from the database the first time it is used (or at startup), kept up to
+# date by the `crud` write paths, and thrown away whenever the tables are
+# dropped, so it can never outlive the data it was built from.
+
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, List
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from database import Base
+
+def primary_of(db: Session) -> Session:
+    """
+    Returns the primary session behind a read replica session (see
+    `replicas`), or the session itself if it is on the primary.
+    """
+    primary = db.info.get("primary")
+    return db if primary is None else primary()
+
+class DerivedIndex(ABC):
+    """
+    Base class for an in-memory index built from the database. Subclasses
+    implement `_clear` and `_load`; updates made while the index is not
+    loaded can simply be skipped, since the next load will see them.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @abstractmethod
+    def _clear(self):
+        """Empties the index."""
+
+    @abstractmethod
+    def _load(self, db: Session):
+        """Fills the empty index from the database."""
+
+    def ensure_loaded(self, db: Session):
+        """
+        Builds the index from the database if it is not already built.
+        """
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                self._clear()
+                # The write paths keep an index current from the moment it
+                # is built, so it must not be built from a lagging replica.
+                self._load(primary_of(db))
+                self._loaded = True
+
+    def reset(self):
+        """
+        Discards the index, so that it is rebuilt on its next use.
+        """
+        with self._lock:
+            self._clear()
+            self._loaded = False
+
+_registry: List[DerivedIndex] = []
+
+def register(index: DerivedIndex) -> DerivedIndex:
+    """
+    Registers an index so that it is warmed at startup and reset with the tables.
+    """
+    _registry.append(index)
+    return index
+
+def warm_all(db: Session):
+    """
+    Builds every registered index. Called once at startup.
+    """
+    for index in _registry:
+        index.ensure_loaded(db)
+
+def reset_all():
+    """
+    Discards every registered index.
+    """
+    for index in _registry:
+        index.reset()
+
+@event.listens_for(Base.metadata, "after_drop")
+def _reset_after_drop(target, connection, **kw):
+    reset_all()
+
+# --- Commit Hooks ---
+# Bulk deletes happen inside a larger transaction, so the indexes are only
+# told about them once that transaction has actually been committed.
+
+def after_commit(db: Session, callback: Callable[[], None]):
+    """
+    Runs `callback` once the session's current transaction commits. If it
+    is rolled back instead, the callback is dropped.
+    """
+    db.info.setdefault("index_callbacks", []).append(callback)
+
+@event.listens_for(Session, "after_commit")
+def _run_commit_callbacks(session):
+    for callback in session.info.pop("index_callbacks", []):
+        callback()
+
+@event.listens_for(Session, "after_rollback")
+def _drop_commit_callbacks(session):
+    session.info.pop("index_callbacks", None)
@@ -0,0 +1,89 @@
+# This file keeps track of long-running admin jobs. Jobs are executed as
+# FastAPI background tasks and record their progress in the `jobs` table,
+# so that clients can poll for it while the work runs, whichever worker
+# process their requests land on.
+
+import datetime
+import time
+from typing import Callable, Optional
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session, sessionmaker
+
+import models
+
+# Only the most recent jobs are kept, so the table cannot grow forever.
+MAX_TRACKED_JOBS = 100
+
+# Progress is written at most this often, so that a job does not compete
+# with its own work for the write lock after every chunk.
+PROGRESS_INTERVAL_SECONDS = 1.0
+
+def create_job(db: Session, kind: str, total: Optional[int] = None) -> models.Job:
+    """
+    Records a new pending job and returns it.
+    """
+    job = models.Job(kind=kind, status="pending", total=total, processed=0)
+    db.add(job)
+    db.flush()
+    # Forget the oldest jobs once the table is full.
+    db.query(models.Job).filter(models.Job.id <= job.id - MAX_TRACKED_JOBS).delete(synchronize_session=False)
+    db.commit()
+    db.refresh(job)
+    return job
+
+def get_job(db: Session, job_id: int) -> Optional[models.Job]:
+    """
+    Retrieves a job by its ID, or None if it is unknown or has expired.
+    """
+    return db.get(models.Job, job_id)
+
+def _update_job(bind, job_id: int, **values):
+    with bind.begin() as connection:
+        connection.execute(update(models.Job).where(models.Job.id == job_id).values(**values))
+
+class _Progress:
+    """
+    Adds up the items a job has processed, writing the total to its row at
+    most every `PROGRESS_INTERVAL_SECONDS`.
+    """
+
+    def __init__(self, bind, job_id: int):
+        self.bind = bind
+        self.job_id = job_id
+        self.pending = 0
+        self.written_at = time.monotonic()
+
+    def advance(self, count: int):
+        """Records that `count` more items have been processed."""
+        self.pending += count
+        if time.monotonic() - self.written_at >= PROGRESS_INTERVAL_SECONDS:
+            _update_job(self.bind, self.job_id, processed=models.Job.processed + self.pending)
+            self.pending = 0
+            self.written_at = time.monotonic()
+
+def run_job(job_id: int, bind, func: Callable, *args, **kwargs):
+    """
+    Runs `func` for a job with its own database session bound to `bind`.
+    The request's session is closed once the response has been sent, so
+    background work must never reuse it.
+    """
+    progress = _Progress(bind, job_id)
+    _update_job(bind, job_id, status="running")
+    db = sessionmaker(autocommit=False, autoflush=False, bind=bind)()
+    status, error = "completed", None
+    try:
+        func(db, *args, progress=progress.advance, **kwargs)
+    except Exception as exc:
+        db.rollback()
+        status, error = "failed", str(exc)
+    finally:
+        db.close()
+    _update_job(
+        bind,
+        job_id,
+        status=status,
+        error=error,
+        processed=models.Job.processed + progress.pending,
+        finished_at=datetime.datetime.now(),
+    )
@@ -0,0 +1,139 @@
+# This file splits requests into lanes by route group (gameplay, auth,
+# analytics and admin). Each lane has its own concurrency limit, its own
+# database connection pool and its own queue timeout, so that a slow
+# dashboard query or a burst of bcrypt on sign-in cannot hold up the run
+# updates sent by live games. A request that cannot get into its lane
+# before the lane's queue timeout is turned away with a 503.
+
+import asyncio
+import contextvars
+import threading
+import weakref
+from typing import Dict, Optional
+
+import anyio.to_thread
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.responses import JSONResponse
+
+from config import settings
+
+class Lane:
+    """
+    One group of routes, with its own admission limit and connection pool.
+    """
+
+    def __init__(self, name: str, limit: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        # asyncio primitives belong to one event loop, so each loop gets
+        # its own semaphore (there is only one outside of tests).
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._sessionmaker: Optional[sessionmaker] = None
+        self._lock = threading.Lock()
+
+    def semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.limit)
+        return semaphore
+
+    @property
+    def sessionmaker(self) -> sessionmaker:
+        """
+        The session factory for this lane, bound to an engine whose pool
+        holds one connection per request the lane admits.
+        """
+        with self._lock:
+            if self._sessionmaker is None:
+                engine = create_engine(
+                    settings.database_url,
+                    connect_args={"check_same_thread": False},
+                    pool_size=self.limit,
+                    max_overflow=0,
+                    pool_timeout=self.queue_timeout,
+                )
+                self._sessionmaker = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+            return self._sessionmaker
+
+LANES: Dict[str, Lane] = {
+    name: Lane(name, limit, settings.lane_queue_timeouts.get(name, 5.0))
+    for name, limit in settings.lane_limits.items()
+}
+
+# Requests are matched against these (lane, methods, path, subtree) rules
+# in order. A rule with methods of None matches any method; a subtree rule
+# matches the path and everything below it, any other rule only the exact
+# path. Anything else, including every read of /runs, is analytics.
+WRITE_METHODS = ("POST", "PATCH", "PUT", "DELETE")
+ROUTE_LANES = (
+    ("admin", None, "/admin", True),
+    ("auth", ("POST",), "/runs/start", False),
+    ("auth", ("POST",), "/runs/submit", False),
+    ("auth", ("POST",), "/players", False),
+    ("gameplay", WRITE_METHODS, "/runs", True),
+)
+DEFAULT_LANE = "analytics"
+
+def classify(method: str, path: str) -> Lane:
+    """
+    Returns the lane that serves a request.
+    """
+    for lane, methods, rule_path, subtree in ROUTE_LANES:
+        if methods is not None and method not in methods:
+            continue
+        if path == rule_path or (subtree and path.startswith(rule_path + "/")):
+            return LANES[lane]
+    return LANES[DEFAULT_LANE]
+
+_current_lane: contextvars.ContextVar[Optional[Lane]] = contextvars.ContextVar("current_lane", default=None)
+
+def current_lane() -> Optional[Lane]:
+    """
+    Returns the lane of the request being served, if any.
+    """
+    return _current_lane.get()
+
+def configure_threadpool():
+    """
+    Makes the shared threadpool large enough for every lane to run at its
+    limit, so that the lane limits, not the pool, decide who waits.
+    """
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = max(limiter.total_tokens, sum(lane.limit for lane in LANES.values()))
+
+class LaneMiddleware:
+    """
+    Admits each request into its lane, or answers 503 if the lane stays
+    full for longer than its queue timeout.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        lane = classify(scope["method"], scope["path"])
+        semaphore = lane.semaphore()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), lane.queue_timeout)
+        except asyncio.TimeoutError:
+            response = JSONResponse(
+                {"detail": f"The {lane.name} lane is busy, please try again later"},
+                status_code=503,
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+
+        token = _current_lane.set(lane)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_lane.reset(token)
+            semaphore.release()
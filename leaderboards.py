@@ -0,0 +1,168 @@
+# This file maintains the daily, weekly and all-time leaderboards, both
+# per map and across all maps, in memory. Each board holds only its top
+# `leaderboard_capacity` finished runs, kept sorted, so a leaderboard read
+# is a slice of a list instead of a sort over the whole `runs` table.
+# The boards are built from the database in a single pass and then kept
+# up to date as runs finish, are deleted, or their players are renamed.
+
+import bisect
+import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+import indexes
+import models
+import schemas
+from config import settings
+
+def window_period(window: schemas.LeaderboardWindow, when: datetime.datetime):
+    """
+    Returns the period of a window that a moment falls into: its date for
+    daily boards, its ISO week for weekly boards, and None for all-time.
+    """
+    if window == schemas.LeaderboardWindow.daily:
+        return when.date()
+    if window == schemas.LeaderboardWindow.weekly:
+        return tuple(when.isocalendar())[:2]
+    return None
+
+class Board:
+    """
+    The top runs for one window, period and map, ordered from best to worst.
+    """
+    __slots__ = ("keys", "entries", "truncated")
+
+    def __init__(self):
+        # Sort keys of the form (-duration, -kills, run_id), in order.
+        self.keys: List[Tuple[int, int, int]] = []
+        self.entries: Dict[int, Tuple[Tuple[int, int, int], schemas.RunLeaderboard]] = {}
+        # Whether runs have fallen off the bottom of the board.
+        self.truncated = False
+
+    def upsert(self, entry: schemas.RunLeaderboard, capacity: int):
+        self.discard(entry.run_id)
+        key = (-entry.duration_seconds, -entry.total_kills, entry.run_id)
+        if len(self.keys) >= capacity and key > self.keys[-1]:
+            self.truncated = True
+            return
+        bisect.insort(self.keys, key)
+        self.entries[entry.run_id] = (key, entry)
+        if len(self.keys) > capacity:
+            dropped = self.keys.pop()
+            del self.entries[dropped[2]]
+            self.truncated = True
+
+    def discard(self, run_id: int) -> bool:
+        """
+        Removes a run, returning True if it was on the board.
+        """
+        found = self.entries.pop(run_id, None)
+        if found is None:
+            return False
+        del self.keys[bisect.bisect_left(self.keys, found[0])]
+        return True
+
+    def top(self, skip: int, limit: int) -> List[schemas.RunLeaderboard]:
+        return [self.entries[key[2]][1] for key in self.keys[skip:skip + limit]]
+
+class LeaderboardIndex(indexes.DerivedIndex):
+    """
+    Holds every current leaderboard, keyed by (window, period, map_id),
+    where a map_id of None is the board across all maps.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._boards: Dict[tuple, Board] = {}
+
+    def _clear(self):
+        self._boards = {}
+
+    def _load(self, db: Session):
+        now = datetime.datetime.now()
+        rows = (
+            db.query(
+                models.Run.id, models.Run.player_id, models.Player.name, models.Run.map_id,
+                models.Run.started_at, models.Run.duration_seconds, models.Run.kills_total,
+            )
+            .join(models.Player, models.Player.id == models.Run.player_id)
+            .filter(models.Run.status.in_(models.TERMINAL_STATUSES))
+            .order_by(models.Run.duration_seconds.desc(), models.Run.kills_total.desc(), models.Run.id)
+            .yield_per(1000)
+        )
+        for run_id, player_id, player_name, map_id, started_at, duration, kills in rows:
+            entry = schemas.RunLeaderboard(
+                player_id=player_id, run_id=run_id, player_name=player_name,
+                duration_seconds=duration or 0, total_kills=kills or 0,
+            )
+            self._add(entry, map_id, started_at, now)
+
+    def _add(self, entry: schemas.RunLeaderboard, map_id: Optional[str], started_at, now: datetime.datetime):
+        for window in schemas.LeaderboardWindow:
+            period = window_period(window, started_at or now)
+            # Runs that belong to a period that has already ended are not shown.
+            if period != window_period(window, now):
+                continue
+            for board_map_id in (map_id, None):
+                board = self._boards.get((window, period, board_map_id))
+                if board is None:
+                    board = self._boards[(window, period, board_map_id)] = Board()
+                board.upsert(entry, settings.leaderboard_capacity)
+
+    def record(self, run: models.Run):
+        """
+        Adds or updates a finished run on every board it belongs on.
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            entry = schemas.RunLeaderboard(
+                player_id=run.player_id, run_id=run.id, player_name=run.player.name,
+                duration_seconds=run.duration_seconds or 0, total_kills=run.kills_total or 0,
+            )
+            self._add(entry, run.map_id, run.started_at, datetime.datetime.now())
+
+    def discard_runs(self, run_ids: List[int]):
+        """
+        Removes deleted runs. If one was on a board that has lost runs off
+        its bottom, that board can no longer be refilled from memory, so
+        everything is rebuilt on the next read.
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            for board in self._boards.values():
+                for run_id in run_ids:
+                    if board.discard(run_id) and board.truncated:
+                        self._clear()
+                        self._loaded = False
+                        return
+
+    def rename_player(self, player_id: int, name: str):
+        """
+        Updates the player name shown on a renamed player's entries.
+        """
+        with self._lock:
+            for board in self._boards.values():
+                for run_id, (key, entry) in list(board.entries.items()):
+                    if entry.player_id == player_id:
+                        board.entries[run_id] = (key, entry.model_copy(update={"player_name": name}))
+
+    def top(
+        self, db: Session, window: schemas.LeaderboardWindow, map_id: Optional[str] = None, skip: int = 0, limit: int = 10
+    ) -> List[schemas.RunLeaderboard]:
+        """
+        Returns the best finished runs for the current period of a window,
+        on one map or, if `map_id` is None, across all maps.
+        """
+        self.ensure_loaded(db)
+        with self._lock:
+            now = datetime.datetime.now()
+            # Drop the boards of periods that have ended since they were built.
+            for key in [key for key in self._boards if key[1] != window_period(key[0], now)]:
+                del self._boards[key]
+            board = self._boards.get((window, window_period(window, now), map_id))
+            return board.top(skip, limit) if board else []
+
+index = indexes.register(LeaderboardIndex())
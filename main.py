@@ -3,28 +3,82 @@
 # components of the application, such as the database, CRUD operations,
 # and authentication.
 
-from fastapi import FastAPI, Depends, HTTPException, Response
+import datetime
+import functools
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Path, Query, Request, Response, BackgroundTasks
+from pydantic import TypeAdapter
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from typing import List, Optional
 
+import activity
+import backup
+import bus
+import coalesce
 import crud
+import diagnostics
+import indexes
+import jobs
+import lanes
+import metrics
+import migrate
 import models
+import partitions
+import ratelimit
+import retention
 import schemas
+import sketches
+import swr
+import sync
+import timeseries
+from config import settings
 from database import SessionLocal, engine, get_db
+from replicas import get_read_db
 from fastapi.middleware.cors import CORSMiddleware
 from auth import get_current_admin, verify_password
 import auth
 
-# Create all database tables based on the models
-models.Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Brings the database up to date with the models, and builds the
+    in-memory indexes (such as the leaderboards) from it before the first
+    request is served. In multi-worker mode, the worker also starts
+    following the change bus.
+    """
+    if settings.migrate_on_startup:
+        migrate.migrate(engine)
+    if settings.change_bus_enabled:
+        # Connections opened by a preloaded parent process must not be
+        # shared with the forked workers.
+        engine.dispose(close=False)
+        bus.listener.start(engine)
+    with SessionLocal() as db:
+        indexes.warm_all(db)
+    lanes.configure_threadpool()
+    if settings.backup_interval_hours:
+        backup.scheduler.start(SessionLocal)
+    yield
+    bus.listener.stop()
+    backup.scheduler.stop()
+    # Save the quantile and activity sketches, so the next start does not
+    # rescan runs.
+    sketches.index.persist(engine)
+    activity.index.persist(engine)
 
 # Initialize the FastAPI app
 app = FastAPI(
     title="Player and Run Tracker API",
     description="An API for tracking player data and game runs.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Serve each route group in its own lane, with its own concurrency limit
+# and connection pool, so heavy analytics cannot starve live games.
+app.add_middleware(lanes.LaneMiddleware)
+
 # Configure Cross-Origin Resource Sharing (CORS) to allow requests
 # from any origin. This is useful for development but should be
 # configured more securely for production.
@@ -36,10 +90,44 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# In diagnostics mode, let admins profile a request with an `X-Profile` header.
+app.add_middleware(diagnostics.ProfilingMiddleware)
+
+# Record per-route latency, SQL statement counts and time spent in the
+# database, bcrypt and serialization. These are served at `/metrics`.
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """
+    Exposes the request metrics in the Prometheus text format.
+    """
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# --- List Responses ---
+# The large listings are built by `crud` from trusted database rows with
+# `model_construct`, skipping validation. Returning them as a `Response`
+# keeps FastAPI from validating every row again against the route's
+# `response_model`, which is still declared for the OpenAPI docs.
+
+@functools.lru_cache(maxsize=None)
+def _list_adapter(schema) -> TypeAdapter:
+    return TypeAdapter(List[schema])
+
+def _list_response(schema, items, headers: Optional[dict] = None) -> Response:
+    """
+    Serializes a list of constructed schemas straight to a JSON response.
+    """
+    return Response(_list_adapter(schema).dump_json(items), media_type="application/json", headers=headers)
+
 # --- Player Name Endpoints ---
 
 @app.post("/players/check-name", response_model=schemas.NameCheckResponse)
-def check_name(request: schemas.NameCheckRequest, db: Session = Depends(get_db)):
+def check_name(
+    request: schemas.NameCheckRequest,
+    db: Session = Depends(get_db),
+    _: None = Depends(ratelimit.limit("name_check"))
+):
     """
     Checks if a player name is already taken. This is useful for
     real-time validation in the user interface.
@@ -49,38 +137,49 @@ def check_name(request: schemas.NameCheckRequest, db: Session = Depends(get_db))
     if not player_name:
         return {"exists": False, "message": "Name cannot be empty"}
     
-    player = crud.get_player_by_name(db, name=player_name)
-    if player:
-        return {"exists": True, "message": "This username is already taken."}
-    else:
-        return {"exists": False, "message": "This username is available."}
+    return crud.check_player_name(db, player_name)
 
 @app.get("/players/generate-name", response_model=schemas.GenerateNameResponse)
-def generate_name(db: Session = Depends(get_db)):
+def generate_name(db: Session = Depends(get_db), _: None = Depends(ratelimit.limit("generate_name"))):
     """
     Generates a unique, random player name that is not already in use.
     """
     new_name = crud.generate_available_player_name(db)
     return {"player_name": new_name}
 
+@app.get("/players/search", response_model=List[schemas.PlayerMatch])
+def search_players(q: str, limit: int = Query(10, ge=1, le=50), db: Session = Depends(get_db)):
+    """
+    Typeahead search over player names. Names starting with `q` come
+    first, followed by names with a word inside them starting with `q`.
+    """
+    return crud.search_player_names(db, q, limit)
+
 # --- Game Session Endpoint ---
 
 @app.post("/runs/start", response_model=schemas.RunStartResponse)
-def start_run(run_input: schemas.RunStart, db: Session = Depends(get_db)):
+def start_run(
+    run_input: schemas.RunStart, request: Request, db: Session = Depends(get_db), _: None = Depends(ratelimit.limit("auth"))
+):
     """
     Starts a new game run. This endpoint handles both new and existing players.
     If `create_new_player` is true, a new player is created. Otherwise,
     the existing player is authenticated.
     """
+    ratelimit.check_player(request, run_input.player_name)
     if run_input.create_new_player:
         # Handle new player creation
-        if crud.get_player_by_name(db, name=run_input.player_name):
+        if crud.player_name_exists(db, run_input.player_name):
             raise HTTPException(status_code=409, detail="Player name already registered")
         
         if not run_input.password:
             raise HTTPException(status_code=422, detail="Password is required for a new player")
             
-        player = crud.create_player_with_password(db, player_name=run_input.player_name, plain_password=run_input.password)
+        try:
+            player = crud.create_player_with_password(db, player_name=run_input.player_name, plain_password=run_input.password)
+        except IntegrityError:
+            # The name was taken after the check above, by another request.
+            raise HTTPException(status_code=409, detail="Player name already registered")
 
     else:
         # Authenticate an existing player
@@ -97,10 +196,27 @@ def start_run(run_input: schemas.RunStart, db: Session = Depends(get_db)):
     
     return schemas.RunStartResponse(player_id=player.id, run_id=db_run.id)
 
+@app.post("/runs/submit", response_model=schemas.RunSubmitResponse, status_code=201)
+def submit_run(
+    submission: schemas.RunSubmit, request: Request, db: Session = Depends(get_db), _: None = Depends(ratelimit.limit("auth"))
+):
+    """
+    Records a complete, finished run in one request: the player's
+    credentials, the final stats, the upgrades and every event. This lets
+    clients on poor connections buffer a run locally and upload it once,
+    instead of starting, updating and sending events separately.
+    """
+    ratelimit.check_player(request, submission.player_name)
+    player = auth.authenticate_player(db, name=submission.player_name, password=submission.password)
+    if not player:
+        raise HTTPException(status_code=401, detail="Incorrect username or password")
+    db_run = crud.submit_run(db, player=player, submission=submission)
+    return schemas.RunSubmitResponse(player_id=player.id, run_id=db_run.id, events_recorded=len(submission.events))
+
 # --- Player CRUD Endpoints ---
 
 @app.get("/players", response_model=List[schemas.Player])
-def get_players(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def get_players(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """
     Retrieves a list of all players with pagination.
     """
@@ -118,16 +234,19 @@ def read_player(player_id: int, db: Session = Depends(get_db)):
     return db_player
 
 @app.post("/players", response_model=schemas.PlayerCreateResponse, status_code=201)
-def create_player(player: schemas.PlayerCreate, db: Session = Depends(get_db)):
+def create_player(player: schemas.PlayerCreate, db: Session = Depends(get_db), _: None = Depends(ratelimit.limit("auth"))):
     """
     Creates a new player with a randomly generated password.
     Returns the new player's details, including the password.
     """
-    db_player_check = crud.get_player_by_name(db, name=player.name)
-    if db_player_check:
+    if crud.player_name_exists(db, player.name):
         raise HTTPException(status_code=409, detail="Player name already registered")
     
-    return crud.create_player(db=db, player=player)
+    try:
+        return crud.create_player(db=db, player=player)
+    except IntegrityError:
+        # The name was taken after the check above, by another request.
+        raise HTTPException(status_code=409, detail="Player name already registered")
 
 @app.delete("/players/{player_id}", status_code=204)
 def delete_player(player_id: int, db: Session = Depends(get_db)):
@@ -142,12 +261,11 @@ def delete_player(player_id: int, db: Session = Depends(get_db)):
 # --- Run CRUD Endpoints ---
 
 @app.get("/runs", response_model=List[schemas.Run])
-def get_runs(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def get_runs(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """
     Retrieves a list of all runs with pagination.
     """
-    runs = crud.get_runs(db, skip=skip, limit=limit)
-    return runs
+    return _list_response(schemas.Run, crud.get_runs(db, skip=skip, limit=limit))
 
 @app.get("/runs/{run_id}", response_model=schemas.Run)
 def get_run(run_id: int, db: Session = Depends(get_db)):
@@ -180,6 +298,17 @@ def delete_run(run_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Run not found")
     return {"message": "Run and associated events deleted successfully"}
 
+@app.get("/runs/{run_id}/curve", response_model=schemas.RunCurve)
+def get_run_curve(run_id: int, db: Session = Depends(get_db)):
+    """
+    Retrieves a run's progress over time: one entry per progress update,
+    with its duration, kills, xp and level at that point.
+    """
+    curve = timeseries.get_run_curve(db, run_id)
+    if curve is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return curve
+
 # --- Run Event Endpoints ---
 
 @app.post("/runs/{run_id}/events", response_model=schemas.RunEvent)
@@ -203,38 +332,161 @@ def get_run_events(run_id: int, db: Session = Depends(get_db)):
 # --- Analytics Endpoints ---
 
 @app.get("/analytics/leaderboard", response_model=List[schemas.RunLeaderboard])
-def get_leaderboard(db: Session = Depends(get_db)):
+def get_leaderboard(request: Request, db: Session = Depends(get_read_db)):
     """
     Retrieves the top 10 runs for the leaderboard, sorted by duration.
+    Identical concurrent requests share one query, and a recent result is
+    served (with an `Age` header) while it is refreshed in the background.
+    """
+    leaderboard, age = swr.caches["leaderboard"].get(
+        db, None, lambda session: coalesce.coalesced(request, lambda: crud.get_leaderboard(session))
+    )
+    return _list_response(schemas.RunLeaderboard, leaderboard, headers={"Age": str(int(age))})
+
+@app.get("/analytics/leaderboard/{window}", response_model=List[schemas.RunLeaderboard])
+def get_windowed_leaderboard(
+    window: schemas.LeaderboardWindow,
+    map_id: Optional[str] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_read_db)
+):
     """
-    return crud.get_leaderboard(db)
+    Retrieves the best finished runs of today (`daily`), this week (`weekly`)
+    or all time (`all_time`), either on one map or across all maps.
+    """
+    return crud.get_windowed_leaderboard(db, window, map_id=map_id, skip=skip, limit=limit)
+
+@app.get("/analytics/rank/run/{run_id}", response_model=schemas.RunRank)
+def get_run_rank(run_id: int, db: Session = Depends(get_read_db)):
+    """
+    Retrieves where a finished run places by survival time, overall and on
+    its map, along with its percentile.
+    """
+    rank = crud.get_run_rank(db, run_id=run_id)
+    if rank is None:
+        raise HTTPException(status_code=404, detail="Run not found or not finished")
+    return rank
+
+@app.get("/analytics/rank/player/{player_id}", response_model=schemas.PlayerRank)
+def get_player_rank(player_id: int, db: Session = Depends(get_read_db)):
+    """
+    Retrieves where a player's best finished run places them among all
+    players, overall and on each map they have played.
+    """
+    rank = crud.get_player_rank(db, player_id=player_id)
+    if rank is None:
+        raise HTTPException(status_code=404, detail="Player not found or has no finished runs")
+    return rank
 
 @app.get("/analytics/players-summary", response_model=List[schemas.PlayerSummary])
-def get_players_summary(db: Session = Depends(get_db), search: Optional[str] = None):
+def get_players_summary(db: Session = Depends(get_read_db), search: Optional[str] = None):
     """
     Provides a summary of all players, including their total number of runs
-    and best run time. Can be filtered by a search term.
+    and best run time. Can be filtered by a search term. A recent result is
+    served (with an `Age` header) while it is refreshed in the background.
     """
-    return crud.get_players_summary(db, search=search)
+    summaries, age = swr.caches["players_summary"].get(
+        db, search, lambda session: crud.get_players_summary(session, search=search)
+    )
+    return _list_response(schemas.PlayerSummary, summaries, headers={"Age": str(int(age))})
 
 @app.get("/analytics/view_player_stats/{player_id}", response_model=schemas.PlayerStats)
-def view_player_stats(player_id: int, db: Session = Depends(get_db)):
+def view_player_stats(player_id: int, request: Request, db: Session = Depends(get_read_db)):
     """
     Retrieves detailed statistics for a single player, such as total runs,
-    average survival time, and total kills.
+    average survival time, and total kills. Identical concurrent requests
+    share one query.
     """
-    stats = crud.get_player_stats(db, player_id=player_id)
+    stats = coalesce.coalesced(request, lambda: crud.get_player_stats(db, player_id=player_id))
     if not stats:
         raise HTTPException(status_code=404, detail="Player not found or has no runs")
     return stats
 
+@app.get("/analytics/maps/{map_id}/curve", response_model=schemas.MapCurve)
+def get_map_curve(
+    map_id: str,
+    bucket_seconds: int = Query(30, ge=1),
+    buckets: int = Query(60, ge=1, le=1000),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Retrieves the survival curve of a map's finished runs, along with the
+    average kills, xp and level over time of the runs still alive.
+    """
+    return timeseries.get_map_curve(db, map_id, bucket_seconds=bucket_seconds, buckets=buckets)
+
+@app.get("/analytics/distribution/{metric}", response_model=schemas.Distribution)
+def get_distribution(
+    metric: schemas.DistributionMetric,
+    map_id: Optional[str] = None,
+    player_id: Optional[int] = None,
+    q: List[float] = Query([0.5, 0.9, 0.99]),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Estimates quantiles of survival time (`duration_seconds`) or kill rate
+    (`kills_per_minute`) over finished runs: all of them, one map's, or one
+    player's. Pass each wanted quantile as `q`, such as `q=0.5&q=0.9`.
+    """
+    if map_id is not None and player_id is not None:
+        raise HTTPException(status_code=422, detail="Give either map_id or player_id, not both")
+    if any(not 0 <= quantile <= 1 for quantile in q):
+        raise HTTPException(status_code=422, detail="Quantiles must be between 0 and 1")
+    return sketches.index.distribution(db, metric, q, map_id=map_id, player_id=player_id)
+
+@app.get("/analytics/active-players", response_model=schemas.ActivePlayers)
+def get_active_players(
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Estimates the distinct players who started a run between `start` and
+    `end` inclusive, overall and on each map. Both default to today.
+    """
+    end = end or datetime.date.today()
+    start = start or end
+    if start > end:
+        raise HTTPException(status_code=422, detail="start must not be after end")
+    return activity.index.active_players(db, start, end)
+
+@app.get("/analytics/engagement", response_model=schemas.Engagement)
+def get_engagement(
+    day: Optional[datetime.date] = None,
+    map_id: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Estimates the daily, weekly and monthly active players up to `day`
+    (today by default), on one map or all of them.
+    """
+    return activity.index.engagement(db, day or datetime.date.today(), map_id=map_id)
+
+@app.get("/analytics/upgrades", response_model=List[schemas.UpgradeEffectiveness])
+def get_upgrade_effectiveness(db: Session = Depends(get_read_db)):
+    """
+    Summarizes, for every upgrade, how many runs picked it and how long
+    those runs survived on average.
+    """
+    return crud.get_upgrade_effectiveness(db)
+
+@app.get("/analytics/player/{player_id}/upgrade-effectiveness", response_model=List[schemas.UpgradeEffectiveness])
+def get_player_upgrade_effectiveness(player_id: int, db: Session = Depends(get_read_db)):
+    """
+    Summarizes, for every upgrade a player has picked, how their runs with
+    that upgrade went.
+    """
+    if crud.get_player(db, player_id=player_id) is None:
+        raise HTTPException(status_code=404, detail="Player not found")
+    return crud.get_upgrade_effectiveness(db, player_id=player_id)
+
 @app.get("/players/{player_id}/runs", response_model=List[schemas.Run])
-def get_player_runs(player_id: int, db: Session = Depends(get_db)):
+def get_player_runs(player_id: int, db: Session = Depends(get_read_db)):
     """
     Retrieves all runs for a specific player.
     """
-    runs = crud.get_runs_by_player(db, player_id=player_id)
-    return runs
+    return _list_response(schemas.Run, crud.get_runs_by_player(db, player_id=player_id))
 
 # --- Admin Endpoints ---
 
@@ -256,7 +508,10 @@ def admin_update_player_name(
     """
     Admin-only endpoint to update a player's name.
     """
-    db_player = crud.update_player_name(db, player_id=player_id, new_name=update_data.name)
+    try:
+        db_player = crud.update_player_name(db, player_id=player_id, new_name=update_data.name)
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="Player name already registered")
     if not db_player:
         raise HTTPException(status_code=404, detail="Player not found")
     return db_player
@@ -289,6 +544,161 @@ def admin_delete_player(
         raise HTTPException(status_code=404, detail="Player not found")
     return Response(status_code=204)
 
+@app.post("/admin/runs/bulk-delete", response_model=schemas.Job, status_code=202)
+def admin_bulk_delete_runs(
+    criteria: schemas.BulkRunDelete,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    admin_user: str = Depends(get_current_admin)
+):
+    """
+    Admin-only endpoint to delete every run matching the given IDs, start
+    date range and/or status, along with their events. The delete runs in
+    the background; poll `/admin/jobs/{job_id}` for its progress.
+    """
+    run_ids = crud.find_run_ids(
+        db,
+        run_ids=criteria.run_ids,
+        started_after=criteria.started_after,
+        started_before=criteria.started_before,
+        status=criteria.status,
+    )
+    job = jobs.create_job(db, "bulk_delete_runs", total=len(run_ids))
+    background_tasks.add_task(jobs.run_job, job.id, db.get_bind(), crud.bulk_delete_runs, run_ids)
+    return job
+
+@app.post("/admin/players/bulk-delete", response_model=schemas.Job, status_code=202)
+def admin_bulk_delete_players(
+    criteria: schemas.BulkPlayerDelete,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    admin_user: str = Depends(get_current_admin)
+):
+    """
+    Admin-only endpoint to delete every player matching the given IDs and/or
+    creation date range, along with all of their runs and events. The delete
+    runs in the background; poll `/admin/jobs/{job_id}` for its progress.
+    """
+    player_ids = crud.find_player_ids(
+        db,
+        player_ids=criteria.player_ids,
+        created_after=criteria.created_after,
+        created_before=criteria.created_before,
+    )
+    job = jobs.create_job(db, "bulk_delete_players", total=len(player_ids))
+    background_tasks.add_task(jobs.run_job, job.id, db.get_bind(), crud.bulk_delete_players, player_ids)
+    return job
+
+@app.post("/admin/retention", response_model=schemas.Job, status_code=202)
+def admin_run_retention(
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    admin_user: str = Depends(get_current_admin)
+):
+    """
+    Admin-only endpoint to run the retention job, as `python retention.py`
+    does: archive every finished run that falls outside the configured
+    retention limits, and prune old delta sync tombstones and partitions.
+    The job runs in the background; poll `/admin/jobs/{job_id}` for its
+    progress.
+    """
+    job = jobs.create_job(db, "retention", total=len(retention.find_expired_run_ids(db)))
+    background_tasks.add_task(jobs.run_job, job.id, db.get_bind(), retention.run_retention)
+    return job
+
+@app.get("/admin/archive/runs", response_model=List[schemas.ArchivedRun])
+def admin_get_archived_runs(
+    start: datetime.datetime,
+    end: datetime.datetime,
+    player_id: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    admin_user: str = Depends(get_current_admin)
+):
+    """
+    Admin-only endpoint to read runs archived into monthly partitions that
+    started between `start` and `end`. Only the overlapping months are read.
+    """
+    start, end = partitions.naive_utc(start), partitions.naive_utc(end)
+    if start >= end:
+        raise HTTPException(status_code=422, detail="start must be before end")
+    return crud.get_archived_runs(start, end, player_id=player_id, limit=limit)
+
+@app.get("/admin/partitions", response_model=List[schemas.Partition])
+def admin_list_partitions(admin_user: str = Depends(get_current_admin)):
+    """
+    Admin-only endpoint to list the months of archived runs.
+    """
+    return [partitions.partition_info(month) for month in partitions.list_months()]
+
+@app.delete("/admin/partitions/{month}", status_code=204)
+def admin_drop_partition(
+    month: str = Path(pattern=partitions.MONTH_PATTERN),
+    admin_user: str = Depends(get_current_admin)
+):
+    """
+    Admin-only endpoint to drop a month (such as `2024-01`) of archived
+    runs at once. A month that still holds the events of live runs is kept.
+    """
+    try:
+        dropped = partitions.drop_month(month)
+    except ValueError as error:
+        raise HTTPException(status_code=409, detail=str(error))
+    if not dropped:
+        raise HTTPException(status_code=404, detail="Partition not found")
+    return Response(status_code=204)
+
+@app.post("/admin/backups", response_model=schemas.Job, status_code=202)
+def admin_create_backup(
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    admin_user: str = Depends(get_current_admin)
+):
+    """
+    Admin-only endpoint to take an online backup of the database while it
+    stays in use. The backup runs in the background; poll
+    `/admin/jobs/{job_id}` for its status.
+    """
+    job = jobs.create_job(db, "backup")
+    background_tasks.add_task(jobs.run_job, job.id, db.get_bind(), backup.create_backup)
+    return job
+
+@app.get("/admin/backups", response_model=List[schemas.Backup])
+def admin_list_backups(admin_user: str = Depends(get_current_admin)):
+    """
+    Admin-only endpoint to list the kept backups, newest first.
+    """
+    return backup.list_backups()
+
+@app.get("/admin/diagnostics", response_model=schemas.DiagnosticsSettings)
+def admin_get_diagnostics(admin_user: str = Depends(get_current_admin)):
+    """
+    Admin-only endpoint to view the diagnostics settings.
+    """
+    return diagnostics.state
+
+@app.patch("/admin/diagnostics", response_model=schemas.DiagnosticsSettings)
+def admin_update_diagnostics(
+    update_data: schemas.DiagnosticsUpdate,
+    admin_user: str = Depends(get_current_admin)
+):
+    """
+    Admin-only endpoint to switch diagnostics mode on or off, or change the
+    slow-query threshold, without restarting the server.
+    """
+    for key, value in update_data.model_dump(exclude_unset=True).items():
+        setattr(diagnostics.state, key, value)
+    return diagnostics.state
+
+@app.get("/admin/jobs/{job_id}", response_model=schemas.Job)
+def admin_get_job(job_id: int, db: Session = Depends(get_db), admin_user: str = Depends(get_current_admin)):
+    """
+    Admin-only endpoint to poll the progress of a background job.
+    """
+    job = jobs.get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 # --- Deprecated / Unused Endpoints ---
 # These endpoints are left for reference but are either replaced by more
 # comprehensive endpoints or are no longer in use.
@@ -318,9 +728,19 @@ def update_run_from_game(run_id: int, run_update: schemas.RunUpdate, db: Session
 # def get_survival_time_distribution(player_id: int, db: Session = Depends(get_db)):
 #     ...
 
-# @app.get("/analytics/player/{player_id}/upgrade-effectiveness")
-# def get_upgrade_effectiveness(player_id: int, db: Session = Depends(get_db)):
-#     ...
+# --- Sync Endpoint ---
+
+@app.get("/sync", response_model=schemas.SyncChanges)
+def get_sync_changes(since: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=5000), db: Session = Depends(get_db)):
+    """
+    Returns the players and runs created, changed or deleted after the
+    cursor `since`, so that tools can keep a local copy of both tables up
+    to date. Start from 0 and pass back the returned `cursor` each time.
+    """
+    changes = sync.get_changes(db, since=since, limit=limit)
+    if changes is None:
+        raise HTTPException(status_code=410, detail="Cursor is too old; sync again from 0")
+    return changes
 
 # --- Test Endpoints ---
 # These are simple endpoints used for basic connectivity testing.
@@ -336,3 +756,7 @@ def test_endpoint_two():
 @app.get("/test3")
 def test_endpoint_three():
     return {"message": "TEST ENDPOINT THREE (ENDGAME) OK"}
+
+# Mark when each endpoint returns, so that metrics can time serialization.
+# This must come after every route has been added.
+metrics.instrument_routes(app)
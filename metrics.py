@@ -0,0 +1,286 @@
+# This file records per-route request metrics and exposes them in the
+# Prometheus text format at `/metrics`. For every request it measures the
+# total latency, the number of SQL statements issued, and the time spent
+# in the database, in bcrypt and in serializing the response, so that
+# slow endpoints and N+1 query patterns show up on dashboards.
+
+import bisect
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Histogram bucket boundaries, in seconds for timings.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+
+# The phases of a request that are timed separately.
+PHASES = ("db", "bcrypt", "serialization")
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """A monotonically increasing counter with a fixed set of label names."""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(self.label_names, labels)} {value}"
+
+class Histogram:
+    """A histogram with fixed bucket boundaries and a fixed set of label names."""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # Each series holds its per-bucket counts (with a final +Inf bucket) and the sum.
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total) in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                bucket_labels = _format_labels(self.label_names, labels, 'le="%s"' % le)
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}"
+
+REQUESTS = Counter(
+    "http_requests_total", "Total HTTP requests by route and status.", ("method", "route", "status")
+)
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"), LATENCY_BUCKETS
+)
+REQUEST_STATEMENTS = Histogram(
+    "http_request_db_statements", "SQL statements issued per HTTP request.", ("method", "route"), STATEMENT_BUCKETS
+)
+REQUEST_PHASES = Histogram(
+    "http_request_phase_seconds", "Time per HTTP request spent in the database, bcrypt and serialization.",
+    ("method", "route", "phase"), LATENCY_BUCKETS
+)
+COALESCED_REQUESTS = Counter(
+    "http_requests_coalesced_total", "HTTP requests answered with another identical request's result.", ("method", "route")
+)
+RATE_LIMITED_REQUESTS = Counter(
+    "http_requests_rate_limited_total", "HTTP requests turned away by a rate limit.", ("group",)
+)
+ALL_METRICS = (REQUESTS, REQUEST_LATENCY, REQUEST_STATEMENTS, REQUEST_PHASES, COALESCED_REQUESTS, RATE_LIMITED_REQUESTS)
+
+# Observations are made from the event loop, while `/metrics` is rendered
+# in the threadpool, so both take this lock.
+_lock = threading.Lock()
+
+class RequestStats:
+    """
+    Accumulates measurements for the request currently being handled.
+    """
+    __slots__ = ("statements", "phases", "endpoint_finished_at")
+
+    def __init__(self):
+        self.statements = 0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.endpoint_finished_at: Optional[float] = None
+
+_current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "metrics_current_request", default=None
+)
+
+@contextmanager
+def timed(phase: str):
+    """
+    Adds the time spent inside the block to `phase` for the current request.
+    """
+    stats = _current_request.get()
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.phases[phase] += time.perf_counter() - started
+
+# --- SQLAlchemy Hooks ---
+# These are registered on the Engine class, so they time statements on
+# every engine, including the ones used by the tests. They are the only
+# query timing hooks: other modules, such as `diagnostics`, are handed each
+# statement's time through `on_query` instead of timing it again.
+
+_query_listeners: List[Callable[[str, object, float], None]] = []
+
+def on_query(listener):
+    """
+    Registers `listener(statement, parameters, seconds)` to be called after
+    every SQL statement, including those that fail. Usable as a decorator.
+    """
+    _query_listeners.append(listener)
+    return listener
+
+def _finish_query(conn, key, statement, parameters):
+    started = conn.info.get("query_started", {}).pop(key, None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats = _current_request.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.phases["db"] += elapsed
+    for listener in _query_listeners:
+        listener(statement, parameters, elapsed)
+
+# Start times are keyed by execution context, so that a failed statement is
+# matched to its own start rather than to whichever was pushed last.
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", {})[id(context or cursor)] = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _finish_query(conn, id(context or cursor), statement, parameters)
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # A statement that raises never reaches `after_cursor_execute`.
+    if exception_context.connection is not None and exception_context.execution_context is not None:
+        _finish_query(
+            exception_context.connection, id(exception_context.execution_context),
+            exception_context.statement, exception_context.parameters,
+        )
+
+# --- Endpoint Instrumentation ---
+
+def _mark_endpoint_finished(call):
+    """
+    Wraps an endpoint so that the time it returns is recorded. Everything
+    between that moment and the response being sent is serialization.
+    """
+    if inspect.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                stats = _current_request.get()
+                if stats is not None:
+                    stats.endpoint_finished_at = time.perf_counter()
+    else:
+        @functools.wraps(call)
+        def wrapper(*args, **kwargs):
+            try:
+                return call(*args, **kwargs)
+            finally:
+                stats = _current_request.get()
+                if stats is not None:
+                    stats.endpoint_finished_at = time.perf_counter()
+    return wrapper
+
+def instrument_routes(app):
+    """
+    Wraps every endpoint of `app` to record when it returns. Called once,
+    after all the routes have been added.
+    """
+    for route in getattr(app, "routes", []):
+        dependant = getattr(route, "dependant", None)
+        if dependant is not None and dependant.call is not None:
+            dependant.call = _mark_endpoint_finished(dependant.call)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that measures every HTTP request. Requests are labelled
+    by their route template (e.g. `/runs/{run_id}`) to keep the number of
+    series small.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if stats.endpoint_finished_at is not None:
+                    stats.phases["serialization"] += time.perf_counter() - stats.endpoint_finished_at
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current_request.reset(token)
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            with _lock:
+                REQUESTS.inc((method, route_path, str(status[0])))
+                REQUEST_LATENCY.observe((method, route_path), elapsed)
+                REQUEST_STATEMENTS.observe((method, route_path), stats.statements)
+                for phase, seconds in stats.phases.items():
+                    REQUEST_PHASES.observe((method, route_path, phase), seconds)
+
+def record_coalesced(method: str, route: str):
+    """
+    Counts a request that shared another request's in-flight result.
+    """
+    with _lock:
+        COALESCED_REQUESTS.inc((method, route))
+
+def record_rate_limited(group: str):
+    """
+    Counts a request turned away by a rate limit.
+    """
+    with _lock:
+        RATE_LIMITED_REQUESTS.inc((group,))
+
+def render() -> str:
+    """
+    Renders every metric in the Prometheus text exposition format.
+    """
+    with _lock:
+        lines = [line for metric in ALL_METRICS for line in metric.render()]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,40 @@
+# This file brings a database up to date with the models. It creates any
+# missing tables, adds columns and indexes added since, rebuilds tables
+# whose definition SQLite cannot alter in place, and backfills data for
+# rows written before newer tables and columns existed. It runs when the
+# app starts (unless `migrate_on_startup` is off), or on its own with
+# `python migrate.py`, such as once before starting several workers.
+
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import event_store
+import models
+import sync
+from database import upgrade_schema
+
+def migrate(bind):
+    """
+    Applies every schema upgrade and backfill to the database behind
+    `bind`. Each step does nothing once it has been applied, so this is
+    safe to run on every start.
+    """
+    models.Base.metadata.create_all(bind=bind)
+    upgrade_schema(bind)
+    event_store.enable_event_id_autoincrement(bind)
+
+    # Copy the upgrades of runs recorded before `run_upgrades` existed, and
+    # stamp rows written before delta sync and `finished_seq` existed.
+    db = sessionmaker(autocommit=False, autoflush=False, bind=bind)()
+    try:
+        crud.backfill_run_upgrades(db)
+        sync.backfill_change_seq(db)
+        sync.backfill_finished_seq(db)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    from database import engine
+
+    migrate(engine)
+    print(f"Migrated {engine.url}")
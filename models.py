@@ -3,7 +3,7 @@
 # application's data structure.
 
 import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, Enum, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import JSON
 from database import Base
@@ -20,9 +20,15 @@ class Player(Base):
     name = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.datetime.now)
+    # Stamped by `sync` on every change, for delta sync.
+    change_seq = Column(Integer, index=True)
+    updated_at = Column(DateTime, nullable=True)
 
     # Establishes a one-to-many relationship with the Run model.
     runs = relationship("Run", back_populates="player", cascade="all, delete-orphan")
+    # Totals for runs that have been moved out to the archive.
+    archive_stats = relationship("PlayerArchiveStats", uselist=False, cascade="all, delete-orphan")
+    archive_upgrades = relationship("PlayerArchiveUpgrade", cascade="all, delete-orphan")
 
 class RunStatus(str, enum.Enum):
     """
@@ -32,6 +38,9 @@ class RunStatus(str, enum.Enum):
     died = "died"
     completed = "completed"
 
+# The statuses a run can finish with. A run never leaves these once reached.
+TERMINAL_STATUSES = (RunStatus.died, RunStatus.completed)
+
 class Run(Base):
     """
     Represents a single game run. Each run is associated with a player
@@ -40,9 +49,9 @@ class Run(Base):
     __tablename__ = "runs"
 
     id = Column(Integer, primary_key=True, index=True)
-    player_id = Column(Integer, ForeignKey("players.id"), nullable=False)
+    player_id = Column(Integer, ForeignKey("players.id"), nullable=False, index=True)
     map_id = Column(String)
-    started_at = Column(DateTime, default=datetime.datetime.now)
+    started_at = Column(DateTime, default=datetime.datetime.now, index=True)
     status = Column(Enum(RunStatus), default=RunStatus.in_progress)
     duration_seconds = Column(Integer, default=0)
     level = Column(Integer, default=0)
@@ -51,11 +60,23 @@ class Run(Base):
     upgrades = Column(JSON, nullable=True)
     ended_at = Column(DateTime, nullable=True)
     cause_of_death = Column(String, nullable=True)
+    # Stamped by `sync` on every change, for delta sync.
+    change_seq = Column(Integer, index=True)
+    updated_at = Column(DateTime, nullable=True)
+    # The `change_seq` of the change that first gave the run a terminal
+    # status. Unlike `change_seq` it never moves afterwards.
+    finished_seq = Column(Integer, index=True)
 
     # Establishes a many-to-one relationship with the Player model.
     player = relationship("Player", back_populates="runs")
     # Establishes a one-to-many relationship with the RunEvent model.
     events = relationship("RunEvent", back_populates="run", cascade="all, delete-orphan")
+    # The packed events of a finished run, see `event_store`.
+    event_pack = relationship("RunEventPack", uselist=False, cascade="all, delete-orphan")
+    # The run's progress samples over time, see `timeseries`.
+    progress = relationship("RunProgress", uselist=False, cascade="all, delete-orphan")
+    # The normalized copy of `upgrades`, one row per upgrade.
+    upgrade_levels = relationship("RunUpgrade", cascade="all, delete-orphan")
 
 class RunEvent(Base):
     """
@@ -65,10 +86,177 @@ class RunEvent(Base):
     __tablename__ = "run_events"
 
     id = Column(Integer, primary_key=True, index=True)
-    run_id = Column(Integer, ForeignKey("runs.id"), nullable=False)
+    run_id = Column(Integer, ForeignKey("runs.id"), nullable=False, index=True)
     event_type = Column(String)
     value = Column(String, nullable=True)
     timestamp = Column(DateTime, default=datetime.datetime.now)
 
     # Establishes a many-to-one relationship with the Run model.
     run = relationship("Run", back_populates="events")
+
+    # Packing a run's events deletes their rows, so IDs must never be
+    # reused, or a later event could share an ID with a packed one.
+    __table_args__ = {"sqlite_autoincrement": True}
+
+class EventType(Base):
+    """
+    Maps each distinct event type name to a small integer, which is what
+    packed run events store instead of the name.
+    """
+    __tablename__ = "event_types"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
+class RunEventPack(Base):
+    """
+    Holds all the events of a finished run, packed and compressed into a
+    single blob by `event_store`. Events recorded while a run is in
+    progress stay in `run_events` until it finishes.
+    """
+    __tablename__ = "run_event_packs"
+
+    run_id = Column(Integer, ForeignKey("runs.id"), primary_key=True)
+    event_count = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+
+class RunProgress(Base):
+    """
+    Holds a run's progress samples as one delta-encoded series, see
+    `timeseries`, along with the latest sample so new ones can be appended.
+    The newest samples are kept in `tail` until there are enough of them
+    to move onto the end of `data`.
+    """
+    __tablename__ = "run_progress"
+
+    run_id = Column(Integer, ForeignKey("runs.id"), primary_key=True)
+    sample_count = Column(Integer, default=0, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    tail = Column(LargeBinary, nullable=True)
+    last_duration_seconds = Column(Integer, default=0, nullable=False)
+    last_kills_total = Column(Integer, default=0, nullable=False)
+    last_xp = Column(Integer, default=0, nullable=False)
+    last_level = Column(Integer, default=0, nullable=False)
+
+class RunUpgrade(Base):
+    """
+    Represents the level an upgrade reached in a run. This is a normalized
+    copy of `Run.upgrades`, which lets upgrade analytics be computed with
+    indexed SQL aggregates instead of decoding every run's JSON.
+    """
+    __tablename__ = "run_upgrades"
+
+    run_id = Column(Integer, ForeignKey("runs.id"), primary_key=True)
+    upgrade = Column(String, primary_key=True)
+    level = Column(Integer, nullable=False)
+
+    # Covers per-upgrade aggregation without touching the table itself.
+    __table_args__ = (Index("ix_run_upgrades_upgrade_level", "upgrade", "run_id", "level"),)
+
+class PlayerArchiveStats(Base):
+    """
+    Holds a player's running totals for runs that the retention job has
+    moved out of the `runs` table, so their statistics stay complete.
+    """
+    __tablename__ = "player_archive_stats"
+
+    player_id = Column(Integer, ForeignKey("players.id"), primary_key=True)
+    runs = Column(Integer, default=0, nullable=False)
+    total_duration_seconds = Column(Integer, default=0, nullable=False)
+    longest_run = Column(Integer, default=0, nullable=False)
+    total_kills = Column(Integer, default=0, nullable=False)
+
+class PlayerArchiveUpgrade(Base):
+    """
+    Holds the summed upgrade levels a player picked across archived runs,
+    which keeps their favourite upgrade correct after archival.
+    """
+    __tablename__ = "player_archive_upgrades"
+
+    player_id = Column(Integer, ForeignKey("players.id"), primary_key=True)
+    upgrade = Column(String, primary_key=True)
+    levels = Column(Integer, default=0, nullable=False)
+
+class SyncState(Base):
+    """
+    A single row holding the last change sequence number handed out, and
+    the highest one whose tombstone has since been pruned.
+    """
+    __tablename__ = "sync_state"
+
+    id = Column(Integer, primary_key=True)
+    last_seq = Column(Integer, default=0, nullable=False)
+    pruned_seq = Column(Integer, default=0, nullable=False)
+
+class Tombstone(Base):
+    """
+    Records that a player or run was deleted, so that delta sync clients
+    can remove it from their copy.
+    """
+    __tablename__ = "tombstones"
+
+    change_seq = Column(Integer, primary_key=True)
+    table_name = Column(String, nullable=False)
+    row_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, default=datetime.datetime.now, nullable=False)
+
+class QuantileSketch(Base):
+    """
+    A saved quantile sketch of one metric over one scope of finished runs,
+    see `sketches`. `watermark` is the `Run.finished_seq` up to which
+    finished runs are included.
+    """
+    __tablename__ = "quantile_sketches"
+
+    metric = Column(String, primary_key=True)
+    scope = Column(String, primary_key=True)
+    runs = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    watermark = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.datetime.now, nullable=False)
+
+class ActivitySketch(Base):
+    """
+    A saved HyperLogLog sketch of the players who started a run on one day
+    and map, see `activity`. `map_id` is "*" for the sketch over all maps.
+    `last_run_id` is the run ID the sketches were complete up to when this
+    one was saved.
+    """
+    __tablename__ = "activity_sketches"
+
+    day = Column(Date, primary_key=True)
+    map_id = Column(String, primary_key=True)
+    registers = Column(LargeBinary, nullable=False)
+    last_run_id = Column(Integer, default=0, nullable=False)
+
+class Job(Base):
+    """
+    Tracks the state of a background admin job, such as a bulk delete, so
+    that its progress can be polled from any worker, see `jobs`.
+    `processed` is advanced as each chunk of the work completes.
+    """
+    __tablename__ = "jobs"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    status = Column(String, default="pending", nullable=False)
+    total = Column(Integer, nullable=True)
+    processed = Column(Integer, default=0, nullable=False)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.now, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+class ChangeMessage(Base):
+    """
+    A change committed by one worker process, for the others to apply to
+    their in-memory state, see `bus`.
+    """
+    __tablename__ = "change_log"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True)
+    topic = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    origin = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.now, nullable=False)
@@ -0,0 +1,108 @@
+# This file keeps a Bloom filter over every player name, so that the live
+# username check can answer "available" without touching the database.
+# A Bloom filter never misses a name it has been given, so a negative
+# answer is definite; a positive answer only means the name might be
+# taken, and is confirmed with an indexed EXISTS query.
+#
+# Names cannot be removed from a Bloom filter. Deleted and renamed-away
+# names are left in place (they only cost an extra database check), and
+# the filter is rebuilt once too many have piled up or it is full.
+
+import hashlib
+import math
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import indexes
+import models
+from config import settings
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter over strings, sized for a given capacity and
+    false-positive rate.
+    """
+    __slots__ = ("size", "hash_count", "bits")
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        # Double hashing: derive every position from two halves of one digest.
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def might_contain(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+class NameFilter(indexes.DerivedIndex):
+    """
+    A Bloom filter over `players.name`, sized from the number of players
+    when it is built.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._clear()
+
+    def _clear(self):
+        self._filter = None
+        self._capacity = 0
+        self._added = 0
+        self._stale = 0
+
+    def _load(self, db: Session):
+        player_count = db.query(func.count(models.Player.id)).scalar()
+        # Leave room to grow, so the filter is not rebuilt straight away.
+        self._capacity = max(settings.name_filter_capacity, 2 * player_count)
+        self._filter = BloomFilter(self._capacity, settings.name_filter_error_rate)
+        for name, in db.query(models.Player.name).yield_per(5000):
+            if name is not None:
+                self._filter.add(name)
+                self._added += 1
+
+    def _rebuild_if_degraded(self):
+        # Past its capacity, or with too many stale names, the false-positive
+        # rate climbs, so the filter is rebuilt from the database on next use.
+        if self._added > self._capacity or self._stale > self._capacity * settings.name_filter_max_stale_fraction:
+            self._clear()
+            self._loaded = False
+
+    def add(self, name: str):
+        """
+        Records a name that has been created or renamed to.
+        """
+        with self._lock:
+            if self._loaded:
+                self._filter.add(name)
+                self._added += 1
+                self._rebuild_if_degraded()
+
+    def discard(self, count: int = 1):
+        """
+        Records that names have been deleted or renamed away from.
+        """
+        with self._lock:
+            if self._loaded:
+                self._stale += count
+                self._rebuild_if_degraded()
+
+    def might_exist(self, db: Session, name: str) -> bool:
+        """
+        Returns False if the name is definitely not taken, True if it may be.
+        """
+        self.ensure_loaded(db)
+        with self._lock:
+            return self._filter.might_contain(name) if self._filter else True
+
+index = indexes.register(NameFilter())
@@ -0,0 +1,121 @@
+# This file keeps an in-memory index for typeahead player search. Names are
+# held in sorted lists, so the players matching a prefix are a contiguous
+# slice that is found with a binary search instead of a `LIKE '%term%'`
+# scan over the players table on every keystroke.
+#
+# A query matches the start of a name first, and then the start of any
+# word inside it, so "fox" finds "SwiftFox" as well as "Foxtrot".
+
+import bisect
+import re
+from typing import Dict, List, Tuple
+
+from sqlalchemy.orm import Session
+
+import indexes
+import models
+
+# Words start at a capital letter, a run of digits, or after a separator,
+# so "SwiftFox_2" is made of "Swift", "Fox" and "2".
+_WORD_START = re.compile(r"[A-Z][a-z]*|[a-z]+|\d+")
+
+def word_suffixes(name: str) -> List[str]:
+    """
+    Returns the lowercased tails of a name that start at each of its
+    words after the first.
+    """
+    starts = [match.start() for match in _WORD_START.finditer(name)]
+    return sorted({name[start:].lower() for start in starts if start > 0})
+
+class NameSearchIndex(indexes.DerivedIndex):
+    """
+    Two sorted lists of (key, player_id): one keyed by whole names and one
+    by the word suffixes of names.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._clear()
+
+    def _clear(self):
+        self._names: List[Tuple[str, int]] = []
+        self._words: List[Tuple[str, int]] = []
+        self._by_id: Dict[int, str] = {}
+
+    def _load(self, db: Session):
+        for player_id, name in db.query(models.Player.id, models.Player.name).yield_per(5000):
+            if name is None:
+                continue
+            self._by_id[player_id] = name
+            self._names.append((name.lower(), player_id))
+            self._words.extend((suffix, player_id) for suffix in word_suffixes(name))
+        # Sorting once is much faster than inserting a million names in order.
+        self._names.sort()
+        self._words.sort()
+
+    @staticmethod
+    def _remove(keys: List[Tuple[str, int]], key: Tuple[str, int]):
+        position = bisect.bisect_left(keys, key)
+        if position < len(keys) and keys[position] == key:
+            del keys[position]
+
+    def _discard(self, player_id: int):
+        name = self._by_id.pop(player_id, None)
+        if name is None:
+            return
+        self._remove(self._names, (name.lower(), player_id))
+        for suffix in word_suffixes(name):
+            self._remove(self._words, (suffix, player_id))
+
+    def add(self, player_id: int, name: str):
+        """
+        Adds a new player, or updates the name of a renamed one.
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            self._discard(player_id)
+            self._by_id[player_id] = name
+            bisect.insort(self._names, (name.lower(), player_id))
+            for suffix in word_suffixes(name):
+                bisect.insort(self._words, (suffix, player_id))
+
+    def discard_players(self, player_ids: List[int]):
+        """
+        Removes deleted players.
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            for player_id in player_ids:
+                self._discard(player_id)
+
+    @staticmethod
+    def _prefixed(keys: List[Tuple[str, int]], prefix: str):
+        for position in range(bisect.bisect_left(keys, (prefix,)), len(keys)):
+            key, player_id = keys[position]
+            if not key.startswith(prefix):
+                return
+            yield player_id
+
+    def search(self, db: Session, query: str, limit: int = 10) -> List[Tuple[int, str]]:
+        """
+        Returns up to `limit` (player_id, name) pairs whose name starts with
+        the query, followed by those with a word inside the name that starts
+        with it. Within each group, matches come in alphabetical order of the
+        matching part, ignoring case, so an exact match comes first.
+        """
+        prefix = query.strip().lower()
+        if not prefix or limit <= 0:
+            return []
+        self.ensure_loaded(db)
+        with self._lock:
+            matches: Dict[int, str] = {}
+            for keys in (self._names, self._words):
+                for player_id in self._prefixed(keys, prefix):
+                    if len(matches) >= limit:
+                        break
+                    matches.setdefault(player_id, self._by_id[player_id])
+            return list(matches.items())
+
+index = indexes.register(NameSearchIndex())
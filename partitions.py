@@ -0,0 +1,321 @@
+# This file stores archived runs in monthly partitions: one SQLite file per
+# month of run start under `partition_dir`, holding that month's runs and
+# their events. When the retention job archives runs with
+# `archive_partitioned` set, it moves them here rather than into compressed
+# JSON Lines files, so they stay queryable.
+#
+# With `partition_live_events`, the packed events of finished runs that
+# are still in the database (see `event_store`) are kept in the partition
+# of the month the run started as well, rather than in `run_event_packs`.
+# They are the bulk of a live run's data. Live runs themselves, and the
+# event rows of runs in progress, stay in the unpartitioned `runs` and
+# `run_events` tables of the database, so queries over live runs are not
+# pruned by month. A month whose file still holds the packs of live runs
+# is not dropped.
+#
+# A date-range query over archived runs attaches only the months that
+# overlap the range to a scratch connection, so the other months are never
+# read. Dropping a month deletes its file, however many archived runs it
+# holds, instead of running a large DELETE. The files are plain SQLite
+# whatever the primary database is.
+
+import datetime
+import json
+import os
+import re
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import models
+import schemas
+from config import settings
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    player_id INTEGER,
+    map_id TEXT,
+    started_at TEXT NOT NULL,
+    ended_at TEXT,
+    status TEXT,
+    duration_seconds INTEGER,
+    level INTEGER,
+    xp INTEGER,
+    kills_total INTEGER,
+    upgrades TEXT,
+    cause_of_death TEXT,
+    progress BLOB
+);
+CREATE INDEX IF NOT EXISTS ix_runs_started_at ON runs (started_at);
+CREATE INDEX IF NOT EXISTS ix_runs_player_id ON runs (player_id);
+CREATE TABLE IF NOT EXISTS run_events (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL,
+    event_type TEXT NOT NULL,
+    value TEXT,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_run_events_run_id ON run_events (run_id);
+CREATE TABLE IF NOT EXISTS run_event_packs (
+    run_id INTEGER PRIMARY KEY,
+    event_count INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+"""
+
+_RUN_COLUMNS = (
+    "id", "player_id", "map_id", "started_at", "ended_at", "status", "duration_seconds",
+    "level", "xp", "kills_total", "upgrades", "cause_of_death",
+)
+
+MONTH_PATTERN = r"^\d{4}-(0[1-9]|1[0-2])$"
+_FILE_NAME = re.compile(r"^runs-(\d{4}-\d{2})\.db$")
+
+# SQLite attaches at most 10 databases to one connection by default.
+_MAX_ATTACHED = 10
+
+def _timestamp(value: Optional[datetime.datetime]) -> Optional[str]:
+    # A fixed width keeps the stored text in chronological order.
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f") if value else None
+
+def naive_utc(value: datetime.datetime) -> datetime.datetime:
+    """
+    Converts a time with a time zone to naive UTC, which is how SQLite
+    keeps times. Naive times are returned as they are.
+    """
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+def month_of(value: datetime.datetime) -> str:
+    return f"{value.year:04d}-{value.month:02d}"
+
+def partition_path(month: str) -> str:
+    if not re.match(MONTH_PATTERN, month):
+        raise ValueError(f"Not a month: {month}")
+    return os.path.join(settings.partition_dir, f"runs-{month}.db")
+
+def list_months() -> List[str]:
+    """
+    Returns the months that have a partition, oldest first.
+    """
+    if not os.path.isdir(settings.partition_dir):
+        return []
+    return sorted(match.group(1) for match in map(_FILE_NAME.match, os.listdir(settings.partition_dir)) if match)
+
+def _month_start(month: str) -> datetime.datetime:
+    year, number = map(int, month.split("-"))
+    return datetime.datetime(year, number, 1)
+
+def _next_month(month: str) -> str:
+    start = _month_start(month)
+    return month_of((start + datetime.timedelta(days=32)).replace(day=1))
+
+def _connect(month: str) -> sqlite3.Connection:
+    os.makedirs(settings.partition_dir, exist_ok=True)
+    connection = sqlite3.connect(partition_path(month))
+    connection.executescript(_SCHEMA)
+    return connection
+
+def write_runs(runs: List[models.Run], events: Dict[int, List[schemas.RunEvent]], progress: Dict[int, bytes]):
+    """
+    Copies runs, with the given events and progress series of each, into
+    the partitions for the months they started in. Runs already present
+    are replaced, so a chunk that was copied but not yet deleted from the
+    database can safely be copied again.
+    """
+    by_month: Dict[str, List[models.Run]] = {}
+    for run in runs:
+        by_month.setdefault(month_of(run.started_at), []).append(run)
+    for month, month_runs in by_month.items():
+        connection = _connect(month)
+        try:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO runs ({', '.join(_RUN_COLUMNS)}, progress) VALUES ({', '.join('?' * (len(_RUN_COLUMNS) + 1))})",
+                [
+                    (
+                        run.id, run.player_id, run.map_id, _timestamp(run.started_at), _timestamp(run.ended_at),
+                        run.status.value if run.status else None, run.duration_seconds, run.level, run.xp,
+                        run.kills_total, json.dumps(run.upgrades) if run.upgrades is not None else None,
+                        run.cause_of_death, progress.get(run.id),
+                    )
+                    for run in month_runs
+                ],
+            )
+            run_ids = [run.id for run in month_runs]
+            connection.execute(f"DELETE FROM run_events WHERE run_id IN ({', '.join('?' * len(run_ids))})", run_ids)
+            connection.executemany(
+                "INSERT INTO run_events (id, run_id, event_type, value, timestamp) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (event.id, run.id, event.event_type, event.value, _timestamp(event.timestamp))
+                    for run in month_runs
+                    for event in events.get(run.id, [])
+                ],
+            )
+            connection.commit()
+        finally:
+            connection.close()
+
+def query_runs(
+    start: datetime.datetime,
+    end: datetime.datetime,
+    player_id: Optional[int] = None,
+    limit: int = 100,
+) -> List[dict]:
+    """
+    Returns archived runs that started in [start, end), oldest first, with
+    their number of events. Only the overlapping months are read.
+    """
+    start, end = naive_utc(start), naive_utc(end)
+    months = [
+        month for month in list_months()
+        if _month_start(month) < end and _month_start(_next_month(month)) > start
+    ]
+    filters = "started_at >= ? AND started_at < ?" + (" AND player_id = ?" if player_id is not None else "")
+    params = [_timestamp(start), _timestamp(end)] + ([player_id] if player_id is not None else [])
+    columns = ", ".join(f"r.{column}" for column in _RUN_COLUMNS)
+
+    rows: List[dict] = []
+    connection = sqlite3.connect(":memory:")
+    connection.row_factory = sqlite3.Row
+    try:
+        # Months are disjoint and in order, so each batch continues the last.
+        for batch_start in range(0, len(months), _MAX_ATTACHED):
+            if len(rows) >= limit:
+                break
+            batch = months[batch_start:batch_start + _MAX_ATTACHED]
+            for index, month in enumerate(batch):
+                connection.execute(f"ATTACH DATABASE ? AS p{index}", (partition_path(month),))
+            try:
+                sql = " UNION ALL ".join(
+                    f"SELECT {columns}, (SELECT COUNT(*) FROM p{index}.run_events e WHERE e.run_id = r.id) AS event_count "
+                    f"FROM p{index}.runs r WHERE {filters}"
+                    for index in range(len(batch))
+                ) + " ORDER BY started_at, id LIMIT ?"
+                cursor = connection.execute(sql, params * len(batch) + [limit - len(rows)])
+                for row in cursor:
+                    run = dict(row)
+                    run["upgrades"] = json.loads(run["upgrades"]) if run["upgrades"] is not None else None
+                    rows.append(run)
+            finally:
+                for index in range(len(batch)):
+                    connection.execute(f"DETACH DATABASE p{index}")
+    finally:
+        connection.close()
+    return rows
+
+# --- Live Event Packs ---
+
+def read_pack(run_id: int, started_at: datetime.datetime) -> Optional[bytes]:
+    """
+    Returns the packed events of a live run kept in its month's partition,
+    or None if there are none.
+    """
+    path = partition_path(month_of(started_at))
+    if not os.path.exists(path):
+        return None
+    connection = sqlite3.connect(path)
+    try:
+        row = connection.execute("SELECT data FROM run_event_packs WHERE run_id = ?", (run_id,)).fetchone()
+    except sqlite3.OperationalError:
+        # A partition written before live packs were kept in them.
+        return None
+    finally:
+        connection.close()
+    return row[0] if row else None
+
+def write_pack(run_id: int, started_at: datetime.datetime, event_count: int, data: bytes):
+    """
+    Stores the packed events of a live run in its month's partition,
+    replacing any it already has there.
+    """
+    connection = _connect(month_of(started_at))
+    try:
+        connection.execute(
+            "INSERT OR REPLACE INTO run_event_packs (run_id, event_count, data) VALUES (?, ?, ?)",
+            (run_id, event_count, data),
+        )
+        connection.commit()
+    finally:
+        connection.close()
+
+def delete_packs(runs: Iterable[Tuple[int, datetime.datetime]]):
+    """
+    Deletes the packed events kept for the given (run ID, start) pairs.
+    """
+    by_month: Dict[str, List[int]] = {}
+    for run_id, started_at in runs:
+        by_month.setdefault(month_of(started_at), []).append(run_id)
+    for month, run_ids in by_month.items():
+        if not os.path.exists(partition_path(month)):
+            continue
+        connection = _connect(month)
+        try:
+            connection.execute(f"DELETE FROM run_event_packs WHERE run_id IN ({', '.join('?' * len(run_ids))})", run_ids)
+            connection.commit()
+        finally:
+            connection.close()
+
+def partition_info(month: str) -> Optional[dict]:
+    """
+    Returns a partition's number of runs and file size, or None if the
+    month has no partition.
+    """
+    path = partition_path(month)
+    if not os.path.exists(path):
+        return None
+    connection = sqlite3.connect(path)
+    try:
+        runs = connection.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+    finally:
+        connection.close()
+    return {"month": month, "runs": runs, "size_bytes": os.path.getsize(path)}
+
+def drop_month(month: str) -> bool:
+    """
+    Drops a month of archived runs by deleting its file. Queries that have
+    the month attached finish reading their already open file. Raises a
+    ValueError, and keeps the file, if it still holds the packed events of
+    live runs.
+    """
+    path = partition_path(month)
+    if not os.path.exists(path):
+        return False
+    connection = sqlite3.connect(path, isolation_level=None)
+    try:
+        # Held until the file is gone, so no pack can be written meanwhile.
+        connection.execute("BEGIN EXCLUSIVE")
+        try:
+            live = connection.execute("SELECT COUNT(*) FROM run_event_packs").fetchone()[0]
+        except sqlite3.OperationalError:
+            # A partition written before live packs were kept in them.
+            live = 0
+        if live:
+            raise ValueError(f"The {month} partition still holds the events of {live} live runs")
+        os.remove(path)
+    finally:
+        connection.close()
+    return True
+
+def drop_expired(now: Optional[datetime.datetime] = None) -> List[str]:
+    """
+    Drops the months that ended more than `partition_max_age_months` months
+    before the current one, and returns them. Months that still hold the
+    packed events of live runs are kept until those runs are archived or
+    deleted.
+    """
+    if settings.partition_max_age_months is None:
+        return []
+    now = now or datetime.datetime.now()
+    oldest_kept = now.year * 12 + now.month - 1 - settings.partition_max_age_months
+    dropped = []
+    for month in list_months():
+        start = _month_start(month)
+        if start.year * 12 + start.month - 1 >= oldest_kept:
+            continue
+        try:
+            if drop_month(month):
+                dropped.append(month)
+        except ValueError:
+            continue
+    return dropped
@@ -0,0 +1,228 @@
+# This file keeps an order-statistic index over the durations of finished
+# runs, so that the rank and percentile of any run, or of any player's best
+# run, can be looked up in O(log n), both overall and on each map. Counts
+# are held in Fenwick trees indexed by duration in whole seconds.
+
+from collections import Counter
+from typing import Dict, Hashable, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+import indexes
+import models
+import schemas
+from config import settings
+
+class FenwickCounter:
+    """
+    Counts how many values fall on each whole number from 0 upwards, with
+    O(log n) updates and O(log n) "how many are greater than x" queries.
+    The tree starts small and doubles in size as larger values arrive.
+    """
+    __slots__ = ("tree", "total")
+
+    def __init__(self, size: int = 1024):
+        self.tree = [0] * (size + 1)
+        self.total = 0
+
+    def _grow(self, value: int):
+        size = len(self.tree) - 1
+        while value >= size:
+            # Every new node covers only empty positions, apart from the last,
+            # which covers the whole tree.
+            self.tree.extend([0] * size)
+            size *= 2
+            self.tree[size] = self.total
+
+    def add(self, value: int, delta: int):
+        self._grow(value)
+        self.total += delta
+        position = value + 1
+        while position < len(self.tree):
+            self.tree[position] += delta
+            position += position & -position
+
+    def count_at_most(self, value: int) -> int:
+        """Returns how many values are less than or equal to `value`."""
+        position = min(value + 1, len(self.tree) - 1)
+        count = 0
+        while position > 0:
+            count += self.tree[position]
+            position -= position & -position
+        return count
+
+    def position(self, value: int) -> schemas.RankPosition:
+        """
+        Returns the rank of a value that is in the counter. Ties share the
+        same rank, and the percentile is the share of values at or below it.
+        """
+        at_most = self.count_at_most(value)
+        return schemas.RankPosition(
+            rank=self.total - at_most + 1,
+            total=self.total,
+            percentile=round(100.0 * at_most / self.total, 2),
+        )
+
+class RankIndex(indexes.DerivedIndex):
+    """
+    Ranks finished runs by duration overall and per map, and ranks players
+    by their best finished run overall and per map.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._clear()
+
+    def _clear(self):
+        # run_id -> (player_id, map_id, duration)
+        self._runs: Dict[int, Tuple[int, Optional[str], int]] = {}
+        self._run_counts = FenwickCounter()
+        self._run_counts_by_map: Dict[Optional[str], FenwickCounter] = {}
+        # How many of each player's runs have each duration, overall and
+        # per (player_id, map_id), and the maps each player has runs on.
+        self._durations: Dict[int, Counter] = {}
+        self._durations_by_map: Dict[Tuple[int, Optional[str]], Counter] = {}
+        self._player_maps: Dict[int, Set[Optional[str]]] = {}
+        # Each player's best duration, overall and per (player_id, map_id).
+        self._best: Dict[int, int] = {}
+        self._best_by_map: Dict[Tuple[int, Optional[str]], int] = {}
+        self._best_counts = FenwickCounter()
+        self._best_counts_by_map: Dict[Optional[str], FenwickCounter] = {}
+
+    def _load(self, db: Session):
+        rows = (
+            db.query(models.Run.id, models.Run.player_id, models.Run.map_id, models.Run.duration_seconds)
+            .filter(models.Run.status.in_(models.TERMINAL_STATUSES))
+            .yield_per(1000)
+        )
+        for run_id, player_id, map_id, duration in rows:
+            self._upsert(run_id, player_id, map_id, duration)
+
+    @staticmethod
+    def _bucket(duration: Optional[int]) -> int:
+        # Very long runs share the top bucket, which keeps the trees bounded.
+        return max(0, min(duration or 0, settings.rank_max_duration_seconds))
+
+    @staticmethod
+    def _add_best(durations: Counter, best: Dict[Hashable, int], key: Hashable, counts: FenwickCounter, duration: int):
+        """
+        Counts one more run of a player's, raising their best if it is longer.
+        """
+        durations[duration] += 1
+        previous = best.get(key)
+        if previous is None or duration > previous:
+            if previous is not None:
+                counts.add(previous, -1)
+            best[key] = duration
+            counts.add(duration, 1)
+
+    @staticmethod
+    def _discard_best(durations: Counter, best: Dict[Hashable, int], key: Hashable, counts: FenwickCounter, duration: int) -> bool:
+        """
+        Counts one run of a player's fewer. Their durations are only looked
+        through again if it was their last run at their best duration.
+        Returns whether the player has no runs left.
+        """
+        durations[duration] -= 1
+        if durations[duration]:
+            return False
+        del durations[duration]
+        if best[key] == duration:
+            counts.add(duration, -1)
+            if durations:
+                best[key] = max(durations)
+                counts.add(best[key], 1)
+            else:
+                del best[key]
+        return not durations
+
+    def _remove(self, run_id: int):
+        found = self._runs.pop(run_id, None)
+        if found is None:
+            return
+        player_id, map_id, duration = found
+        self._run_counts.add(duration, -1)
+        self._run_counts_by_map[map_id].add(duration, -1)
+        if self._discard_best(self._durations[player_id], self._best, player_id, self._best_counts, duration):
+            del self._durations[player_id]
+        key = (player_id, map_id)
+        if self._discard_best(self._durations_by_map[key], self._best_by_map, key, self._best_counts_by_map[map_id], duration):
+            del self._durations_by_map[key]
+            self._player_maps[player_id].discard(map_id)
+            if not self._player_maps[player_id]:
+                del self._player_maps[player_id]
+
+    def _upsert(self, run_id: int, player_id: int, map_id: Optional[str], duration: Optional[int]):
+        self._remove(run_id)
+        duration = self._bucket(duration)
+        self._runs[run_id] = (player_id, map_id, duration)
+        self._run_counts.add(duration, 1)
+        self._run_counts_by_map.setdefault(map_id, FenwickCounter()).add(duration, 1)
+        self._add_best(self._durations.setdefault(player_id, Counter()), self._best, player_id, self._best_counts, duration)
+        key = (player_id, map_id)
+        self._add_best(
+            self._durations_by_map.setdefault(key, Counter()), self._best_by_map, key,
+            self._best_counts_by_map.setdefault(map_id, FenwickCounter()), duration,
+        )
+        self._player_maps.setdefault(player_id, set()).add(map_id)
+
+    def record(self, run: models.Run):
+        """
+        Adds or updates a finished run.
+        """
+        with self._lock:
+            if self._loaded:
+                self._upsert(run.id, run.player_id, run.map_id, run.duration_seconds)
+
+    def discard_runs(self, run_ids):
+        """
+        Removes deleted runs.
+        """
+        with self._lock:
+            if self._loaded:
+                for run_id in run_ids:
+                    self._remove(run_id)
+
+    def run_rank(self, db: Session, run_id: int) -> Optional[schemas.RunRank]:
+        """
+        Returns where a finished run places overall and on its map, or None
+        if the run is unknown or has not finished.
+        """
+        self.ensure_loaded(db)
+        with self._lock:
+            found = self._runs.get(run_id)
+            if found is None:
+                return None
+            player_id, map_id, duration = found
+            return schemas.RunRank(
+                run_id=run_id,
+                player_id=player_id,
+                map_id=map_id,
+                duration_seconds=duration,
+                overall=self._run_counts.position(duration),
+                on_map=self._run_counts_by_map[map_id].position(duration),
+            )
+
+    def player_rank(self, db: Session, player_id: int) -> Optional[schemas.PlayerRank]:
+        """
+        Returns where a player's best finished run places them among all
+        players, overall and on each map they have played, or None if they
+        have no finished runs.
+        """
+        self.ensure_loaded(db)
+        with self._lock:
+            best = self._best.get(player_id)
+            if best is None:
+                return None
+            return schemas.PlayerRank(
+                player_id=player_id,
+                best_run_seconds=best,
+                overall=self._best_counts.position(best),
+                by_map={
+                    map_id: self._best_counts_by_map[map_id].position(self._best_by_map[(player_id, map_id)])
+                    for map_id in self._player_maps[player_id]
+                    if map_id is not None
+                },
+            )
+
+index = indexes.register(RankIndex())
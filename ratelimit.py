@@ -0,0 +1,156 @@
+# This file implements admission control with token buckets. Each limited
+# route group has a bucket per client IP (or per client IP and player name
+# for sign-ins, or one for the whole group) that holds up to
+# `rate_limit_bursts[group]` tokens and refills at
+# `rate_limit_rates[group]` tokens per second. A request takes one token;
+# when the bucket is empty it is turned away with a 429 and a
+# `Retry-After` header saying when the next token will be there.
+#
+# Buckets live in memory by default, where a check costs about a
+# microsecond. With several workers each would keep its own buckets, so
+# `rate_limit_backend = "sqlite"` shares them through a small SQLite file
+# instead, at the cost of a short write transaction per check.
+
+import math
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Tuple
+
+from fastapi import HTTPException, Request
+
+import metrics
+from config import settings
+
+class MemoryBackend:
+    """
+    Buckets held in this process, as (tokens, last update, time full).
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+        self._lock = threading.Lock()
+        self._max_keys = max_keys
+        self._sweep_at = max_keys
+
+    def take(self, key: str, rate: float, burst: int) -> float:
+        """
+        Takes a token from a bucket. Returns 0 if one was available, or
+        otherwise the number of seconds until one will be.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._buckets.get(key)
+            if state is None:
+                tokens = float(burst)
+                if len(self._buckets) >= self._sweep_at:
+                    self._sweep(now)
+            else:
+                tokens = min(burst, state[0] + (now - state[1]) * rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+                return (1 - tokens) / rate
+            tokens -= 1
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            return 0.0
+
+    def _sweep(self, now: float):
+        # A bucket that has refilled is the same as no bucket at all.
+        self._buckets = {key: state for key, state in self._buckets.items() if state[2] > now}
+        self._sweep_at = max(self._max_keys, 2 * len(self._buckets))
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+class SQLiteBackend:
+    """
+    Buckets shared by every worker process through a SQLite file. Each
+    thread keeps its own connection.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, isolation_level=None, timeout=5.0)
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def take(self, key: str, rate: float, burst: int) -> float:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # Wall-clock time, since the buckets are shared between processes.
+            now = time.time()
+            row = connection.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens = float(burst) if row is None else min(burst, row[0] + max(now - row[1], 0.0) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            connection.execute(
+                "INSERT INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now),
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return wait
+
+    def clear(self):
+        connection = self._connection()
+        connection.execute("DELETE FROM rate_buckets")
+
+def _make_backend():
+    if settings.rate_limit_backend == "sqlite":
+        return SQLiteBackend(settings.rate_limit_sqlite_path)
+    if settings.rate_limit_backend == "memory":
+        return MemoryBackend()
+    raise ValueError(f"Unknown rate limit backend: {settings.rate_limit_backend}")
+
+backend = _make_backend()
+
+def check(group: str, key: str):
+    """
+    Admits one request to `group` for `key`, or raises a 429 if its bucket
+    is empty. Groups without a configured rate are not limited.
+    """
+    rate = settings.rate_limit_rates.get(group)
+    if not settings.rate_limit_enabled or not rate:
+        return
+    wait = backend.take(f"{group}:{key}", rate, settings.rate_limit_bursts.get(group, 1))
+    if wait:
+        metrics.record_rate_limited(group)
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests, please slow down",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+def check_player(request: Request, player_name: str):
+    """
+    Admits one sign-in attempt for a player from the requesting client.
+    The bucket is per client IP and player name, so knowing a player's
+    name is not enough to use up their sign-ins from elsewhere.
+    """
+    check("player", f"{client_ip(request)}:{player_name}")
+
+def limit(group: str, per_client: bool = True) -> Callable[[Request], None]:
+    """
+    Returns a dependency that limits a route group, with a bucket per
+    client IP, or one bucket for the whole group if `per_client` is False.
+    """
+    def dependency(request: Request):
+        check(group, client_ip(request) if per_client else "*")
+    return dependency
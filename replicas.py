@@ -0,0 +1,239 @@
+# This file routes the reads of analytics and list endpoints to a replica
+# of the database, so that they no longer compete with gameplay writes on
+# the primary. The replica is either a separate database kept up to date by
+# the database itself (`replica_database_url`) or, for local use, a copy of
+# the primary SQLite file that is refreshed in the background with SQLite's
+# online backup API (`replica_snapshot_path`), or restored from the newest
+# backup (`replica_from_backups`, see `backup`).
+#
+# Writes, and reads that must see them (such as fetching the run a client
+# has just updated), keep using `get_db` and the primary. Endpoints that can
+# serve slightly stale data use `get_read_db` instead, which falls back to
+# the primary whenever the replica is more than `replica_max_lag_seconds`
+# behind. Lag is measured with the delta-sync change sequence, which every
+# player and run write advances. The primary's sequence is sampled on each
+# check, and the replica is as fresh as the primary was at the newest
+# sample no further along than the replica, so a replica that trails a
+# busy primary by a few writes still reports a lag of a moment.
+
+import collections
+import datetime
+import logging
+import os
+import threading
+import time
+from typing import Callable, Deque, Optional, Tuple
+
+from fastapi import Request
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+import backup
+import models
+from config import settings
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+# The number of samples of the primary's change sequence kept for
+# measuring lag. Lag beyond what they cover counts as too far behind.
+LAG_HISTORY_SAMPLES = 256
+
+def _last_seq(db: Session) -> int:
+    state = db.get(models.SyncState, 1)
+    return state.last_seq if state else 0
+
+class Replica:
+    """
+    The configured read replica, with its measured lag.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Lag checks come from concurrent request threads.
+        self._lag_lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self._engine = None
+        self._sessionmaker: Optional[sessionmaker] = None
+        # The monotonic time at which the replica was last known to hold
+        # every committed change, or None if it never has.
+        self._fresh_at: Optional[float] = None
+        # Recent (primary change sequence, monotonic time) samples, oldest first.
+        self._history: Deque[Tuple[int, float]] = collections.deque(maxlen=LAG_HISTORY_SAMPLES)
+        self._checked_at = 0.0
+        self._refreshing = False
+        self._refresh_started_at: Optional[float] = None
+        self._restored_backup: Optional[str] = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(settings.replica_database_url or settings.replica_snapshot_path)
+
+    @property
+    def lag_seconds(self) -> Optional[float]:
+        """
+        How long ago the primary last had no change that the replica lacks.
+        """
+        return None if self._fresh_at is None else time.monotonic() - self._fresh_at
+
+    def _session(self) -> Session:
+        with self._lock:
+            if self._sessionmaker is None:
+                url = settings.replica_database_url or f"sqlite:///{settings.replica_snapshot_path}"
+                connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+                self._engine = create_engine(url, connect_args=connect_args)
+                self._sessionmaker = sessionmaker(autocommit=False, autoflush=False, bind=self._engine)
+            return self._sessionmaker()
+
+    def _check_lag(self, primary: Callable[[], Session]):
+        """
+        Compares the replica's change sequence with the primary's, at most
+        once per `replica_lag_check_interval_seconds`.
+        """
+        with self._lag_lock:
+            now = time.monotonic()
+            if now - self._checked_at < settings.replica_lag_check_interval_seconds:
+                return
+            self._checked_at = now
+        if settings.replica_snapshot_path and not os.path.exists(settings.replica_snapshot_path):
+            return
+        try:
+            with self._session() as replica_db:
+                replica_seq = _last_seq(replica_db)
+        except Exception:
+            logger.exception("Checking the read replica failed")
+            with self._lag_lock:
+                self._fresh_at = None
+            return
+        primary_seq = _last_seq(primary())
+        with self._lag_lock:
+            self._history.append((primary_seq, now))
+            for sampled_seq, sampled_at in reversed(self._history):
+                if sampled_seq <= replica_seq:
+                    self._fresh_at = max(self._fresh_at or 0.0, sampled_at)
+                    break
+
+    def refresh_snapshot(self, primary_bind):
+        """
+        Refreshes the snapshot at the snapshot path, by copying the primary
+        a batch of pages at a time so writers are never blocked for long,
+        or with `replica_from_backups` by restoring the newest backup. The
+        copy is written beside the snapshot and then moved into place, so
+        readers always see a whole snapshot.
+        """
+        path = settings.replica_snapshot_path
+        partial = f"{path}.partial"
+        if settings.replica_from_backups:
+            backups = backup.list_backups()
+            if not backups or backups[0]["name"] == self._restored_backup:
+                return
+            # Backups are dated by the wall clock, and lag by the monotonic one.
+            age = (datetime.datetime.now() - backups[0]["created_at"]).total_seconds()
+            taken_at = time.monotonic() - age
+            backup.restore(backups[0]["path"], partial)
+            self._restored_backup = backups[0]["name"]
+        else:
+            taken_at = time.monotonic()
+            backup.copy_database(primary_bind, partial, pages=settings.replica_snapshot_pages)
+        os.replace(partial, path)
+        with self._lock:
+            if self._engine is not None:
+                # Pooled connections still have the old file open.
+                self._engine.dispose()
+            self._fresh_at = max(self._fresh_at or 0.0, taken_at)
+
+    def _refresh_in_background(self, primary_bind):
+        now = time.monotonic()
+        with self._lock:
+            if self._refreshing:
+                return
+            # A refresh that failed, or found no newer backup, is not retried
+            # on every request.
+            if self._refresh_started_at is not None and now - self._refresh_started_at < settings.replica_snapshot_interval_seconds:
+                return
+            self._refreshing = True
+            self._refresh_started_at = now
+
+        def refresh():
+            try:
+                self.refresh_snapshot(primary_bind)
+            except Exception:
+                logger.exception("Refreshing the replica snapshot failed")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=refresh, name="replica-snapshot", daemon=True).start()
+
+    def session_for(self, primary: Callable[[], Session]) -> Optional[Session]:
+        """
+        Returns a session on the replica if it is within the allowed lag,
+        or None if reads should stay on the primary. `primary` returns the
+        primary session, and is only called when it is needed.
+        """
+        if not self.configured:
+            return None
+        self._check_lag(primary)
+        lag = self.lag_seconds
+        if settings.replica_snapshot_path and (lag is None or lag > settings.replica_snapshot_interval_seconds):
+            self._refresh_in_background(primary().get_bind())
+        if lag is None or lag > settings.replica_max_lag_seconds:
+            return None
+        db = self._session()
+        # Derived indexes must be built from the primary, see `indexes`.
+        db.info["primary"] = primary
+        return db
+
+    def reset(self):
+        """
+        Drops the replica connections and lag, so that changed settings
+        take effect.
+        """
+        with self._lock:
+            if self._engine is not None:
+                self._engine.dispose()
+            self._clear()
+
+replica = Replica()
+
+class _LazyPrimary:
+    """
+    The primary session of a request, opened through `get_db` (or its
+    override) the first time it is asked for.
+    """
+
+    def __init__(self, request: Request):
+        self._get_db = request.app.dependency_overrides.get(get_db, get_db)
+        self._sessions = None
+        self._session: Optional[Session] = None
+
+    def __call__(self) -> Session:
+        if self._session is None:
+            self._sessions = self._get_db()
+            self._session = next(self._sessions)
+        return self._session
+
+    def close(self):
+        if self._sessions is not None:
+            self._sessions.close()
+
+def get_read_db(request: Request):
+    """
+    A dependency for endpoints that may serve slightly stale data. Provides
+    a session on the read replica when one is configured and close enough
+    to the primary, and the primary session otherwise. The primary session
+    is only opened if it is used.
+    """
+    primary = _LazyPrimary(request)
+    try:
+        read_db = replica.session_for(primary)
+        if read_db is None:
+            yield primary()
+            return
+        try:
+            yield read_db
+        finally:
+            read_db.close()
+    finally:
+        primary.close()
@@ -0,0 +1,191 @@
+# This file implements the data retention job. Finished runs that are
+# older than the configured age, or beyond a player's run cap, are moved
+# out of the `runs` and `run_events` tables into compressed archive files,
+# or into monthly partitions (see `partitions`).
+# Their contributions are folded into the per-player archive totals first,
+# so player statistics and the leaderboard stay correct.
+
+import datetime
+import gzip
+import json
+import os
+from typing import Callable, Iterator, List, Optional
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import Session, selectinload
+
+import backup
+import crud
+import event_store
+import models
+import partitions
+import sync
+import timeseries
+from config import settings
+
+def find_expired_run_ids(db: Session, now: Optional[datetime.datetime] = None) -> List[int]:
+    """
+    Returns the IDs of the finished runs that fall outside the retention
+    limits. The longest runs overall and on each map, and every run from
+    the current week, are always kept for the leaderboards.
+    """
+    now = now or datetime.datetime.now()
+    conditions = []
+    if settings.retention_max_age_days is not None:
+        cutoff = now - datetime.timedelta(days=settings.retention_max_age_days)
+        conditions.append(models.Run.started_at < cutoff)
+    if settings.retention_max_runs_per_player is not None:
+        # Number each player's runs from newest to oldest.
+        recency = func.row_number().over(
+            partition_by=models.Run.player_id,
+            order_by=(models.Run.started_at.desc(), models.Run.id.desc()),
+        ).label("recency")
+        ranked = select(models.Run.id, recency).subquery()
+        conditions.append(models.Run.id.in_(
+            select(ranked.c.id).where(ranked.c.recency > settings.retention_max_runs_per_player)
+        ))
+    if not conditions:
+        return []
+
+    # Runs from the current week may still be on the daily and weekly boards.
+    week_start = datetime.datetime.combine(now.date() - datetime.timedelta(days=now.weekday()), datetime.time())
+    query = db.query(models.Run.id).filter(
+        models.Run.status.in_(models.TERMINAL_STATUSES),
+        models.Run.started_at < week_start,
+        or_(*conditions),
+    )
+    if settings.retention_keep_top_runs > 0:
+        top_runs = (
+            select(models.Run.id)
+            .order_by(models.Run.duration_seconds.desc())
+            .limit(settings.retention_keep_top_runs)
+            .subquery()
+        )
+        query = query.filter(models.Run.id.notin_(select(top_runs.c.id)))
+        map_rank = func.row_number().over(
+            partition_by=models.Run.map_id,
+            order_by=models.Run.duration_seconds.desc(),
+        ).label("map_rank")
+        ranked_by_map = select(models.Run.id, map_rank).subquery()
+        query = query.filter(models.Run.id.notin_(
+            select(ranked_by_map.c.id).where(ranked_by_map.c.map_rank <= settings.retention_keep_top_runs)
+        ))
+    return [run_id for run_id, in query.order_by(models.Run.id)]
+
+def _serialize_run(db: Session, run: models.Run) -> dict:
+    """
+    Converts a run and its events into a JSON-compatible dictionary.
+    """
+    def isoformat(value):
+        return value.isoformat() if value else None
+
+    return {
+        "id": run.id,
+        "player_id": run.player_id,
+        "map_id": run.map_id,
+        "started_at": isoformat(run.started_at),
+        "ended_at": isoformat(run.ended_at),
+        "status": run.status.value if run.status else None,
+        "duration_seconds": run.duration_seconds,
+        "level": run.level,
+        "xp": run.xp,
+        "kills_total": run.kills_total,
+        "upgrades": run.upgrades,
+        "cause_of_death": run.cause_of_death,
+        "events": [
+            {
+                "id": event.id,
+                "event_type": event.event_type,
+                "value": event.value,
+                "timestamp": isoformat(event.timestamp),
+            }
+            for event in event_store.loaded_run_events(db, run)
+        ],
+        "progress": {
+            field: values.tolist()
+            for field, values in timeseries.decode(timeseries.series_data(run.progress)).items()
+        } if run.progress else None,
+    }
+
+def _load_run_chunks(db: Session, run_ids: List[int]) -> Iterator[List[models.Run]]:
+    """
+    Loads the given runs, with everything that is archived alongside them,
+    a chunk at a time.
+    """
+    chunk_size = settings.bulk_delete_chunk_size
+    for start in range(0, len(run_ids), chunk_size):
+        yield (
+            db.query(models.Run)
+            .options(selectinload(models.Run.events), selectinload(models.Run.event_pack), selectinload(models.Run.progress))
+            .filter(models.Run.id.in_(run_ids[start:start + chunk_size]))
+            .all()
+        )
+
+def archive_runs(
+    db: Session,
+    run_ids: List[int],
+    progress: Optional[Callable[[int], None]] = None,
+    archive_dir: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Moves the given runs into a new gzip-compressed JSON Lines file, one
+    run (with its events) per line, and returns the file's path. With
+    `archive_partitioned` set, they are moved into the monthly partitions
+    instead, and the partition directory is returned. Each chunk is
+    written out before the transaction that removes it from the database
+    is committed, so no run is ever lost.
+    """
+    if not run_ids:
+        return None
+    if settings.archive_partitioned:
+        for runs in _load_run_chunks(db, run_ids):
+            partitions.write_runs(
+                runs,
+                {run.id: event_store.loaded_run_events(db, run) for run in runs},
+                {run.id: timeseries.series_data(run.progress) for run in runs if run.progress},
+            )
+            crud.fold_and_delete_runs(db, runs)
+            db.commit()
+            if progress:
+                progress(len(runs))
+        return settings.partition_dir
+
+    archive_dir = archive_dir or settings.archive_dir
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"runs-{datetime.datetime.now():%Y%m%dT%H%M%S%f}.jsonl.gz")
+
+    with open(path, "wb") as file, gzip.GzipFile(fileobj=file, mode="wb") as archive:
+        # The new file must still be there after a crash, not just its data.
+        backup.sync_directory(archive_dir)
+        for runs in _load_run_chunks(db, run_ids):
+            for run in runs:
+                archive.write((json.dumps(_serialize_run(db, run)) + "\n").encode("utf-8"))
+            # Each chunk is on the disk before its runs are deleted.
+            archive.flush()
+            backup.sync_file(file)
+
+            crud.fold_and_delete_runs(db, runs)
+            db.commit()
+            if progress:
+                progress(len(runs))
+    return path
+
+def run_retention(db: Session, progress: Optional[Callable[[int], None]] = None) -> Optional[str]:
+    """
+    Archives every run that falls outside the retention limits, and prunes
+    old delta sync tombstones and partitions.
+    """
+    archive_path = archive_runs(db, find_expired_run_ids(db), progress=progress)
+    sync.prune_tombstones(db, settings.sync_tombstone_max_age_days)
+    partitions.drop_expired()
+    return archive_path
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        archive_path = run_retention(session)
+        print(f"Archived runs to {archive_path}" if archive_path else "No runs to archive")
+    finally:
+        session.close()
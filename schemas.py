@@ -3,8 +3,9 @@
 # These models ensure that the data flowing in and out of the API
 # has a consistent and predictable structure.
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 import datetime
+import enum
 from typing import Optional, List, Dict
 from models import RunStatus
 
@@ -28,6 +29,11 @@ class Player(PlayerBase):
     created_at: datetime.datetime
     model_config = ConfigDict(from_attributes=True)
 
+class PlayerMatch(BaseModel):
+    """Schema for a player matched by the typeahead search."""
+    id: int
+    name: str
+
 class PlayerCreateResponse(Player):
     """
     Schema for the response when a new player is created.
@@ -110,8 +116,105 @@ class RunStartResponse(BaseModel):
     player_id: int
     run_id: int
 
+class RunSubmitEvent(RunEventBase):
+    """An event in a submitted run, with the time it happened if known."""
+    timestamp: Optional[datetime.datetime] = None
+
+class RunSubmit(BaseModel):
+    """
+    Schema for submitting a complete, finished run in a single request,
+    for clients that record a run offline and upload it afterwards.
+    """
+    player_name: str
+    password: str
+    map_id: str
+    status: RunStatus = RunStatus.died
+    started_at: Optional[datetime.datetime] = None
+    ended_at: Optional[datetime.datetime] = None
+    duration_seconds: int = Field(0, ge=0)
+    level: int = 0
+    xp: int = 0
+    kills_total: int = Field(0, ge=0)
+    upgrades: Optional[Dict[str, int]] = None
+    cause_of_death: Optional[str] = None
+    # Bounded so that one request cannot hold the write lock for long.
+    events: List[RunSubmitEvent] = Field(default_factory=list, max_length=10000)
+
+    @model_validator(mode="after")
+    def require_finished(self):
+        if self.status == RunStatus.in_progress:
+            raise ValueError("Only finished runs can be submitted")
+        return self
+
+class RunSubmitResponse(RunStartResponse):
+    """Schema for the response when a complete run has been submitted."""
+    events_recorded: int
+
 # --- Analytics Schemas ---
 
+class DistributionMetric(str, enum.Enum):
+    """The per-run metrics whose distributions can be queried."""
+    duration_seconds = "duration_seconds"
+    kills_per_minute = "kills_per_minute"
+
+class Distribution(BaseModel):
+    """
+    Schema for estimated quantiles of a metric over finished runs: all
+    runs, one map's (`map_id`) or one player's (`player_id`). Quantiles are
+    keyed by the requested fraction, such as "0.5" for the median.
+    """
+    metric: DistributionMetric
+    map_id: Optional[str] = None
+    player_id: Optional[int] = None
+    runs: int
+    quantiles: Dict[str, Optional[float]]
+
+class ActivePlayers(BaseModel):
+    """
+    Schema for the estimated number of distinct players who started a run
+    between `start` and `end` inclusive, overall and on each map.
+    """
+    start: datetime.date
+    end: datetime.date
+    players: int
+    by_map: Dict[str, int]
+
+class Engagement(BaseModel):
+    """
+    Schema for the estimated daily, weekly and monthly active players up to
+    `day`, and `stickiness`, the share of monthly players active that day.
+    """
+    day: datetime.date
+    map_id: Optional[str] = None
+    daily: int
+    weekly: int
+    monthly: int
+    stickiness: float
+
+class RunCurve(BaseModel):
+    """
+    Schema for a run's progress over time, one list entry per sample.
+    """
+    run_id: int
+    duration_seconds: List[int]
+    kills_total: List[int]
+    xp: List[int]
+    level: List[int]
+
+class MapCurve(BaseModel):
+    """
+    Schema for the aggregate progress of a map's finished runs, sampled at
+    each time in `seconds`. `survival` is the share of runs still alive;
+    the averages are over the runs alive at that time.
+    """
+    map_id: str
+    runs: int
+    seconds: List[int]
+    survival: List[float]
+    average_kills: List[float]
+    average_xp: List[float]
+    average_level: List[float]
+
 class PlayerSummary(Player):
     """
     Schema for a player summary, which includes their total number of runs
@@ -130,6 +233,20 @@ class PlayerStats(BaseModel):
     favourite_upgrade: Optional[str] = None
     total_monsters_slain: int
 
+class UpgradeEffectiveness(BaseModel):
+    """Schema for how runs that picked a given upgrade performed."""
+    upgrade: str
+    runs: int
+    average_level: float
+    average_duration_seconds: float
+    average_kills: float
+
+class LeaderboardWindow(str, enum.Enum):
+    """The time windows that leaderboards are available for."""
+    daily = "daily"
+    weekly = "weekly"
+    all_time = "all_time"
+
 class RunLeaderboard(BaseModel):
     """Schema for a single entry in the leaderboard."""
     player_id: int
@@ -139,6 +256,31 @@ class RunLeaderboard(BaseModel):
     total_kills: int
     model_config = ConfigDict(from_attributes=True)
 
+class RankPosition(BaseModel):
+    """
+    Schema for a position in a ranking. Ties share a rank, and the
+    percentile is the share of entries at or below this one.
+    """
+    rank: int
+    total: int
+    percentile: float
+
+class RunRank(BaseModel):
+    """Schema for where a finished run places, overall and on its map."""
+    run_id: int
+    player_id: int
+    map_id: Optional[str] = None
+    duration_seconds: int
+    overall: RankPosition
+    on_map: RankPosition
+
+class PlayerRank(BaseModel):
+    """Schema for where a player's best run places them, overall and per map."""
+    player_id: int
+    best_run_seconds: int
+    overall: RankPosition
+    by_map: Dict[str, RankPosition]
+
 # --- Name Validation Schemas ---
 
 class NameCheckRequest(BaseModel):
@@ -153,3 +295,127 @@ class NameCheckResponse(BaseModel):
 class GenerateNameResponse(BaseModel):
     """Schema for the response when generating a random player name."""
     player_name: str
+
+# --- Admin Bulk Operation Schemas ---
+
+class BulkRunDelete(BaseModel):
+    """
+    Schema for selecting runs to delete in bulk. Runs must match every
+    criterion that is given, and at least one criterion is required.
+    """
+    run_ids: Optional[List[int]] = None
+    started_after: Optional[datetime.datetime] = None
+    started_before: Optional[datetime.datetime] = None
+    status: Optional[RunStatus] = None
+
+    @model_validator(mode="after")
+    def require_criteria(self):
+        if all(getattr(self, field) is None for field in type(self).model_fields):
+            raise ValueError("At least one selection criterion is required")
+        return self
+
+class BulkPlayerDelete(BaseModel):
+    """
+    Schema for selecting players to delete in bulk. Players must match every
+    criterion that is given, and at least one criterion is required.
+    """
+    player_ids: Optional[List[int]] = None
+    created_after: Optional[datetime.datetime] = None
+    created_before: Optional[datetime.datetime] = None
+
+    @model_validator(mode="after")
+    def require_criteria(self):
+        if all(getattr(self, field) is None for field in type(self).model_fields):
+            raise ValueError("At least one selection criterion is required")
+        return self
+
+class ArchivedRun(BaseModel):
+    """Schema for a run that has been moved into a monthly partition."""
+    id: int
+    player_id: Optional[int] = None
+    map_id: Optional[str] = None
+    started_at: datetime.datetime
+    ended_at: Optional[datetime.datetime] = None
+    status: Optional[RunStatus] = None
+    duration_seconds: Optional[int] = None
+    level: Optional[int] = None
+    xp: Optional[int] = None
+    kills_total: Optional[int] = None
+    upgrades: Optional[Dict[str, int]] = None
+    cause_of_death: Optional[str] = None
+    event_count: int
+
+class Partition(BaseModel):
+    """Schema for one month of archived runs."""
+    month: str
+    runs: int
+    size_bytes: int
+
+class Backup(BaseModel):
+    """Schema for a compressed backup of the database and its checksum."""
+    name: str
+    size_bytes: int
+    sha256: Optional[str] = None
+    created_at: datetime.datetime
+
+class Job(BaseModel):
+    """Schema for reporting the progress of a background admin job."""
+    id: int
+    kind: str
+    status: str
+    total: Optional[int] = None
+    processed: int
+    error: Optional[str] = None
+    created_at: datetime.datetime
+    finished_at: Optional[datetime.datetime] = None
+    model_config = ConfigDict(from_attributes=True)
+
+# --- Diagnostics Schemas ---
+
+class DiagnosticsSettings(BaseModel):
+    """Schema for the current diagnostics settings."""
+    enabled: bool
+    slow_query_threshold_ms: float
+    model_config = ConfigDict(from_attributes=True)
+
+class DiagnosticsUpdate(BaseModel):
+    """Schema for changing the diagnostics settings. All fields are optional."""
+    enabled: Optional[bool] = None
+    slow_query_threshold_ms: Optional[float] = Field(None, ge=0)
+
+    @model_validator(mode="after")
+    def reject_nulls(self):
+        # A field may be left out, but the settings themselves cannot be null.
+        if any(getattr(self, field) is None for field in self.model_fields_set):
+            raise ValueError("Diagnostics settings cannot be null")
+        return self
+
+# --- Sync Schemas ---
+
+class SyncRun(RunBase):
+    """Schema for a run in a delta sync, without its nested player."""
+    id: int
+    started_at: datetime.datetime
+    status: RunStatus
+    duration_seconds: int
+    level: int
+    xp: int
+    kills_total: int
+    upgrades: Optional[Dict[str, int]] = None
+    ended_at: Optional[datetime.datetime]
+    cause_of_death: Optional[str]
+    model_config = ConfigDict(from_attributes=True)
+
+class SyncChanges(BaseModel):
+    """
+    Schema for a page of changes to players and runs since a cursor.
+    Clients should apply the deletions first and then the rows, which are
+    always the current state, and pass `cursor` back on their next call.
+    `has_more` means another page is ready straight away.
+    """
+    cursor: int
+    has_more: bool
+    players: List[Player]
+    runs: List[SyncRun]
+    deleted_player_ids: List[int]
+    deleted_run_ids: List[int]
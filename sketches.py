@@ -0,0 +1,309 @@
+# This file keeps quantile sketches of run survival times and kill rates,
+# so that questions like "median survival on a map" or "p90 kills per
+# minute" are answered from a few hundred retained values instead of by
+# loading every run. Sketches are KLL sketches: they accept values one at
+# a time, can be merged, use memory that grows only with the logarithm of
+# the number of runs, and answer any quantile with a rank error of about
+# 1-2% at the default size.
+#
+# Sketches for each map and for all runs are held in memory, updated as
+# runs finish, and the changed ones are saved to `quantile_sketches` in
+# the background every `sketch_persist_interval_seconds` (and at
+# shutdown). Each saved sketch records the `Run.finished_seq` it is
+# complete up to, so a restart only has to read the runs finished since.
+# A player's sketch is built on demand from their runs, which are indexed
+# by player, read from the primary database, and kept in a bounded LRU
+# cache.
+#
+# Sketches cannot forget values, so deleted runs still count until the
+# sketches are next rebuilt from scratch. Archived runs count as well,
+# which is usually what is wanted for long-term distributions.
+
+import bisect
+import collections
+import concurrent.futures
+import datetime
+import json
+import logging
+import math
+import random
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import indexes
+import models
+import schemas
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+_random = random.Random()
+
+# Sketches are saved on their own thread, so that finishing a run never
+# waits for them to be written.
+_saver = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="sketch-save")
+
+class KLLSketch:
+    """
+    A KLL quantile sketch over floats. Level h holds values that each stand
+    for 2**h original values; when the sketch is full, the first level over
+    its capacity is sorted and every other value is promoted a level up.
+    """
+    __slots__ = ("k", "count", "levels", "_cdf")
+
+    def __init__(self, k: int = 200):
+        self.k = k
+        self.count = 0
+        self.levels: List[List[float]] = [[]]
+        self._cdf: Optional[Tuple[List[float], List[int]]] = None
+
+    def _capacity(self, level: int) -> int:
+        # Lower levels get geometrically less room than the top one.
+        depth = len(self.levels) - level - 1
+        return int(math.ceil(self.k * (2 / 3) ** depth)) + 1
+
+    def _size(self) -> int:
+        return sum(len(values) for values in self.levels)
+
+    def _max_size(self) -> int:
+        return sum(self._capacity(level) for level in range(len(self.levels)))
+
+    def _compress(self):
+        while self._size() >= self._max_size():
+            for level, values in enumerate(self.levels):
+                if len(values) >= self._capacity(level):
+                    if level + 1 == len(self.levels):
+                        self.levels.append([])
+                    values.sort()
+                    # An odd value out stays behind at this level.
+                    leftover = [values.pop()] if len(values) % 2 else []
+                    self.levels[level + 1].extend(values[_random.randint(0, 1)::2])
+                    self.levels[level] = leftover
+                    break
+
+    def update(self, value: float):
+        self.levels[0].append(float(value))
+        self.count += 1
+        self._cdf = None
+        self._compress()
+
+    def merge(self, other: "KLLSketch"):
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, values in enumerate(other.levels):
+            self.levels[level].extend(values)
+        self.count += other.count
+        self._cdf = None
+        self._compress()
+
+    def _cumulative(self) -> Tuple[List[float], List[int]]:
+        if self._cdf is None:
+            weighted = sorted((value, 1 << level) for level, values in enumerate(self.levels) for value in values)
+            values, totals, running = [], [], 0
+            for value, weight in weighted:
+                running += weight
+                values.append(value)
+                totals.append(running)
+            self._cdf = (values, totals)
+        return self._cdf
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Returns an estimate of the value at quantile `q` (0 to 1), in
+        O(log k) once the sorted summary has been built.
+        """
+        values, totals = self._cumulative()
+        if not values:
+            return None
+        target = q * totals[-1]
+        return values[min(bisect.bisect_left(totals, target), len(values) - 1)]
+
+    def to_bytes(self) -> bytes:
+        return zlib.compress(json.dumps({"k": self.k, "count": self.count, "levels": self.levels}).encode("utf-8"))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "KLLSketch":
+        state = json.loads(zlib.decompress(data))
+        sketch = cls(state["k"])
+        sketch.count = state["count"]
+        sketch.levels = state["levels"]
+        return sketch
+
+def metric_values(duration_seconds: Optional[int], kills_total: Optional[int]) -> Dict[schemas.DistributionMetric, float]:
+    """
+    Returns the value of each distribution metric for a finished run.
+    Kill rates are only defined for runs that lasted some time.
+    """
+    duration = duration_seconds or 0
+    values = {schemas.DistributionMetric.duration_seconds: float(duration)}
+    if duration > 0:
+        values[schemas.DistributionMetric.kills_per_minute] = (kills_total or 0) * 60 / duration
+    return values
+
+# Scopes are stored as strings: "all", or "map:<map_id>".
+ALL_RUNS = "all"
+
+def map_scope(map_id: Optional[str]) -> str:
+    return f"map:{map_id}"
+
+class SketchIndex(indexes.DerivedIndex):
+    """
+    Holds the sketches for all runs and for each map, per metric, and a
+    bounded cache of per-player sketches.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._clear()
+
+    def _clear(self):
+        self._sketches: Dict[Tuple[schemas.DistributionMetric, str], KLLSketch] = {}
+        self._players: "collections.OrderedDict[int, Dict[schemas.DistributionMetric, KLLSketch]]" = collections.OrderedDict()
+        # The highest `finished_seq` of any run counted so far.
+        self._watermark = 0
+        # The shared sketches changed since they were last saved.
+        self._dirty: Set[Tuple[schemas.DistributionMetric, str]] = set()
+        self._persisted_at = time.monotonic()
+
+    def _add(
+        self, scopes: Iterable[str], values: Dict[schemas.DistributionMetric, float],
+        saved: Optional[Dict[Tuple[schemas.DistributionMetric, str], int]] = None, finished_seq: int = 0,
+    ):
+        for scope in scopes:
+            for metric, value in values.items():
+                key = (metric, scope)
+                # Skip sketches that were saved after this run was counted.
+                if saved and key in saved and finished_seq <= saved[key]:
+                    continue
+                sketch = self._sketches.get(key)
+                if sketch is None:
+                    sketch = self._sketches[key] = KLLSketch(settings.sketch_k)
+                sketch.update(value)
+                self._dirty.add(key)
+
+    def _load(self, db: Session):
+        saved = {}
+        for row in db.query(models.QuantileSketch):
+            key = (schemas.DistributionMetric(row.metric), row.scope)
+            self._sketches[key] = KLLSketch.from_bytes(row.data)
+            saved[key] = row.watermark
+        self._watermark = max(saved.values(), default=0)
+
+        # Add the runs that finished since the oldest of the sketches was saved.
+        rows = (
+            db.query(models.Run.map_id, models.Run.duration_seconds, models.Run.kills_total, models.Run.finished_seq)
+            .filter(models.Run.status.in_(models.TERMINAL_STATUSES))
+        )
+        if saved:
+            rows = rows.filter(models.Run.finished_seq > min(saved.values()))
+        for map_id, duration, kills, finished_seq in rows.yield_per(5000):
+            self._add((ALL_RUNS, map_scope(map_id)), metric_values(duration, kills), saved, finished_seq or 0)
+            self._watermark = max(self._watermark, finished_seq or 0)
+
+    def record(self, run: models.Run):
+        """
+        Adds a run that has just finished. Must only be called once per run.
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            values = metric_values(run.duration_seconds, run.kills_total)
+            self._add((ALL_RUNS, map_scope(run.map_id)), values)
+            player_sketches = self._players.get(run.player_id)
+            if player_sketches is not None:
+                for metric, value in values.items():
+                    player_sketches.setdefault(metric, KLLSketch(settings.sketch_k)).update(value)
+            self._watermark = max(self._watermark, run.finished_seq or 0)
+
+    def discard_player(self, player_id: int):
+        with self._lock:
+            self._players.pop(player_id, None)
+
+    def persist_if_due(self, bind):
+        """
+        Saves the changed sketches in the background if the persist
+        interval has passed since they were last saved.
+        """
+        with self._lock:
+            if not self._dirty or time.monotonic() - self._persisted_at < settings.sketch_persist_interval_seconds:
+                return
+            self._persisted_at = time.monotonic()
+        _saver.submit(self._persist_in_background, bind)
+
+    def _persist_in_background(self, bind):
+        try:
+            self.persist(bind)
+        except Exception:
+            # The saved rows that were not replaced keep their older
+            # watermarks, so the next load still counts every run.
+            logger.exception("Saving the quantile sketches failed")
+
+    def persist(self, bind):
+        """
+        Saves every shared sketch that has changed since the last save,
+        with the `finished_seq` they are complete up to.
+        """
+        with self._lock:
+            if not self._loaded or not self._dirty:
+                return
+            now = datetime.datetime.now()
+            rows = [
+                {"metric": metric.value, "scope": scope, "runs": self._sketches[(metric, scope)].count,
+                 "data": self._sketches[(metric, scope)].to_bytes(), "watermark": self._watermark, "updated_at": now}
+                for metric, scope in self._dirty
+            ]
+            self._dirty = set()
+            self._persisted_at = time.monotonic()
+        table = models.QuantileSketch.__table__
+        with bind.begin() as connection:
+            for row in rows:
+                connection.execute(table.delete().where(table.c.metric == row["metric"], table.c.scope == row["scope"]))
+            connection.execute(table.insert(), rows)
+
+    def _player_sketches(self, db: Session, player_id: int) -> Dict[schemas.DistributionMetric, KLLSketch]:
+        cached = self._players.get(player_id)
+        if cached is not None:
+            self._players.move_to_end(player_id)
+            return cached
+        sketches: Dict[schemas.DistributionMetric, KLLSketch] = {}
+        # `record` only adds runs as they finish from now on, so the cached
+        # sketch must not be built from a replica that lacks earlier ones.
+        rows = (
+            indexes.primary_of(db).query(models.Run.duration_seconds, models.Run.kills_total)
+            .filter(models.Run.player_id == player_id, models.Run.status.in_(models.TERMINAL_STATUSES))
+        )
+        for duration, kills in rows.yield_per(5000):
+            for metric, value in metric_values(duration, kills).items():
+                sketches.setdefault(metric, KLLSketch(settings.sketch_k)).update(value)
+        self._players[player_id] = sketches
+        while len(self._players) > settings.sketch_player_cache_size:
+            self._players.popitem(last=False)
+        return sketches
+
+    def distribution(
+        self, db: Session, metric: schemas.DistributionMetric, quantiles: List[float],
+        map_id: Optional[str] = None, player_id: Optional[int] = None,
+    ) -> schemas.Distribution:
+        """
+        Returns estimates of the given quantiles of a metric, over all
+        finished runs, those on one map, or those of one player.
+        """
+        self.ensure_loaded(db)
+        with self._lock:
+            if player_id is not None:
+                sketch = self._player_sketches(db, player_id).get(metric)
+            else:
+                sketch = self._sketches.get((metric, map_scope(map_id) if map_id is not None else ALL_RUNS))
+            return schemas.Distribution(
+                metric=metric,
+                map_id=map_id,
+                player_id=player_id,
+                runs=sketch.count if sketch else 0,
+                quantiles={str(q): sketch.quantile(q) if sketch else None for q in quantiles},
+            )
+
+index = indexes.register(SketchIndex())
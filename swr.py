@@ -0,0 +1,196 @@
+# This file serves slow analytics reads with stale-while-revalidate
+# semantics. The last good result of a read is kept; while it is fresh it
+# is served as is, and once it goes stale it is still served straight away
+# (with its age) while a background refresh fetches a new one. If the
+# database is locked or failing, the stale result is served instead of an
+# error, for as long as it is within the endpoint's maximum staleness.
+#
+# Any commit that changes players or runs marks every cached result dirty.
+# A dirty result is still served, but the next read refreshes it in the
+# background, so reads never queue behind gameplay writes for SQLite's
+# lock. Only a read with nothing servable waits for the database, and every
+# query is bounded by `swr_lock_timeout_seconds`, so a locked database
+# gives up quickly instead of holding the request or a refresh thread.
+
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, sessionmaker
+
+import models
+from config import settings
+from database import Base
+
+logger = logging.getLogger(__name__)
+
+# The most results kept per endpoint, since keys include query parameters.
+MAX_ENTRIES = 256
+
+_refresher = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="swr-refresh")
+
+class Entry:
+    __slots__ = ("value", "fetched_at", "dirty", "refreshing")
+
+    def __init__(self, value: Any):
+        self.value = value
+        self.fetched_at = time.monotonic()
+        self.dirty = False
+        self.refreshing = False
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+class StaleWhileRevalidate:
+    """
+    The cached results of one endpoint. Results younger than
+    `fresh_seconds` are served as is; older ones are served while being
+    refreshed, and are never served once older than `max_stale_seconds`.
+    """
+
+    def __init__(self, name: str, fresh_seconds: float, max_stale_seconds: float):
+        self.name = name
+        self.fresh_seconds = fresh_seconds
+        self.max_stale_seconds = max_stale_seconds
+        self._entries: "collections.OrderedDict[Hashable, Entry]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so that a result computed before a
+        # write is not stored as if it were current.
+        self._generation = 0
+
+    def _store(self, key: Hashable, value: Any, generation: int):
+        with self._lock:
+            entry = self._entries[key] = Entry(value)
+            # A result computed before a write is newer than the one it
+            # replaces, but is still due a refresh.
+            entry.dirty = generation != self._generation
+            self._entries.move_to_end(key)
+            while len(self._entries) > MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def _refresh(self, key: Hashable, bind, compute: Callable[[Session], Any], generation: int):
+        db = sessionmaker(autocommit=False, autoflush=False, bind=bind)()
+        try:
+            with _lock_timeout(db):
+                value = compute(db)
+            self._store(key, value, generation)
+        except Exception:
+            logger.warning("Background refresh of %s failed; still serving the stale result", self.name, exc_info=True)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.refreshing = False
+        finally:
+            db.close()
+
+    def get(self, db: Session, key: Hashable, compute: Callable[[Session], Any]) -> Tuple[Any, float]:
+        """
+        Returns the result for a key and its age in seconds. `compute` is
+        called with a session to fetch a new result: `db` when the caller
+        has to wait for it, or a fresh session for a background refresh.
+        Only a key with no result within `max_stale_seconds` waits.
+        """
+        with self._lock:
+            generation = self._generation
+            entry = self._entries.get(key)
+            usable = entry is not None and entry.age <= self.max_stale_seconds
+            if usable and (entry.dirty or entry.age > self.fresh_seconds) and not entry.refreshing:
+                entry.refreshing = True
+                _refresher.submit(self._refresh, key, db.get_bind(), compute, generation)
+        if usable:
+            return entry.value, entry.age
+
+        # Nothing servable, so wait for the database, but not for longer
+        # than the lock timeout.
+        try:
+            with _lock_timeout(db):
+                value = compute(db)
+        except SQLAlchemyError:
+            db.rollback()
+            raise
+        self._store(key, value, generation)
+        return value, 0.0
+
+    def invalidate(self):
+        """
+        Marks every result dirty, so the next read refreshes it in the
+        background.
+        """
+        with self._lock:
+            self._generation += 1
+            for entry in self._entries.values():
+                entry.dirty = True
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+@contextmanager
+def _lock_timeout(db: Session):
+    """
+    Makes SQLite give up waiting for a lock after `swr_lock_timeout_seconds`
+    within the block, instead of after the connection's usual busy timeout.
+    The raw connection is used, as the session may be unusable after a
+    failed query, and its own timeout is restored before it is released.
+    """
+    if db.get_bind().dialect.name != "sqlite":
+        yield
+        return
+    raw = db.connection().connection.dbapi_connection
+    previous = raw.execute("PRAGMA busy_timeout").fetchone()[0]
+    raw.execute(f"PRAGMA busy_timeout = {int(settings.swr_lock_timeout_seconds * 1000)}")
+    try:
+        yield
+    finally:
+        raw.execute(f"PRAGMA busy_timeout = {int(previous)}")
+
+caches: Dict[str, StaleWhileRevalidate] = {
+    name: StaleWhileRevalidate(name, fresh, settings.swr_max_stale_seconds.get(name, fresh))
+    for name, fresh in settings.swr_fresh_seconds.items()
+}
+
+def invalidate_all():
+    for cache in caches.values():
+        cache.invalidate()
+
+@event.listens_for(Base.metadata, "after_drop")
+def _clear_after_drop(target, connection, **kw):
+    for cache in caches.values():
+        cache.clear()
+
+# --- Invalidation ---
+# Sessions note when they flush or bulk-execute changes to players or
+# runs, and the caches are invalidated once that transaction commits.
+
+_WATCHED_TABLES = {models.Player.__tablename__, models.Run.__tablename__}
+
+@event.listens_for(Session, "after_flush")
+def _note_flushed_changes(session, flush_context):
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, (models.Player, models.Run)):
+            session.info["swr_dirty"] = True
+            return
+
+@event.listens_for(Session, "do_orm_execute")
+def _note_bulk_changes(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if table is not None and table.name in _WATCHED_TABLES:
+            orm_execute_state.session.info["swr_dirty"] = True
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop("swr_dirty", False):
+        invalidate_all()
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changes(session):
+    session.info.pop("swr_dirty", None)
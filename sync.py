@@ -0,0 +1,176 @@
+# This file supports delta sync of the players and runs tables, so that
+# admin and dev tools can keep a local copy up to date at a cost that
+# depends on how much has changed rather than on the size of the tables.
+#
+# Every insert, update and delete of a player or run is stamped with the
+# next number from a single database-wide sequence: live rows carry it in
+# `change_seq`, and deleted rows leave a tombstone carrying it. A client
+# asks for everything after the last number it has seen.
+#
+# Numbers are handed out by updating the `sync_state` row inside the
+# writing transaction. SQLite lets only one transaction write at a time,
+# so a transaction that commits later always holds higher numbers, and a
+# cursor can never skip past a change that has yet to commit.
+
+import datetime
+from typing import List, Optional
+
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.orm import Session
+
+import models
+import schemas
+from config import settings
+
+SYNCED_MODELS = (models.Player, models.Run)
+
+def allocate(db: Session, count: int) -> int:
+    """
+    Reserves `count` consecutive sequence numbers in the current
+    transaction and returns the first of them.
+    """
+    connection = db.connection()
+    result = connection.execute(
+        update(models.SyncState).where(models.SyncState.id == 1).values(last_seq=models.SyncState.last_seq + count)
+    )
+    if result.rowcount == 0:
+        connection.execute(insert(models.SyncState).values(id=1, last_seq=count, pruned_seq=0))
+    last_seq = connection.execute(select(models.SyncState.last_seq).where(models.SyncState.id == 1)).scalar_one()
+    return last_seq - count + 1
+
+@event.listens_for(Session, "before_flush")
+def _stamp_changes(session, flush_context, instances):
+    changed = [
+        instance for instance in session.new
+        if isinstance(instance, SYNCED_MODELS)
+    ] + [
+        instance for instance in session.dirty
+        if isinstance(instance, SYNCED_MODELS) and session.is_modified(instance, include_collections=False)
+    ]
+    deleted = [instance for instance in session.deleted if isinstance(instance, SYNCED_MODELS)]
+    if not changed and not deleted:
+        return
+    seq = allocate(session, len(changed) + len(deleted))
+    now = datetime.datetime.now()
+    for instance in changed:
+        instance.change_seq = seq
+        instance.updated_at = now
+        if isinstance(instance, models.Run) and instance.finished_seq is None and instance.status in models.TERMINAL_STATUSES:
+            instance.finished_seq = seq
+        seq += 1
+    for instance in deleted:
+        session.add(models.Tombstone(change_seq=seq, table_name=instance.__tablename__, row_id=instance.id, deleted_at=now))
+        seq += 1
+
+def record_deletions(db: Session, model, row_ids: List[int]):
+    """
+    Writes tombstones for rows removed with a bulk query delete, which
+    the flush hook above never sees. The caller is responsible for committing.
+    """
+    if not row_ids:
+        return
+    seq = allocate(db, len(row_ids))
+    now = datetime.datetime.now()
+    db.execute(insert(models.Tombstone), [
+        {"change_seq": seq + offset, "table_name": model.__tablename__, "row_id": row_id, "deleted_at": now}
+        for offset, row_id in enumerate(row_ids)
+    ])
+
+def backfill_change_seq(db: Session) -> int:
+    """
+    Stamps rows written before delta sync existed, one chunk per
+    transaction, so every row can be reached from cursor 0. Returns the
+    number of rows stamped.
+    """
+    stamped = 0
+    for model in SYNCED_MODELS:
+        while True:
+            row_ids = [
+                row_id for row_id, in db.query(model.id)
+                .filter(model.change_seq.is_(None))
+                .order_by(model.id)
+                .limit(settings.bulk_delete_chunk_size)
+            ]
+            if not row_ids:
+                break
+            seq = allocate(db, len(row_ids))
+            db.execute(update(model), [
+                {"id": row_id, "change_seq": seq + offset} for offset, row_id in enumerate(row_ids)
+            ])
+            db.commit()
+            stamped += len(row_ids)
+    return stamped
+
+def backfill_finished_seq(db: Session) -> int:
+    """
+    Stamps runs that finished before `finished_seq` existed with their
+    current `change_seq`. Saved quantile sketches were complete up to a
+    `change_seq`, which edited runs have since moved past, so they are
+    discarded first and rebuilt from scratch. Returns the number of runs
+    stamped.
+    """
+    unstamped = models.Run.finished_seq.is_(None), models.Run.status.in_(models.TERMINAL_STATUSES)
+    if db.query(models.Run.id).filter(*unstamped).first() is None:
+        return 0
+    db.query(models.QuantileSketch).delete(synchronize_session=False)
+    db.commit()
+    stamped = db.execute(
+        update(models.Run).where(*unstamped).values(finished_seq=models.Run.change_seq)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return stamped
+
+def prune_tombstones(db: Session, max_age_days: int) -> int:
+    """
+    Deletes tombstones older than `max_age_days`. Cursors from before the
+    newest pruned tombstone can no longer be served and must start over.
+    """
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=max_age_days)
+    newest = db.query(models.Tombstone.change_seq).filter(models.Tombstone.deleted_at < cutoff).order_by(
+        models.Tombstone.change_seq.desc()
+    ).limit(1).scalar()
+    if newest is None:
+        return 0
+    pruned = db.query(models.Tombstone).filter(models.Tombstone.change_seq <= newest).delete(synchronize_session=False)
+    db.execute(update(models.SyncState).where(models.SyncState.id == 1).values(pruned_seq=newest))
+    db.commit()
+    return pruned
+
+def get_changes(db: Session, since: int = 0, limit: int = 1000) -> Optional[schemas.SyncChanges]:
+    """
+    Returns up to `limit` changes after the cursor `since`, oldest first,
+    or None if tombstones the client needs have been pruned.
+    """
+    state = db.get(models.SyncState, 1)
+    if state is not None and since < state.pruned_seq:
+        return None
+
+    def after_cursor(query, column):
+        return query.filter(column > since).order_by(column).limit(limit + 1).all()
+
+    players = after_cursor(db.query(models.Player), models.Player.change_seq)
+    runs = after_cursor(db.query(models.Run), models.Run.change_seq)
+    tombstones = after_cursor(db.query(models.Tombstone), models.Tombstone.change_seq)
+
+    # Keep the oldest `limit` changes across all three, so the cursor
+    # never moves past a change that has not been returned.
+    changes = sorted([*players, *runs, *tombstones], key=lambda change: change.change_seq)
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    cursor = changes[-1].change_seq if changes else since
+
+    return schemas.SyncChanges(
+        cursor=cursor,
+        has_more=has_more,
+        players=[change for change in changes if isinstance(change, models.Player)],
+        runs=[change for change in changes if isinstance(change, models.Run)],
+        deleted_player_ids=[
+            change.row_id for change in changes
+            if isinstance(change, models.Tombstone) and change.table_name == models.Player.__tablename__
+        ],
+        deleted_run_ids=[
+            change.row_id for change in changes
+            if isinstance(change, models.Tombstone) and change.table_name == models.Run.__tablename__
+        ],
+    )
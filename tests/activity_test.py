@@ -0,0 +1,129 @@
+# This file contains tests for the active-player counters.
+# It verifies the accuracy and merging of HyperLogLog sketches, and the
+# active-player and engagement endpoints over days and maps.
+
+import datetime
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+import activity
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+
+def start_run(player, map_id):
+    """Starts a run for a player on a map."""
+    client.post("/runs/start", json={"player_name": player["name"], "password": player["password"], "map_id": map_id})
+
+def test_sketches_estimate_and_merge_accurately():
+    """
+    Estimates must be within a few percent, and merging must match the
+    register-wise maximum and count the union of both sketches once.
+    """
+    first, second = bytearray(4096), bytearray(4096)
+    for player_id in range(30_000):
+        activity.add(first, player_id)
+    for player_id in range(20_000, 50_000):
+        activity.add(second, player_id)
+
+    merged = activity.merge_registers([bytes(first), bytes(second)])
+    assert merged == bytes(max(pair) for pair in zip(first, second))
+    assert abs(activity.estimate(bytes(first)) - 30_000) < 30_000 * 0.05
+    assert abs(activity.estimate(merged) - 50_000) < 50_000 * 0.05
+
+    small = bytearray(4096)
+    for player_id in range(100):
+        activity.add(small, player_id)
+        activity.add(small, player_id)
+    assert abs(activity.estimate(bytes(small)) - 100) <= 2
+    assert activity.estimate(None) == 0
+
+def test_active_players_by_day_and_map():
+    """
+    Players must be counted once however many runs they start, on the day
+    their run started, overall and on each map.
+    """
+    alice = client.post("/players", json={"name": "Alice"}).json()
+    bob = client.post("/players", json={"name": "Bob"}).json()
+    for _ in range(3):
+        start_run(alice, "forest")
+    start_run(alice, "cave")
+    start_run(bob, "cave")
+    last_week = datetime.datetime.now() - datetime.timedelta(days=7)
+    client.post("/runs/submit", json={
+        "player_name": "Bob", "password": bob["password"], "map_id": "desert",
+        "started_at": last_week.isoformat(), "duration_seconds": 60,
+    })
+
+    today = client.get("/analytics/active-players").json()
+    assert today["players"] == 2
+    assert today["by_map"] == {"cave": 2, "forest": 1}
+
+    week = client.get("/analytics/active-players", params={"start": (last_week.date()).isoformat()}).json()
+    assert week["players"] == 2
+    assert week["by_map"] == {"cave": 2, "desert": 1, "forest": 1}
+
+    engagement = client.get("/analytics/engagement", params={"map_id": "desert"}).json()
+    assert (engagement["daily"], engagement["weekly"], engagement["monthly"]) == (0, 0, 1)
+    engagement = client.get("/analytics/engagement").json()
+    assert (engagement["daily"], engagement["monthly"], engagement["stickiness"]) == (2, 2, 1.0)
+
+    params = {"start": datetime.date.today().isoformat(), "end": last_week.date().isoformat()}
+    assert client.get("/analytics/active-players", params=params).status_code == 422
+
+def test_saved_sketches_are_reloaded_with_newer_runs():
+    """
+    After a restart, the saved sketches plus the runs started since must
+    give the same counts as before.
+    """
+    first = client.post("/players", json={"name": "Early"}).json()
+    second = client.post("/players", json={"name": "Late"}).json()
+    start_run(first, "forest")
+    client.get("/analytics/active-players")
+    activity.index.persist(engine)
+
+    start_run(second, "forest")
+    activity.index.reset()
+    reloaded = client.get("/analytics/active-players").json()
+    assert reloaded["players"] == 2 and reloaded["by_map"] == {"forest": 2}
@@ -0,0 +1,159 @@
+# This file contains tests for the admin bulk operation endpoints.
+# It verifies that bulk deletes remove the selected runs and players,
+# cascade to their events, and report their progress as a job.
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+ADMIN_AUTH = ("admin", "admin")
+
+def start_run(player_name, password):
+    """Starts a run for an existing player and returns its ID."""
+    response = client.post("/runs/start", json={"player_name": player_name, "password": password, "map_id": "map1"})
+    return response.json()["run_id"]
+
+# --- Bulk Delete Tests ---
+
+def test_bulk_delete_runs_by_status():
+    """
+    Tests that a bulk delete by status removes only the matching runs,
+    cascades to their events, and reports a completed job.
+    """
+    # 1. Create a player with one finished run (with events) and one live run.
+    player = client.post("/players", json={"name": "bulk_runs"}).json()
+    finished_run = start_run(player["name"], player["password"])
+    live_run = start_run(player["name"], player["password"])
+    client.patch(f"/runs/{finished_run}", json={"status": "died"})
+    client.post(f"/runs/{finished_run}/events", json={"event_type": "boss_defeated"})
+
+    # 2. Delete every run that ended in death.
+    response = client.post("/admin/runs/bulk-delete", json={"status": "died"}, auth=ADMIN_AUTH)
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+
+    # 3. The job should have finished and removed the single matching run.
+    job = client.get(f"/admin/jobs/{job_id}", auth=ADMIN_AUTH).json()
+    assert job["status"] == "completed"
+    assert job["total"] == 1
+    assert job["processed"] == 1
+    assert client.get(f"/runs/{finished_run}").status_code == 404
+    assert client.get(f"/runs/{finished_run}/events").json() == []
+    assert client.get(f"/runs/{live_run}").status_code == 200
+
+def test_bulk_delete_players_cascades_to_events():
+    """
+    Tests that bulk deleting players removes their runs and run events.
+    """
+    player = client.post("/players", json={"name": "bulk_player"}).json()
+    run_id = start_run(player["name"], player["password"])
+    client.post(f"/runs/{run_id}/events", json={"event_type": "level_up", "value": "2"})
+
+    response = client.post("/admin/players/bulk-delete", json={"player_ids": [player["id"]]}, auth=ADMIN_AUTH)
+    assert response.status_code == 202
+
+    job = client.get(f"/admin/jobs/{response.json()['id']}", auth=ADMIN_AUTH).json()
+    assert job["status"] == "completed"
+    assert client.get(f"/players/{player['id']}").status_code == 404
+    assert client.get(f"/runs/{run_id}/events").json() == []
+
+def test_bulk_delete_requires_criteria_and_admin():
+    """
+    Tests that a bulk delete without criteria is rejected, and that the
+    endpoint cannot be used without admin credentials.
+    """
+    assert client.post("/admin/runs/bulk-delete", json={}, auth=ADMIN_AUTH).status_code == 422
+    assert client.post("/admin/runs/bulk-delete", json={"status": "died"}).status_code == 401
+
+def test_delete_player_is_one_transaction(monkeypatch):
+    """
+    Tests that deleting a single player removes all of their runs in one
+    transaction, without the pauses of the background bulk deletes, and
+    that a failure partway leaves every run in place.
+    """
+    import time
+    import crud
+    from config import settings
+    monkeypatch.setattr(settings, "bulk_delete_chunk_size", 1)
+    monkeypatch.setattr(time, "sleep", lambda seconds: pytest.fail("delete_player must not sleep"))
+
+    player = client.post("/players", json={"name": "single_delete"}).json()
+    run_ids = [start_run(player["name"], player["password"]) for _ in range(3)]
+
+    # 1. A failure after the first chunk rolls back the whole delete.
+    original = crud._delete_runs_by_ids
+    calls = []
+    def failing_delete(db, chunk):
+        calls.append(chunk)
+        if len(calls) == 2:
+            raise RuntimeError("disk full")
+        original(db, chunk)
+    monkeypatch.setattr(crud, "_delete_runs_by_ids", failing_delete)
+    with pytest.raises(RuntimeError):
+        client.delete(f"/admin/players/{player['id']}", auth=ADMIN_AUTH)
+    assert [client.get(f"/runs/{run_id}").status_code for run_id in run_ids] == [200, 200, 200]
+
+    # 2. Without the failure, the player and all their runs are removed.
+    monkeypatch.setattr(crud, "_delete_runs_by_ids", original)
+    assert client.delete(f"/admin/players/{player['id']}", auth=ADMIN_AUTH).status_code == 204
+    assert client.get(f"/players/{player['id']}").status_code == 404
+    assert [client.get(f"/runs/{run_id}").status_code for run_id in run_ids] == [404, 404, 404]
+
+def test_jobs_are_kept_in_the_database(monkeypatch):
+    """
+    Tests that job state is read from the database, so that any worker can
+    report it, and that only the most recent jobs are kept.
+    """
+    import jobs
+    monkeypatch.setattr(jobs, "MAX_TRACKED_JOBS", 2)
+    db = TestingSessionLocal()
+    try:
+        job_ids = [jobs.create_job(db, "example", total=3).id for _ in range(3)]
+    finally:
+        db.close()
+
+    assert client.get(f"/admin/jobs/{job_ids[0]}", auth=ADMIN_AUTH).status_code == 404
+    job = client.get(f"/admin/jobs/{job_ids[2]}", auth=ADMIN_AUTH).json()
+    assert (job["kind"], job["status"], job["total"], job["processed"]) == ("example", "pending", 3, 0)
@@ -0,0 +1,135 @@
+# This file contains tests for the online backups.
+# It verifies that backups are checksummed, rotated and restorable while
+# the database stays in use, and that the replica can read from them.
+
+import os
+import sqlite3
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import backup
+import replicas
+from config import settings
+from main import app
+from database import Base, get_db
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+ADMIN_AUTH = ("admin", "admin")
+
+@pytest.fixture
+def backup_dir(tmp_path, monkeypatch):
+    """A temporary backup directory, copied one page per step."""
+    monkeypatch.setattr(settings, "backup_dir", str(tmp_path / "backups"))
+    monkeypatch.setattr(settings, "backup_pages", 1)
+    monkeypatch.setattr(settings, "backup_sleep_seconds", 0.0)
+    return tmp_path / "backups"
+
+def test_backup_can_be_verified_and_restored(backup_dir, tmp_path):
+    """
+    A backup must match its checksum and restore into a working database
+    holding every player, and a damaged backup must not be restored.
+    """
+    for name in ("Alpha", "Bravo"):
+        client.post("/players", json={"name": name})
+    pages = []
+    with TestingSessionLocal() as db:
+        path = backup.create_backup(db, progress=pages.append)
+    assert sum(pages) > 1
+    assert backup.verify(path)
+
+    backup.restore(path, str(tmp_path / "restored.db"))
+    with sqlite3.connect(tmp_path / "restored.db") as restored:
+        names = [row[0] for row in restored.execute("SELECT name FROM players ORDER BY name")]
+    assert names == ["Alpha", "Bravo"]
+
+    with open(path, "ab") as damaged:
+        damaged.write(b"\0")
+    assert not backup.verify(path)
+    with pytest.raises(ValueError):
+        backup.restore(path, str(tmp_path / "damaged.db"))
+
+def test_old_backups_are_rotated(backup_dir, monkeypatch):
+    """
+    Only the newest `backup_keep` backups, and their checksums, are kept.
+    """
+    monkeypatch.setattr(settings, "backup_keep", 2)
+    with TestingSessionLocal() as db:
+        paths = [backup.create_backup(db) for _ in range(3)]
+    assert [entry["path"] for entry in backup.list_backups()] == paths[:0:-1]
+    kept = [os.path.basename(path) for path in paths[1:]]
+    assert sorted(file.name for file in backup_dir.iterdir()) == sorted(kept + [f"{name}.sha256" for name in kept])
+
+def test_admin_backup_endpoint(backup_dir):
+    """
+    The admin endpoint takes a backup in the background and lists it.
+    """
+    client.post("/players", json={"name": "Charlie"})
+    response = client.post("/admin/backups", auth=ADMIN_AUTH)
+    assert response.status_code == 202
+    job = client.get(f"/admin/jobs/{response.json()['id']}", auth=ADMIN_AUTH).json()
+    assert job["status"] == "completed"
+    assert job["processed"] > 0
+
+    backups = client.get("/admin/backups", auth=ADMIN_AUTH).json()
+    assert len(backups) == 1
+    assert backups[0]["sha256"] is not None
+    assert client.get("/admin/backups").status_code == 401
+
+def test_replica_reads_from_the_latest_backup(backup_dir, tmp_path, monkeypatch):
+    """
+    With `replica_from_backups` set, list reads are served from the newest
+    backup instead of a copy of the live database.
+    """
+    monkeypatch.setattr(settings, "replica_from_backups", True)
+    monkeypatch.setattr(settings, "replica_snapshot_path", str(tmp_path / "replica.db"))
+    monkeypatch.setattr(settings, "replica_snapshot_interval_seconds", 3600.0)
+    monkeypatch.setattr(settings, "replica_lag_check_interval_seconds", 0.0)
+    replicas.replica.reset()
+    try:
+        client.post("/players", json={"name": "Backed Up"})
+        with TestingSessionLocal() as db:
+            backup.create_backup(db)
+        replicas.replica.refresh_snapshot(engine)
+        client.post("/players", json={"name": "Too Late"})
+        assert [player["name"] for player in client.get("/players").json()] == ["Backed Up"]
+    finally:
+        replicas.replica.reset()
@@ -0,0 +1,111 @@
+# This file contains tests for the multi-worker change bus.
+# It verifies that writes publish messages only when the bus is enabled,
+# and that a worker applies the changes of other workers to its own
+# in-memory indexes while skipping its own.
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+from config import settings
+import bus
+import models
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+
+OTHER_WORKER = "other-host:1"
+
+@pytest.fixture
+def listener(monkeypatch):
+    """A listener that is only polled by the test itself."""
+    monkeypatch.setattr(settings, "change_bus_poll_interval_seconds", 60.0)
+    listener = bus.Listener()
+    listener.start(engine)
+    yield listener
+    listener.stop()
+
+def test_writes_publish_only_when_enabled(monkeypatch):
+    """
+    A single process must not write to the change log; with the bus
+    enabled, each write publishes its message in the same transaction.
+    """
+    client.post("/players", json={"name": "Quiet"})
+    with TestingSessionLocal() as db:
+        assert db.query(models.ChangeMessage).count() == 0
+
+    monkeypatch.setattr(settings, "change_bus_enabled", True)
+    player = client.post("/players", json={"name": "Loud"}).json()
+    client.post("/runs/start", json={"player_name": "Loud", "password": player["password"], "map_id": "forest"})
+    with TestingSessionLocal() as db:
+        messages = db.query(models.ChangeMessage).order_by(models.ChangeMessage.id).all()
+    assert [message.topic for message in messages] == ["player_saved", "run_started"]
+    assert messages[0].payload == {"player_id": player["id"], "name": "Loud"}
+    assert messages[0].origin == bus.worker_id()
+
+def test_changes_from_other_workers_are_applied(monkeypatch, listener):
+    """
+    Runs and renames committed by another worker must reach this worker's
+    leaderboard and name search once it polls, and its own messages must
+    not be applied twice.
+    """
+    monkeypatch.setattr(settings, "change_bus_enabled", True)
+    player = client.post("/players", json={"name": "Alice"}).json()
+    assert client.get("/analytics/leaderboard/all_time").json() == []
+    assert listener.poll() == 0
+
+    with TestingSessionLocal() as db:
+        run = models.Run(player_id=player["id"], map_id="forest", status=models.RunStatus.died, duration_seconds=300)
+        db.add(run)
+        db.flush()
+        db.add(models.ChangeMessage(topic="run_finished", payload={"run_id": run.id, "ended": True}, origin=OTHER_WORKER))
+        db.query(models.Player).filter(models.Player.id == player["id"]).update({"name": "Alicia"})
+        db.add(models.ChangeMessage(topic="player_renamed", payload={"player_id": player["id"], "name": "Alicia"}, origin=OTHER_WORKER))
+        db.commit()
+    assert client.get("/analytics/leaderboard/all_time").json() == []
+
+    assert listener.poll() == 2
+    leaderboard = client.get("/analytics/leaderboard/all_time").json()
+    assert [(entry["player_name"], entry["duration_seconds"]) for entry in leaderboard] == [("Alicia", 300)]
+    assert client.get("/players/search", params={"q": "Alic"}).json()[0]["name"] == "Alicia"
+    assert listener.poll() == 0
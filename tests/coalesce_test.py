@@ -0,0 +1,162 @@
+# This file contains tests for request coalescing.
+# It verifies that identical concurrent reads share one computation, that
+# slow leaders time out to independent work, and that the coalesced
+# endpoints still return the same data.
+
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+import coalesce
+import crud
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+def test_concurrent_calls_share_one_computation():
+    """
+    Calls for the same key made while one is in flight must not run again.
+    """
+    flight = coalesce.SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def slow_query():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return ["result"]
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("key", slow_query)))
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=lambda: results.append(flight.do("key", slow_query))) for _ in range(10)]
+    for thread in followers:
+        thread.start()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [["result"]] * 11
+    # Once finished, the next call computes afresh.
+    flight.do("key", slow_query)
+    assert len(calls) == 2
+
+def test_errors_are_shared_and_timeouts_fall_back():
+    """
+    A leader's error must reach its followers, and a follower that waits
+    too long must compute its own result.
+    """
+    flight = coalesce.SingleFlight()
+    started = threading.Event()
+
+    def failing_query():
+        started.set()
+        time.sleep(0.2)
+        raise ValueError("boom")
+
+    errors = []
+    def call():
+        try:
+            flight.do("key", failing_query)
+        except ValueError as exc:
+            errors.append(exc)
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=call)
+    follower.start()
+    # This follower gives up on the leader and runs its own query.
+    assert flight.do("key", lambda: "own", timeout=0.01) == "own"
+    leader.join()
+    follower.join()
+    assert len(errors) == 2
+
+def test_async_calls_share_one_computation():
+    """
+    Coroutines for the same key must share one computation too.
+    """
+    flight = coalesce.SingleFlight()
+    calls = []
+
+    async def slow_query():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async("key", slow_query) for _ in range(10)))
+
+    assert asyncio.run(main()) == ["result"] * 10
+    assert len(calls) == 1
+
+def test_leaderboard_herd_runs_one_query(monkeypatch):
+    """
+    A burst of identical leaderboard requests must reach the database once.
+    """
+    player = client.post("/players", json={"name": "Streamer"}).json()
+    run = client.post("/runs/start", json={"player_name": "Streamer", "password": player["password"], "map_id": "forest"}).json()
+    client.patch(f"/runs/{run['run_id']}", json={"duration_seconds": 300, "status": "died"})
+
+    calls = []
+    original = crud.get_leaderboard
+    def slow_leaderboard(db, *args, **kwargs):
+        calls.append(1)
+        time.sleep(0.3)
+        return original(db, *args, **kwargs)
+    monkeypatch.setattr(crud, "get_leaderboard", slow_leaderboard)
+
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(client.get("/analytics/leaderboard"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert all(response.status_code == 200 for response in responses)
+    assert all(response.json()[0]["player_name"] == "Streamer" for response in responses)
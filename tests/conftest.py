@@ -0,0 +1,19 @@
+# This file holds fixtures shared by every test module.
+
+import os
+
+# Point the app's own engine at the scratch test database before anything
+# imports the settings, so that no test ever touches `coursework1.db`.
+os.environ["DATABASE_URL"] = "sqlite:///./test.db"
+
+import pytest
+
+import ratelimit
+
+@pytest.fixture(autouse=True)
+def empty_rate_limit_buckets():
+    """
+    Every test starts with full rate limit buckets, since all test requests
+    come from the same client.
+    """
+    ratelimit.backend.clear()
@@ -0,0 +1,145 @@
+# This file contains tests for the run progress time series.
+# It verifies that progress updates build a run's curve, and that map
+# curves aggregate survival and averages across finished runs.
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+import timeseries
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+def play_run(player, map_id, samples, status="died"):
+    """Starts a run, sends (duration, kills, xp) progress updates and ends it."""
+    run_id = client.post("/runs/start", json={"player_name": player["name"], "password": player["password"], "map_id": map_id}).json()["run_id"]
+    for duration, kills, xp in samples:
+        client.patch(f"/runs/{run_id}", json={"duration_seconds": duration, "kills_total": kills, "xp": xp, "level": xp // 100})
+    client.patch(f"/runs/{run_id}", json={"status": status})
+    return run_id
+
+def test_progress_updates_build_run_curve():
+    """
+    Each progress update must append one sample, and an update that
+    changes nothing must not.
+    """
+    player = client.post("/players", json={"name": "Curvy"}).json()
+    run_id = play_run(player, "forest", [(30, 4, 120), (60, 9, 250), (90, 8, 400)])
+
+    curve = client.get(f"/runs/{run_id}/curve").json()
+    assert curve["duration_seconds"] == [30, 60, 90]
+    assert curve["kills_total"] == [4, 9, 8]
+    assert curve["xp"] == [120, 250, 400]
+    assert curve["level"] == [1, 2, 4]
+    assert client.get("/runs/9999/curve").status_code == 404
+
+def test_series_decode_matches_appended_samples():
+    """
+    The delta encoding must round-trip, including values that go down.
+    """
+    data = bytearray()
+    last = (0, 0, 0, 0)
+    samples = [(30, 5, 100, 1), (60, 3, 100, 1), (1_000_000, 70_000, 9_999_999, 99)]
+    for sample in samples:
+        for value, previous in zip(sample, last):
+            timeseries.write_varint(data, timeseries.zigzag(value - previous))
+        last = sample
+    columns = timeseries.decode(bytes(data))
+    assert list(zip(*(columns[field] for field in timeseries.FIELDS))) == samples
+
+def test_map_curve_aggregates_finished_runs():
+    """
+    The map curve must report the share of runs alive in each bucket and
+    average the values of the runs still alive.
+    """
+    player = client.post("/players", json={"name": "Mapper"}).json()
+    play_run(player, "cave", [(30, 2, 100), (60, 6, 200)])
+    play_run(player, "cave", [(30, 4, 300), (60, 8, 400), (90, 10, 500), (120, 12, 600)])
+    play_run(player, "forest", [(30, 100, 100)])
+
+    curve = client.get("/analytics/maps/cave/curve", params={"bucket_seconds": 30, "buckets": 5}).json()
+    assert curve["runs"] == 2
+    assert curve["seconds"] == [0, 30, 60, 90, 120]
+    assert curve["survival"] == [1.0, 1.0, 1.0, 0.5, 0.5]
+    # At 0 seconds neither run has a sample yet.
+    assert curve["average_kills"] == [0.0, 3.0, 7.0, 10.0, 12.0]
+    assert curve["average_xp"][1] == 200.0
+
+def test_map_curve_is_kept_up_to_date_without_decoding_every_run(monkeypatch):
+    """
+    Once built, the map curves must be read without decoding any series,
+    take in runs as they finish, and drop deleted runs.
+    """
+    player = client.post("/players", json={"name": "Tracker"}).json()
+    play_run(player, "cave", [(30, 2, 100), (60, 6, 200)])
+    assert client.get("/analytics/maps/cave/curve", params={"bucket_seconds": 30, "buckets": 5}).json()["runs"] == 1
+
+    decoded = []
+    real_decode = timeseries.decode
+    monkeypatch.setattr(timeseries, "decode", lambda data: decoded.append(data) or real_decode(data))
+    assert client.get("/analytics/maps/cave/curve", params={"bucket_seconds": 10, "buckets": 10}).json()["runs"] == 1
+    assert decoded == []
+
+    run_id = play_run(player, "cave", [(30, 4, 300), (60, 8, 400), (90, 10, 500), (120, 12, 600)])
+    assert len(decoded) == 1
+    curve = client.get("/analytics/maps/cave/curve", params={"bucket_seconds": 30, "buckets": 5}).json()
+    assert curve["survival"] == [1.0, 1.0, 1.0, 0.5, 0.5]
+    assert curve["average_kills"] == [0.0, 3.0, 7.0, 10.0, 12.0]
+
+    assert client.delete(f"/runs/{run_id}").status_code == 200
+    curve = client.get("/analytics/maps/cave/curve", params={"bucket_seconds": 30, "buckets": 5}).json()
+    assert curve["runs"] == 1
+    assert curve["survival"] == [1.0, 1.0, 1.0, 0.0, 0.0]
+
+def test_long_series_moves_its_tail_into_the_data():
+    """
+    Samples must stay in order as the tail of a long series is moved onto
+    the rest of it.
+    """
+    player = client.post("/players", json={"name": "Marathon"}).json()
+    samples = [(30 * step, step, 100 * step) for step in range(1, 121)]
+    run_id = play_run(player, "forest", samples)
+
+    curve = client.get(f"/runs/{run_id}/curve").json()
+    assert curve["duration_seconds"] == [duration for duration, _, _ in samples]
+    assert curve["xp"] == [xp for _, _, xp in samples]
@@ -0,0 +1,107 @@
+# This file contains tests for the diagnostics mode.
+# It verifies that slow queries are logged with their originating
+# `crud` function, and that admins can profile a request.
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+ADMIN_AUTH = ("admin", "admin")
+
+def teardown_module():
+    """
+    Switch diagnostics mode back off once these tests are done.
+    """
+    client.patch("/admin/diagnostics", json={"enabled": False, "slow_query_threshold_ms": 100.0}, auth=ADMIN_AUTH)
+
+# --- Diagnostics Tests ---
+
+def test_slow_query_log_names_crud_function(caplog):
+    """
+    Tests that, with a zero threshold, queries are logged along with their
+    parameters and the `crud` function that issued them.
+    """
+    response = client.patch("/admin/diagnostics", json={"enabled": True, "slow_query_threshold_ms": 0}, auth=ADMIN_AUTH)
+    assert response.json() == {"enabled": True, "slow_query_threshold_ms": 0.0}
+
+    with caplog.at_level("WARNING", logger="diagnostics.slow_query"):
+        client.get("/players/424242")
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert any("crud.get_player:" in message and "424242" in message for message in messages)
+
+def test_profile_header_requires_admin():
+    """
+    Tests that an admin receives a collapsed-stack profile instead of the
+    normal response, and that anyone else is refused.
+    """
+    client.patch("/admin/diagnostics", json={"enabled": True}, auth=ADMIN_AUTH)
+    client.post("/players", json={"name": "profiled_player"})
+
+    response = client.get("/analytics/players-summary", headers={"X-Profile": "1"}, auth=ADMIN_AUTH)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert response.headers["x-profiled-status"] == "200"
+    for line in response.text.splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert stack.startswith("main.get_players_summary")
+        assert int(count) > 0
+
+    assert client.get("/analytics/players-summary", headers={"X-Profile": "1"}).status_code == 401
+    assert client.get("/analytics/players-summary", headers={"X-Profile": "1"}, auth=("admin", "wrong")).status_code == 401
+
+def test_diagnostics_settings_cannot_be_null():
+    """
+    Tests that null or negative settings are refused with a 422 and leave
+    the current settings unchanged.
+    """
+    client.patch("/admin/diagnostics", json={"enabled": True, "slow_query_threshold_ms": 50.0}, auth=ADMIN_AUTH)
+    assert client.patch("/admin/diagnostics", json={"slow_query_threshold_ms": None}, auth=ADMIN_AUTH).status_code == 422
+    assert client.patch("/admin/diagnostics", json={"enabled": None}, auth=ADMIN_AUTH).status_code == 422
+    assert client.patch("/admin/diagnostics", json={"slow_query_threshold_ms": -1}, auth=ADMIN_AUTH).status_code == 422
+
+    assert client.get("/admin/diagnostics", auth=ADMIN_AUTH).json() == {"enabled": True, "slow_query_threshold_ms": 50.0}
+    assert client.get("/players/424242").status_code == 404
@@ -0,0 +1,144 @@
+# This file contains tests for the quantile sketches.
+# It verifies the accuracy, merging and saving of KLL sketches, and the
+# distribution endpoint over all runs, one map and one player.
+
+import random
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+import sketches
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+def finish_run(player, map_id, duration, kills):
+    """Starts a run and ends it with a duration and kill count."""
+    run_id = client.post("/runs/start", json={"player_name": player["name"], "password": player["password"], "map_id": map_id}).json()["run_id"]
+    client.patch(f"/runs/{run_id}", json={"duration_seconds": duration, "kills_total": kills, "status": "died"})
+    return run_id
+
+def test_sketch_quantiles_are_accurate_and_bounded():
+    """
+    Estimated quantiles must be within a small rank error, using far
+    fewer values than were added, and merging must keep that accuracy.
+    """
+    values = list(range(100_000))
+    random.Random(1).shuffle(values)
+    first, second = sketches.KLLSketch(), sketches.KLLSketch()
+    for value in values[:50_000]:
+        first.update(value)
+    for value in values[50_000:]:
+        second.update(value)
+    first.merge(second)
+
+    assert first.count == 100_000
+    assert sum(len(level) for level in first.levels) < 2_000
+    for q in (0.01, 0.5, 0.9, 0.99):
+        assert abs(first.quantile(q) - q * 100_000) < 2_000
+
+    restored = sketches.KLLSketch.from_bytes(first.to_bytes())
+    assert restored.quantile(0.5) == first.quantile(0.5)
+
+def test_distribution_by_scope():
+    """
+    The endpoint must answer for all runs, one map and one player, and
+    only count each run once however often it is updated after finishing.
+    """
+    alice = client.post("/players", json={"name": "Alice"}).json()
+    bob = client.post("/players", json={"name": "Bob"}).json()
+    for duration in (60, 120, 180):
+        finish_run(alice, "forest", duration, duration // 6)
+    run_id = finish_run(bob, "cave", 600, 30)
+    client.patch(f"/runs/{run_id}", json={"cause_of_death": "Lava"})
+
+    everything = client.get("/analytics/distribution/duration_seconds", params={"q": [0.5, 1.0]}).json()
+    assert everything["runs"] == 4
+    assert everything["quantiles"] == {"0.5": 120.0, "1.0": 600.0}
+
+    forest = client.get("/analytics/distribution/kills_per_minute", params={"map_id": "forest"}).json()
+    assert forest["runs"] == 3 and forest["quantiles"]["0.5"] == 10.0
+
+    bobs = client.get("/analytics/distribution/duration_seconds", params={"player_id": bob["id"], "q": 0.5}).json()
+    assert bobs["runs"] == 1 and bobs["quantiles"] == {"0.5": 600.0}
+
+    assert client.get("/analytics/distribution/duration_seconds", params={"q": 2}).status_code == 422
+
+def test_saved_sketches_are_reloaded_with_newer_runs():
+    """
+    After a restart, the saved sketches plus the runs finished since must
+    give the same counts as before.
+    """
+    player = client.post("/players", json={"name": "Saver"}).json()
+    finish_run(player, "forest", 100, 10)
+    client.get("/analytics/distribution/duration_seconds")
+    sketches.index.persist(engine)
+
+    finish_run(player, "forest", 300, 10)
+    sketches.index.reset()
+    reloaded = client.get("/analytics/distribution/duration_seconds", params={"map_id": "forest", "q": [0.0, 1.0]}).json()
+    assert reloaded["runs"] == 2
+    assert reloaded["quantiles"] == {"0.0": 100.0, "1.0": 300.0}
+
+def test_runs_edited_after_saving_are_not_counted_twice():
+    """
+    Editing a finished run after the sketches were saved must not count it
+    again on reload, and a save must only rewrite the sketches that changed.
+    """
+    player = client.post("/players", json={"name": "Editor"}).json()
+    run_id = finish_run(player, "forest", 100, 10)
+    client.get("/analytics/distribution/duration_seconds")
+    sketches.index.persist(engine)
+    client.patch(f"/runs/{run_id}", json={"cause_of_death": "Wolves"})
+
+    finish_run(player, "cave", 200, 10)
+    with engine.connect() as connection:
+        saved_forest = connection.execute(text("SELECT watermark FROM quantile_sketches WHERE scope = 'map:forest'")).scalars().all()
+        sketches.index.persist(engine)
+        assert connection.execute(text("SELECT watermark FROM quantile_sketches WHERE scope = 'map:forest'")).scalars().all() == saved_forest
+
+    sketches.index.reset()
+    overall = client.get("/analytics/distribution/duration_seconds").json()
+    assert overall["runs"] == 2
+    forest = client.get("/analytics/distribution/duration_seconds", params={"map_id": "forest"}).json()
+    assert forest["runs"] == 1
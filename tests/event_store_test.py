@@ -0,0 +1,145 @@
+# This file contains tests for the packed run event storage.
+# It verifies that packs round-trip exactly, that finishing a run packs its
+# events transparently, and that packs are deleted with their runs.
+
+import datetime
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+import event_store
+import models
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+def to_millisecond(events):
+    """Truncates event timestamps to milliseconds, as packs store them."""
+    for event in events:
+        moment = datetime.datetime.fromisoformat(event["timestamp"])
+        event["timestamp"] = moment.replace(microsecond=moment.microsecond // 1000 * 1000)
+    return events
+
+def test_pack_round_trip():
+    """
+    Decoding a pack must give back exactly the events that were encoded,
+    to the millisecond, including events from before the run started.
+    """
+    started = datetime.datetime(2024, 5, 1, 12, 0, 0)
+    events = [
+        (10, 1, started + datetime.timedelta(seconds=1.5), "3"),
+        (11, 2, started - datetime.timedelta(milliseconds=250), None),
+        (15, 1, started + datetime.timedelta(hours=2), "Überboss ☠"),
+        (16, 3, started, ""),
+    ]
+    assert event_store.decode(event_store.encode(started, events)) == events
+
+def test_finished_run_events_are_packed_transparently():
+    """
+    Events must read the same before and after a run finishes, even though
+    finishing moves them out of `run_events` into a pack.
+    """
+    player = client.post("/players", json={"name": "Packer"}).json()
+    run_id = client.post("/runs/start", json={"player_name": "Packer", "password": player["password"], "map_id": "forest"}).json()["run_id"]
+    for index in range(50):
+        client.post(f"/runs/{run_id}/events", json={"event_type": "kill" if index % 2 else "level_up", "value": str(index)})
+    before = client.get(f"/runs/{run_id}/events").json()
+
+    client.patch(f"/runs/{run_id}", json={"status": "died", "duration_seconds": 60})
+    after = client.get(f"/runs/{run_id}/events").json()
+    assert to_millisecond(after) == to_millisecond(before)
+
+    db = TestingSessionLocal()
+    try:
+        assert db.query(models.RunEvent).filter(models.RunEvent.run_id == run_id).count() == 0
+        pack = db.get(models.RunEventPack, run_id)
+        assert pack.event_count == 50
+        assert db.query(models.EventType).count() == 2
+    finally:
+        db.close()
+
+    # An event sent after the run finished is still returned, in order.
+    client.post(f"/runs/{run_id}/events", json={"event_type": "late", "value": None})
+    events = client.get(f"/runs/{run_id}/events").json()
+    assert len(events) == 51 and events[-1]["event_type"] == "late"
+
+def test_packs_are_deleted_with_their_runs():
+    """
+    Deleting a finished run must remove its packed events too.
+    """
+    player = client.post("/players", json={"name": "Deleter"}).json()
+    run_id = client.post("/runs/start", json={"player_name": "Deleter", "password": player["password"], "map_id": "forest"}).json()["run_id"]
+    client.post(f"/runs/{run_id}/events", json={"event_type": "kill"})
+    client.patch(f"/runs/{run_id}", json={"status": "completed"})
+
+    client.delete(f"/runs/{run_id}")
+    db = TestingSessionLocal()
+    try:
+        assert db.get(models.RunEventPack, run_id) is None
+    finally:
+        db.close()
+
+def test_concurrent_new_event_types_share_one_id():
+    """
+    Two sessions adding the same new event type at once must both get the
+    one row's ID, instead of the second failing on the unique name.
+    """
+    import threading
+    first, second = TestingSessionLocal(), TestingSessionLocal()
+    try:
+        first_id = event_store.type_id(first, "meteor")
+        result = {}
+        # The second session finds no committed row, so it inserts too,
+        # waiting for the first one's write lock.
+        racer = threading.Thread(target=lambda: result.setdefault("id", event_store.type_id(second, "meteor")))
+        racer.start()
+        time.sleep(0.2)
+        first.commit()
+        racer.join()
+        second.commit()
+        assert result["id"] == first_id
+        assert first.query(models.EventType).filter(models.EventType.name == "meteor").count() == 1
+    finally:
+        first.close()
+        second.close()
@@ -0,0 +1,89 @@
+# This file contains tests for the request lanes.
+# It verifies how routes are assigned to lanes, that a full lane turns
+# requests away without affecting other lanes, and that sessions come from
+# the lane's own connection pool.
+
+import asyncio
+
+import httpx
+import pytest
+from starlette.responses import PlainTextResponse
+
+import database
+import lanes
+
+def test_routes_are_classified_into_lanes():
+    """
+    Each route group must be served by its own lane.
+    """
+    assert lanes.classify("PATCH", "/runs/5").name == "gameplay"
+    assert lanes.classify("POST", "/runs/5/events").name == "gameplay"
+    assert lanes.classify("POST", "/runs/start").name == "auth"
+    assert lanes.classify("POST", "/players").name == "auth"
+    assert lanes.classify("GET", "/analytics/leaderboard").name == "analytics"
+    assert lanes.classify("GET", "/players/3").name == "analytics"
+    assert lanes.classify("POST", "/admin/retention").name == "admin"
+    # A prefix only matches whole path segments.
+    assert lanes.classify("GET", "/runsheet").name == "analytics"
+
+def test_run_reads_and_name_checks_stay_out_of_busy_lanes():
+    """
+    Reads of runs must not take gameplay slots, and only sign-up itself may
+    take a slot in the auth lane.
+    """
+    assert lanes.classify("GET", "/runs").name == "analytics"
+    assert lanes.classify("GET", "/runs/5").name == "analytics"
+    assert lanes.classify("GET", "/runs/5/curve").name == "analytics"
+    assert lanes.classify("GET", "/runs/5/events").name == "analytics"
+    assert lanes.classify("DELETE", "/runs/5").name == "gameplay"
+    assert lanes.classify("PATCH", "/runs/5/update").name == "gameplay"
+    assert lanes.classify("POST", "/players/check-name").name == "analytics"
+    assert lanes.classify("GET", "/players").name == "analytics"
+
+def test_full_lane_rejects_without_blocking_other_lanes(monkeypatch):
+    """
+    Once a lane is full, further requests to it must get a 503 after its
+    queue timeout, while other lanes keep serving.
+    """
+    monkeypatch.setitem(lanes.LANES, "analytics", lanes.Lane("analytics", 1, 0.05))
+    release = asyncio.Event()
+
+    async def app(scope, receive, send):
+        if scope["path"].startswith("/analytics"):
+            await release.wait()
+        await PlainTextResponse(lanes.current_lane().name)(scope, receive, send)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=lanes.LaneMiddleware(app))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            slow = asyncio.create_task(client.get("/analytics/players-summary"))
+            await asyncio.sleep(0.01)
+            rejected = await client.get("/analytics/leaderboard")
+            gameplay = await client.patch("/runs/1")
+            release.set()
+            return rejected, gameplay, await slow
+
+    rejected, gameplay, slow = asyncio.run(scenario())
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"] == "1"
+    assert gameplay.status_code == 200 and gameplay.text == "gameplay"
+    assert slow.status_code == 200 and slow.text == "analytics"
+
+def test_sessions_come_from_the_lane_pool():
+    """
+    A session opened while serving a lane must be bound to that lane's engine.
+    """
+    lane = lanes.LANES["gameplay"]
+    token = lanes._current_lane.set(lane)
+    try:
+        sessions = database.get_db()
+        db = next(sessions)
+        assert db.get_bind() is lane.sessionmaker.kw["bind"]
+        assert db.get_bind().pool.size() == lane.limit
+        sessions.close()
+    finally:
+        lanes._current_lane.reset(token)
+
+    sessions = database.get_db()
+    assert next(sessions).get_bind() is database.engine
+    sessions.close()
@@ -0,0 +1,128 @@
+# This file contains tests for the windowed, per-map leaderboards.
+# It verifies that finished runs are ranked on the right boards and that
+# the in-memory boards follow renames and deletes.
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+ADMIN_AUTH = ("admin", "admin")
+
+def finish_run(player, map_id, duration, status="died"):
+    """Starts a run on a map, ends it with a duration and returns its ID."""
+    run = client.post("/runs/start", json={"player_name": player["name"], "password": player["password"], "map_id": map_id}).json()
+    client.patch(f"/runs/{run['run_id']}", json={"duration_seconds": duration, "status": status})
+    return run["run_id"]
+
+def board(window, map_id=None):
+    """Returns the run IDs on a leaderboard, best first."""
+    params = {"map_id": map_id} if map_id else {}
+    response = client.get(f"/analytics/leaderboard/{window}", params=params)
+    assert response.status_code == 200
+    return [entry["run_id"] for entry in response.json()]
+
+# --- Leaderboard Tests ---
+
+def test_windowed_leaderboards_per_map():
+    """
+    Tests that finished runs are ranked per map and across all maps, and
+    that runs still in progress are left off.
+    """
+    player = client.post("/players", json={"name": "board_player"}).json()
+    short_run = finish_run(player, "map1", 100)
+    long_run = finish_run(player, "map1", 500, status="completed")
+    other_map_run = finish_run(player, "map2", 300)
+    client.post("/runs/start", json={"player_name": player["name"], "password": player["password"], "map_id": "map1"})
+
+    for window in ("daily", "weekly", "all_time"):
+        assert board(window, "map1") == [long_run, short_run]
+        assert board(window, "map2") == [other_map_run]
+        assert board(window) == [long_run, other_map_run, short_run]
+
+    assert client.get("/analytics/leaderboard/monthly").status_code == 422
+
+def test_leaderboards_rebuild_from_database():
+    """
+    Tests that boards rebuilt from the database only show old runs on the
+    all-time board, and match what was kept in memory.
+    """
+    import datetime
+    import indexes
+    import models
+    player = client.post("/players", json={"name": "veteran"}).json()
+    old_run = finish_run(player, "map1", 900)
+    new_run = finish_run(player, "map1", 200)
+
+    # Move the first run back into a previous week.
+    db = TestingSessionLocal()
+    try:
+        db.get(models.Run, old_run).started_at -= datetime.timedelta(days=14)
+        db.commit()
+    finally:
+        db.close()
+    indexes.reset_all()
+
+    assert board("all_time", "map1") == [old_run, new_run]
+    assert board("weekly", "map1") == [new_run]
+    assert board("daily", "map1") == [new_run]
+
+def test_leaderboards_follow_renames_and_deletes():
+    """
+    Tests that renaming a player updates their entries, and that deleted
+    runs disappear from the boards.
+    """
+    player = client.post("/players", json={"name": "before_rename"}).json()
+    kept_run = finish_run(player, "map1", 100)
+    deleted_run = finish_run(player, "map1", 400)
+    assert board("daily", "map1") == [deleted_run, kept_run]
+
+    client.patch(f"/admin/players/{player['id']}", json={"name": "after_rename"}, auth=ADMIN_AUTH)
+    entries = client.get("/analytics/leaderboard/daily", params={"map_id": "map1"}).json()
+    assert {entry["player_name"] for entry in entries} == {"after_rename"}
+
+    client.delete(f"/admin/runs/{deleted_run}", auth=ADMIN_AUTH)
+    assert board("daily", "map1") == [kept_run]
+    assert board("all_time") == [kept_run]
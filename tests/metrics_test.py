@@ -0,0 +1,112 @@
+# This file contains tests for the request metrics exposed at `/metrics`.
+# It verifies that latency, SQL statement counts and phase timings
+# are recorded per route in the Prometheus text format.
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+# --- Metrics Tests ---
+
+def test_metrics_record_route_latency_and_statements():
+    """
+    Tests that a request is counted under its route template, together
+    with its latency and the number of SQL statements it issued.
+    """
+    player = client.post("/players", json={"name": "metrics_player"}).json()
+    client.get(f"/players/{player['id']}")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'http_requests_total{method="GET",route="/players/{player_id}",status="200"}' in body
+    assert 'http_request_duration_seconds_count{method="GET",route="/players/{player_id}"}' in body
+    # Fetching a player by ID is a single SELECT.
+    assert 'http_request_db_statements_bucket{method="GET",route="/players/{player_id}",le="1.0"}' in body
+    statements_line = next(
+        line for line in body.splitlines()
+        if line.startswith('http_request_db_statements_sum{method="GET",route="/players/{player_id}"}')
+    )
+    assert float(statements_line.split()[-1]) >= 1
+
+def test_metrics_record_bcrypt_time():
+    """
+    Tests that time spent hashing passwords is attributed to the bcrypt phase.
+    """
+    client.post("/players", json={"name": "bcrypt_player"})
+
+    body = client.get("/metrics").text
+    bcrypt_line = next(
+        line for line in body.splitlines()
+        if line.startswith('http_request_phase_seconds_sum{method="POST",route="/players",phase="bcrypt"}')
+    )
+    assert float(bcrypt_line.split()[-1]) > 0
+
+def test_failed_queries_are_timed_and_routes_wrapped_at_startup(caplog):
+    """
+    Tests that a statement that raises is still timed and handed to the
+    query listeners, leaving no start time behind, and that endpoints are
+    wrapped when the app is set up rather than on the first request.
+    """
+    import metrics
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+
+    route = next(route for route in app.routes if getattr(route, "path", None) == "/test1")
+    assert hasattr(route.dependant.call, "__wrapped__")
+
+    timings = []
+    listener = metrics.on_query(lambda statement, parameters, seconds: timings.append(statement))
+    try:
+        with engine.connect() as connection:
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM no_such_table"))
+            connection.execute(text("SELECT 1"))
+            assert connection.info["query_started"] == {}
+    finally:
+        metrics._query_listeners.remove(listener)
+    assert timings == ["SELECT * FROM no_such_table", "SELECT 1"]
@@ -0,0 +1,128 @@
+# This file contains tests for the username availability check.
+# It verifies that the Bloom filter in front of the check never reports a
+# taken name as available, and that free names skip the database.
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+import name_filter
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+ADMIN_AUTH = ("admin", "admin")
+
+
+def check(name):
+    """Returns whether the username check reports the name as taken."""
+    return client.post("/players/check-name", json={"player_name": name}).json()["exists"]
+
+def test_bloom_filter_has_no_false_negatives():
+    """
+    Every name added to the filter must be reported as possibly present.
+    """
+    bloom = name_filter.BloomFilter(capacity=1000, error_rate=0.01)
+    names = [f"Player{i}" for i in range(1000)]
+    for name in names:
+        bloom.add(name)
+    assert all(bloom.might_contain(name) for name in names)
+    false_positives = sum(bloom.might_contain(f"Other{i}") for i in range(10000))
+    assert false_positives < 300
+
+def test_check_name_follows_create_rename_and_delete():
+    """
+    The check must track players as they are created, renamed and deleted.
+    """
+    assert check("Alice") is False
+    alice = client.post("/players", json={"name": "Alice"}).json()
+    assert check("Alice") is True
+
+    client.patch(f"/admin/players/{alice['id']}", json={"name": "Alicia"}, auth=ADMIN_AUTH)
+    assert check("Alicia") is True
+    assert check("Alice") is False
+
+    client.delete(f"/players/{alice['id']}")
+    assert check("Alicia") is False
+
+    # A name freed by a delete can be registered again.
+    response = client.post("/players", json={"name": "Alicia"})
+    assert response.status_code == 201
+
+def test_available_name_skips_database():
+    """
+    Once the filter is loaded, a free name must be answered without
+    running any SQL.
+    """
+    client.post("/players", json={"name": "Bob"})
+    check("Warmup")
+
+    statements = []
+    def count(*args):
+        statements.append(args[2])
+    event.listen(Engine, "before_cursor_execute", count)
+    try:
+        assert check("Nobody") is False
+        assert check("Bob") is True
+    finally:
+        event.remove(Engine, "before_cursor_execute", count)
+    # Only the taken name needed the EXISTS query.
+    assert len(statements) == 1
+
+def test_name_taken_on_another_worker_is_rejected(monkeypatch):
+    """
+    A name the filter has not heard of yet, as when another worker has just
+    created it, must still be rejected with a 409 rather than a 500.
+    """
+    carol = client.post("/players", json={"name": "Carol"}).json()
+    dave = client.post("/players", json={"name": "Dave"}).json()
+    monkeypatch.setattr(name_filter.index, "might_exist", lambda db, name: False)
+
+    assert client.post("/players", json={"name": "Carol"}).status_code == 409
+    response = client.post("/runs/start", json={
+        "player_name": "Carol", "password": "secret", "map_id": "map1", "create_new_player": True,
+    })
+    assert response.status_code == 409
+    response = client.patch(f"/admin/players/{dave['id']}", json={"name": "Carol"}, auth=ADMIN_AUTH)
+    assert response.status_code == 409
+    assert client.get(f"/players/{carol['id']}").json()["name"] == "Carol"
+    assert client.get(f"/players/{dave['id']}").json()["name"] == "Dave"
@@ -0,0 +1,140 @@
+# This file contains tests for the run and player rank lookups.
+# It verifies the ranks and percentiles served from the order-statistic
+# index, and that the index follows run updates and deletes.
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+def new_player(name):
+    """Creates a player and returns their details, including the password."""
+    return client.post("/players", json={"name": name}).json()
+
+def finish_run(player, map_id, duration):
+    """Starts a run on a map, ends it with a duration and returns its ID."""
+    run = client.post("/runs/start", json={"player_name": player["name"], "password": player["password"], "map_id": map_id}).json()
+    client.patch(f"/runs/{run['run_id']}", json={"duration_seconds": duration, "status": "died"})
+    return run["run_id"]
+
+# --- Rank Tests ---
+
+def test_run_rank_overall_and_on_map():
+    """
+    Tests the rank and percentile of runs overall and on their map,
+    including runs longer than the counter's initial size.
+    """
+    alice, bob = new_player("rank_alice"), new_player("rank_bob")
+    slow = finish_run(alice, "map1", 100)
+    fast = finish_run(bob, "map1", 5000)
+    middle = finish_run(bob, "map2", 300)
+
+    rank = client.get(f"/analytics/rank/run/{middle}").json()
+    assert rank["overall"] == {"rank": 2, "total": 3, "percentile": 66.67}
+    assert rank["on_map"] == {"rank": 1, "total": 1, "percentile": 100.0}
+
+    assert client.get(f"/analytics/rank/run/{fast}").json()["overall"]["rank"] == 1
+    slow_rank = client.get(f"/analytics/rank/run/{slow}").json()
+    assert slow_rank["overall"]["rank"] == 3
+    assert slow_rank["on_map"] == {"rank": 2, "total": 2, "percentile": 50.0}
+
+def test_player_rank_uses_best_run():
+    """
+    Tests that players are ranked by their best finished run, overall and
+    on each map they have played.
+    """
+    alice, bob = new_player("best_alice"), new_player("best_bob")
+    finish_run(alice, "map1", 100)
+    finish_run(alice, "map2", 700)
+    finish_run(bob, "map1", 400)
+
+    rank = client.get(f"/analytics/rank/player/{alice['id']}").json()
+    assert rank["best_run_seconds"] == 700
+    assert rank["overall"] == {"rank": 1, "total": 2, "percentile": 100.0}
+    assert rank["by_map"]["map1"] == {"rank": 2, "total": 2, "percentile": 50.0}
+    assert rank["by_map"]["map2"]["rank"] == 1
+
+def test_rank_follows_updates_and_deletes():
+    """
+    Tests that unfinished runs are not ranked, and that updating or deleting
+    a finished run is reflected in the ranks straight away.
+    """
+    alice, bob = new_player("live_alice"), new_player("live_bob")
+    run = client.post("/runs/start", json={"player_name": alice["name"], "password": alice["password"], "map_id": "map1"}).json()
+    assert client.get(f"/analytics/rank/run/{run['run_id']}").status_code == 404
+    assert client.get(f"/analytics/rank/player/{alice['id']}").status_code == 404
+
+    other = finish_run(bob, "map1", 200)
+    client.patch(f"/runs/{run['run_id']}", json={"duration_seconds": 100, "status": "died"})
+    assert client.get(f"/analytics/rank/run/{run['run_id']}").json()["overall"]["rank"] == 2
+
+    client.patch(f"/runs/{run['run_id']}", json={"duration_seconds": 300})
+    assert client.get(f"/analytics/rank/run/{run['run_id']}").json()["overall"]["rank"] == 1
+    assert client.get(f"/analytics/rank/player/{alice['id']}").json()["overall"]["rank"] == 1
+
+    client.delete(f"/runs/{other}")
+    assert client.get(f"/analytics/rank/run/{run['run_id']}").json()["overall"]["total"] == 1
+    assert client.get(f"/analytics/rank/player/{bob['id']}").status_code == 404
+
+def test_player_best_falls_back_when_best_run_goes():
+    """
+    Tests that removing a player's best run leaves their next best in
+    place, and that a tie at the best keeps it until both runs are gone.
+    """
+    alice = new_player("fallback_alice")
+    first = finish_run(alice, "map1", 500)
+    second = finish_run(alice, "map1", 500)
+    finish_run(alice, "map2", 200)
+    finish_run(alice, "map1", 300)
+
+    client.delete(f"/runs/{first}")
+    rank = client.get(f"/analytics/rank/player/{alice['id']}").json()
+    assert rank["best_run_seconds"] == 500
+
+    client.delete(f"/runs/{second}")
+    rank = client.get(f"/analytics/rank/player/{alice['id']}").json()
+    assert rank["best_run_seconds"] == 300
+    assert set(rank["by_map"]) == {"map1", "map2"}
+    assert rank["overall"] == {"rank": 1, "total": 1, "percentile": 100.0}
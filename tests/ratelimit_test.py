@@ -0,0 +1,115 @@
+# This file contains tests for the token-bucket rate limits.
+# It verifies that bursts beyond a bucket are turned away with a 429 and a
+# Retry-After header, that buckets are kept per client (and per client and
+# player for sign-ins), and that the SQLite backend shares buckets between
+# workers.
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+from config import settings
+import ratelimit
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+
+def test_bucket_refills_at_its_rate():
+    """
+    A bucket must allow its burst, then report how long until the next
+    token, and keep separate keys apart.
+    """
+    backend = ratelimit.MemoryBackend()
+    assert [backend.take("a", 2.0, 3) for _ in range(3)] == [0.0, 0.0, 0.0]
+    wait = backend.take("a", 2.0, 3)
+    assert 0.4 < wait <= 0.5
+    assert backend.take("b", 2.0, 3) == 0.0
+
+def test_name_checks_are_limited_per_client(monkeypatch):
+    """
+    Name checks beyond the burst must get a 429 with a Retry-After header,
+    while a client with a different IP is still served.
+    """
+    monkeypatch.setitem(settings.rate_limit_rates, "name_check", 0.5)
+    monkeypatch.setitem(settings.rate_limit_bursts, "name_check", 2)
+    for _ in range(2):
+        assert client.post("/players/check-name", json={"player_name": "Spammer"}).status_code == 200
+    response = client.post("/players/check-name", json={"player_name": "Spammer"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+
+    other_client = TestClient(app, client=("10.0.0.2", 50000))
+    assert other_client.post("/players/check-name", json={"player_name": "Spammer"}).status_code == 200
+    assert 'http_requests_rate_limited_total{group="name_check"}' in client.get("/metrics").text
+
+def test_run_starts_are_limited_per_client_and_player(monkeypatch):
+    """
+    Sign-ins for one player must be limited per client, without affecting
+    other players, or the same player signing in from another client.
+    """
+    monkeypatch.setitem(settings.rate_limit_rates, "player", 0.1)
+    monkeypatch.setitem(settings.rate_limit_bursts, "player", 1)
+    target = client.post("/players", json={"name": "Target"}).json()
+    bystander = client.post("/players", json={"name": "Bystander"}).json()
+
+    assert client.post("/runs/start", json={"player_name": "Target", "password": "guess", "map_id": "map1"}).status_code == 401
+    response = client.post("/runs/start", json={"player_name": "Target", "password": target["password"], "map_id": "map1"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "10"
+    response = client.post("/runs/start", json={"player_name": "Bystander", "password": bystander["password"], "map_id": "map1"})
+    assert response.status_code == 200
+
+    # Whoever used up the bucket above cannot lock the player out elsewhere.
+    own_client = TestClient(app, client=("10.0.0.3", 50000))
+    response = own_client.post("/runs/start", json={"player_name": "Target", "password": target["password"], "map_id": "map1"})
+    assert response.status_code == 200
+
+def test_sqlite_backend_shares_buckets(tmp_path):
+    """
+    Two workers using the SQLite backend must draw from the same bucket.
+    """
+    path = str(tmp_path / "ratelimit.db")
+    first, second = ratelimit.SQLiteBackend(path), ratelimit.SQLiteBackend(path)
+    assert first.take("auth:1.2.3.4", 1.0, 2) == 0.0
+    assert second.take("auth:1.2.3.4", 1.0, 2) == 0.0
+    assert first.take("auth:1.2.3.4", 1.0, 2) > 0.9
+    assert second.take("auth:5.6.7.8", 1.0, 2) == 0.0
@@ -0,0 +1,193 @@
+# This file contains tests for read-replica routing.
+# It verifies that analytics and list endpoints read from a snapshot
+# replica while it is within the allowed lag, that they fall back to the
+# primary once it is not, that lag is measured against recent states of
+# the primary, and that writes and indexes use the primary.
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+import models
+from config import settings
+import name_search
+import replicas
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+
+@pytest.fixture
+def snapshot(tmp_path, monkeypatch):
+    """A snapshot replica that is only refreshed by the test itself."""
+    monkeypatch.setattr(settings, "replica_snapshot_path", str(tmp_path / "replica.db"))
+    monkeypatch.setattr(settings, "replica_snapshot_interval_seconds", 3600.0)
+    monkeypatch.setattr(settings, "replica_lag_check_interval_seconds", 0.0)
+    replicas.replica.reset()
+    yield replicas.replica
+    replicas.replica.reset()
+
+def player_names():
+    return [player["name"] for player in client.get("/players").json()]
+
+def test_reads_use_the_snapshot_within_the_allowed_lag(snapshot, monkeypatch):
+    """
+    List endpoints must serve the snapshot while it is recent enough, even
+    if it lacks the latest write, and the primary once it is too far behind.
+    """
+    client.post("/players", json={"name": "Before"})
+    snapshot.refresh_snapshot(engine)
+    assert player_names() == ["Before"]
+    assert snapshot.lag_seconds < 1
+
+    after = client.post("/players", json={"name": "After"}).json()
+    # Reads that must see their writes stay on the primary.
+    assert client.get(f"/players/{after['id']}").status_code == 200
+    assert player_names() == ["Before"]
+
+    monkeypatch.setattr(settings, "replica_max_lag_seconds", 0.0)
+    assert player_names() == ["Before", "After"]
+
+def test_indexes_are_built_from_the_primary(snapshot):
+    """
+    An index first used through the replica must still hold every write,
+    since the write paths only keep it current from then on.
+    """
+    client.post("/players", json={"name": "Old Timer"})
+    snapshot.refresh_snapshot(engine)
+    client.post("/players", json={"name": "Newcomer"})
+    name_search.index.reset()
+
+    with TestingSessionLocal() as primary:
+        read_db = snapshot.session_for(lambda: primary)
+        assert read_db is not None
+        try:
+            matches = name_search.index.search(read_db, "New", 10)
+        finally:
+            read_db.close()
+    assert [name for _, name in matches] == ["Newcomer"]
+
+def test_player_sketches_are_built_from_the_primary(snapshot):
+    """
+    A player's cached sketch first built through the replica must still
+    count the runs the replica has not caught up on.
+    """
+    import schemas
+    import sketches
+    player = client.post("/players", json={"name": "Sketched"}).json()
+    for duration in (100, 200):
+        run = client.post("/runs/start", json={"player_name": player["name"], "password": player["password"], "map_id": "map1"}).json()
+        client.patch(f"/runs/{run['run_id']}", json={"duration_seconds": duration, "status": "died"})
+        if duration == 100:
+            snapshot.refresh_snapshot(engine)
+    sketches.index.discard_player(player["id"])
+
+    with TestingSessionLocal() as primary:
+        read_db = snapshot.session_for(lambda: primary)
+        assert read_db is not None
+        try:
+            distribution = sketches.index.distribution(
+                read_db, schemas.DistributionMetric.duration_seconds, [1.0], player_id=player["id"]
+            )
+        finally:
+            read_db.close()
+    assert distribution.runs == 2
+
+def test_reads_stay_on_the_primary_without_a_snapshot(snapshot):
+    """
+    Until the first snapshot has been taken, reads must use the primary.
+    """
+    client.post("/players", json={"name": "Early"})
+    assert snapshot.lag_seconds is None
+    assert player_names() == ["Early"]
+
+def set_last_seq(session_factory, last_seq):
+    with session_factory() as db:
+        state = db.get(models.SyncState, 1) or models.SyncState(id=1, pruned_seq=0)
+        state.last_seq = last_seq
+        db.merge(state)
+        db.commit()
+
+def test_lag_is_measured_against_recent_states_of_the_primary(tmp_path, monkeypatch):
+    """
+    A replica that never quite catches up with a busy primary must report
+    how long ago the primary was where the replica is now, not fall back.
+    """
+    replica_engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    Base.metadata.create_all(bind=replica_engine)
+    ReplicaSession = sessionmaker(bind=replica_engine)
+    monkeypatch.setattr(settings, "replica_database_url", f"sqlite:///{tmp_path / 'replica.db'}")
+    monkeypatch.setattr(settings, "replica_lag_check_interval_seconds", 0.0)
+    replicas.replica.reset()
+    try:
+        with TestingSessionLocal() as primary:
+            set_last_seq(TestingSessionLocal, 5)
+            set_last_seq(ReplicaSession, 3)
+            assert replicas.replica.session_for(lambda: primary) is None
+
+            set_last_seq(TestingSessionLocal, 8)
+            set_last_seq(ReplicaSession, 5)
+            read_db = replicas.replica.session_for(lambda: primary)
+            assert read_db is not None
+            read_db.close()
+            assert replicas.replica.lag_seconds < 1
+    finally:
+        replicas.replica.reset()
+        replica_engine.dispose()
+
+def test_replica_reads_only_open_the_primary_when_needed(snapshot, monkeypatch):
+    """
+    Between lag checks, a read served by the replica must not open a
+    session on the primary.
+    """
+    client.post("/players", json={"name": "Reader"})
+    snapshot.refresh_snapshot(engine)
+    assert player_names() == ["Reader"]
+
+    opened = []
+    def counting_get_db():
+        opened.append(True)
+        yield from override_get_db()
+    monkeypatch.setattr(settings, "replica_lag_check_interval_seconds", 3600.0)
+    monkeypatch.setitem(app.dependency_overrides, get_db, counting_get_db)
+    assert player_names() == ["Reader"]
+    assert opened == []
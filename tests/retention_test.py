@@ -0,0 +1,271 @@
+# This file contains tests for the data retention job.
+# It verifies that old runs are moved into the archive while player
+# statistics and the leaderboard stay correct.
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+ADMIN_AUTH = ("admin", "admin")
+
+def play_run(player, duration, kills, upgrades):
+    """Starts and finishes a run for a player and returns its ID."""
+    run = client.post("/runs/start", json={"player_name": player["name"], "password": player["password"], "map_id": "map1"}).json()
+    client.patch(f"/runs/{run['run_id']}", json={
+        "duration_seconds": duration, "kills_total": kills, "upgrades": upgrades, "status": "died",
+    })
+    return run["run_id"]
+
+def backdate_runs(days):
+    """Moves the start of every run back by a number of days."""
+    import datetime
+    import models
+    db = TestingSessionLocal()
+    try:
+        for run in db.query(models.Run):
+            run.started_at -= datetime.timedelta(days=days)
+        db.commit()
+    finally:
+        db.close()
+
+# --- Retention Tests ---
+
+def test_retention_archives_runs_beyond_player_cap(monkeypatch, tmp_path):
+    """
+    Tests that runs beyond the per-player cap are written to an archive
+    file and removed, while the player's statistics remain unchanged.
+    """
+    import retention
+    from config import settings
+    monkeypatch.setattr(settings, "retention_max_runs_per_player", 1)
+    monkeypatch.setattr(settings, "retention_keep_top_runs", 0)
+    monkeypatch.setattr(settings, "archive_dir", str(tmp_path))
+
+    # 1. Play three runs, with the oldest one being the longest.
+    player = client.post("/players", json={"name": "retained"}).json()
+    first_run = play_run(player, 300, 30, {"speed": 3})
+    client.post(f"/runs/{first_run}/events", json={"event_type": "boss_defeated"})
+    play_run(player, 100, 10, {"damage": 1})
+    latest_run = play_run(player, 200, 20, {"damage": 1})
+    backdate_runs(30)
+    stats_before = client.get(f"/analytics/view_player_stats/{player['id']}").json()
+
+    # 2. Run the retention job through the admin endpoint.
+    response = client.post("/admin/retention", auth=ADMIN_AUTH)
+    assert response.status_code == 202
+    job = client.get(f"/admin/jobs/{response.json()['id']}", auth=ADMIN_AUTH).json()
+    assert job["status"] == "completed"
+    assert job["processed"] == 2
+
+    # 3. Only the latest run is left in the hot table...
+    runs = client.get(f"/players/{player['id']}/runs").json()
+    assert [run["id"] for run in runs] == [latest_run]
+    assert retention.find_expired_run_ids(TestingSessionLocal()) == []
+
+    # 4. ...but the player's statistics still include the archived runs.
+    assert client.get(f"/analytics/view_player_stats/{player['id']}").json() == stats_before
+    summary = client.get("/analytics/players-summary").json()[0]
+    assert summary["total_runs"] == 3
+    assert summary["best_run_time"] == 300
+
+    # 5. The archive holds both runs, including their events.
+    import gzip, json
+    archive_files = list(tmp_path.iterdir())
+    assert len(archive_files) == 1
+    with gzip.open(archive_files[0], "rt") as archive:
+        archived = [json.loads(line) for line in archive]
+    assert len(archived) == 2
+    assert archived[0]["id"] == first_run
+    assert archived[0]["events"][0]["event_type"] == "boss_defeated"
+
+def test_retention_keeps_leaderboard_runs(monkeypatch, tmp_path):
+    """
+    Tests that the longest runs, and runs from the current week, are never
+    archived, so the leaderboards are unchanged by the retention job.
+    """
+    import retention
+    from config import settings
+    monkeypatch.setattr(settings, "retention_max_runs_per_player", 1)
+    monkeypatch.setattr(settings, "retention_keep_top_runs", 1)
+    monkeypatch.setattr(settings, "archive_dir", str(tmp_path))
+
+    player = client.post("/players", json={"name": "champion"}).json()
+    best_run = play_run(player, 900, 5, {})
+    older_run = play_run(player, 100, 5, {})
+    backdate_runs(30)
+    leaderboard_before = client.get("/analytics/leaderboard").json()
+
+    assert retention.run_retention(TestingSessionLocal()) is None
+    assert client.get("/analytics/leaderboard").json() == leaderboard_before
+    assert leaderboard_before[0]["run_id"] == best_run
+
+    # Runs from this week are kept even when they are over the cap.
+    play_run(player, 50, 5, {})
+    play_run(player, 60, 5, {})
+    assert retention.find_expired_run_ids(TestingSessionLocal()) == [older_run]
+
+def test_retention_moves_runs_into_monthly_partitions(monkeypatch, tmp_path):
+    """
+    Tests that archived runs go into one partition per month, that range
+    queries only read the overlapping months, and that a month can be
+    dropped at once.
+    """
+    import datetime
+    import models
+    import retention
+    from config import settings
+    monkeypatch.setattr(settings, "retention_max_runs_per_player", 1)
+    monkeypatch.setattr(settings, "retention_keep_top_runs", 0)
+    monkeypatch.setattr(settings, "archive_partitioned", True)
+    monkeypatch.setattr(settings, "partition_dir", str(tmp_path))
+
+    # 1. Play three runs, started in March, May and (the latest) June.
+    player = client.post("/players", json={"name": "partitioned"}).json()
+    run_ids = [play_run(player, duration, 5, {"speed": 1}) for duration in (100, 200, 300)]
+    client.post(f"/runs/{run_ids[0]}/events", json={"event_type": "boss_defeated"})
+    db = TestingSessionLocal()
+    try:
+        for run_id, started_at in zip(run_ids, ("2024-03-10", "2024-05-20", "2024-06-01")):
+            db.get(models.Run, run_id).started_at = datetime.datetime.fromisoformat(started_at)
+        db.commit()
+    finally:
+        db.close()
+
+    # 2. The two older runs are moved into their months' partitions.
+    assert retention.run_retention(TestingSessionLocal()) == str(tmp_path)
+    assert [run["id"] for run in client.get(f"/players/{player['id']}/runs").json()] == [run_ids[2]]
+    partitions = client.get("/admin/partitions", auth=ADMIN_AUTH).json()
+    assert [(partition["month"], partition["runs"]) for partition in partitions] == [("2024-03", 1), ("2024-05", 1)]
+
+    # 3. A range query never opens months outside the range.
+    (tmp_path / "runs-2023-12.db").write_bytes(b"not a database")
+    archived = client.get("/admin/archive/runs", params={"start": "2024-03-01", "end": "2024-06-01"}, auth=ADMIN_AUTH).json()
+    assert [(run["id"], run["event_count"], run["upgrades"]) for run in archived] == [(run_ids[0], 1, {"speed": 1}), (run_ids[1], 0, {"speed": 1})]
+    params = {"start": "2024-04-01", "end": "2024-06-01", "player_id": player["id"]}
+    assert [run["id"] for run in client.get("/admin/archive/runs", params=params, auth=ADMIN_AUTH).json()] == [run_ids[1]]
+    # Times with a time zone are read as UTC.
+    params = {"start": "2024-03-01T00:00:00Z", "end": "2024-06-01T00:00:00+00:00"}
+    assert [run["id"] for run in client.get("/admin/archive/runs", params=params, auth=ADMIN_AUTH).json()] == run_ids[:2]
+
+    # 4. Dropping a month removes its runs at once.
+    assert client.delete("/admin/partitions/2024-03", auth=ADMIN_AUTH).status_code == 204
+    assert client.delete("/admin/partitions/2024-03", auth=ADMIN_AUTH).status_code == 404
+    assert client.delete("/admin/partitions/2024-13", auth=ADMIN_AUTH).status_code == 422
+    archived = client.get("/admin/archive/runs", params={"start": "2024-03-01", "end": "2024-06-01"}, auth=ADMIN_AUTH).json()
+    assert [run["id"] for run in archived] == [run_ids[1]]
+
+def test_live_event_packs_are_kept_in_monthly_partitions(monkeypatch, tmp_path):
+    """
+    Tests that with `partition_live_events` the events of a finished run
+    are packed into its month's partition rather than the database, are
+    still read back with the run, go when the run does, and keep their
+    month from being dropped.
+    """
+    import datetime
+    import models
+    import partitions
+    from config import settings
+    monkeypatch.setattr(settings, "partition_live_events", True)
+    monkeypatch.setattr(settings, "partition_dir", str(tmp_path))
+
+    player = client.post("/players", json={"name": "live_partitioned"}).json()
+    run_ids = []
+    for _ in range(2):
+        run = client.post("/runs/start", json={"player_name": player["name"], "password": player["password"], "map_id": "map1"}).json()
+        client.post(f"/runs/{run['run_id']}/events", json={"event_type": "boss_defeated", "value": "dragon"})
+        client.patch(f"/runs/{run['run_id']}", json={"status": "died"})
+        run_ids.append(run["run_id"])
+
+    month = partitions.month_of(datetime.datetime.now())
+    db = TestingSessionLocal()
+    try:
+        assert db.query(models.RunEventPack).count() == 0
+        assert db.query(models.RunEvent).count() == 0
+        started_at = db.get(models.Run, run_ids[0]).started_at
+    finally:
+        db.close()
+    assert [event["value"] for event in client.get(f"/runs/{run_ids[0]}/events").json()] == ["dragon"]
+
+    # Deleting a run deletes its pack.
+    assert client.delete(f"/runs/{run_ids[0]}").status_code == 200
+    assert partitions.read_pack(run_ids[0], started_at) is None
+
+    # The month still holds the other run's events, so it is not dropped,
+    # either by hand or by the retention job.
+    assert client.delete(f"/admin/partitions/{month}", auth=ADMIN_AUTH).status_code == 409
+    monkeypatch.setattr(settings, "partition_max_age_months", 0)
+    assert partitions.drop_expired(datetime.datetime.now() + datetime.timedelta(days=62)) == []
+    assert [event["value"] for event in client.get(f"/runs/{run_ids[1]}/events").json()] == ["dragon"]
+
+    # Once that run is gone too, the month can be dropped.
+    assert client.delete(f"/runs/{run_ids[1]}").status_code == 200
+    assert client.delete(f"/admin/partitions/{month}", auth=ADMIN_AUTH).status_code == 204
+
+def test_admin_retention_prunes_tombstones_and_partitions(monkeypatch, tmp_path):
+    """
+    Tests that the admin endpoint runs the whole retention job, as the
+    scheduled one does, including tombstone and partition pruning.
+    """
+    import models
+    from config import settings
+    monkeypatch.setattr(settings, "sync_tombstone_max_age_days", 0)
+    monkeypatch.setattr(settings, "partition_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "partition_max_age_months", 1)
+    (tmp_path / "runs-2020-01.db").write_bytes(b"")
+
+    player = client.post("/players", json={"name": "pruned"}).json()
+    run_id = play_run(player, 100, 1, {})
+    client.delete(f"/runs/{run_id}")
+
+    response = client.post("/admin/retention", auth=ADMIN_AUTH)
+    job = client.get(f"/admin/jobs/{response.json()['id']}", auth=ADMIN_AUTH).json()
+    assert job["status"] == "completed"
+    assert not (tmp_path / "runs-2020-01.db").exists()
+    db = TestingSessionLocal()
+    try:
+        assert db.query(models.Tombstone).count() == 0
+    finally:
+        db.close()
@@ -8,6 +8,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from main import app
 from database import Base, get_db
+import crud
 
 # --- Test Database Setup ---
 
@@ -126,4 +127,78 @@ def test_get_run_not_found():
     does not exist. It should return a 404 Not Found status.
     """
     response = client.get("/runs/9999")  # A run ID that is unlikely to exist.
-    assert response.status_code == 404
\ No newline at end of file
+    assert response.status_code == 404
+
+def test_submit_full_run():
+    """
+    Tests submitting a complete run with its stats, upgrades and events in
+    a single request, and that it shows up like any other finished run.
+    """
+    # 1. Create a player to get their credentials.
+    player_data = client.post("/players", json={"name": "run_submitter"}).json()
+
+    # 2. Submit the whole run at once.
+    submit_response = client.post("/runs/submit", json={
+        "player_name": player_data["name"],
+        "password": player_data["password"],
+        "map_id": "map1",
+        "status": "died",
+        "duration_seconds": 420,
+        "kills_total": 77,
+        "level": 9,
+        "upgrades": {"speed": 2, "armor": 1},
+        "cause_of_death": "Boss",
+        "events": [
+            {"event_type": "level_up", "value": "2"},
+            {"event_type": "boss_spawned", "timestamp": "2024-01-01T12:00:00"},
+        ],
+    })
+    assert submit_response.status_code == 201
+    submitted = submit_response.json()
+    assert submitted["events_recorded"] == 2
+
+    # 3. The run, its upgrades and its events are all stored.
+    run_data = client.get(f"/runs/{submitted['run_id']}").json()
+    assert run_data["status"] == "died"
+    assert run_data["duration_seconds"] == 420
+    assert run_data["upgrades"] == {"speed": 2, "armor": 1}
+    assert run_data["ended_at"] is not None
+    events = client.get(f"/runs/{submitted['run_id']}/events").json()
+    assert [event["event_type"] for event in events] == ["level_up", "boss_spawned"]
+    assert events[1]["timestamp"] == "2024-01-01T12:00:00"
+    leaderboard = client.get("/analytics/leaderboard/all_time").json()
+    assert leaderboard[0]["run_id"] == submitted["run_id"]
+
+def test_submit_run_rejects_bad_credentials_and_unfinished_runs():
+    """
+    Tests that a submission needs valid credentials and a finished status.
+    """
+    player_data = client.post("/players", json={"name": "run_cheater"}).json()
+    run = {"player_name": player_data["name"], "password": "wrong", "map_id": "map1"}
+    assert client.post("/runs/submit", json=run).status_code == 401
+
+    run["password"] = player_data["password"]
+    run["status"] = "in_progress"
+    assert client.post("/runs/submit", json=run).status_code == 422
+
+def test_run_listings_read_rows_without_orm_objects():
+    """
+    Tests that run listings return each run with its player, without
+    loading any ORM objects into the session, and serialize runs exactly
+    as the validated single-run endpoint does.
+    """
+    player_data = client.post("/players", json={"name": "run_lister"}).json()
+    for map_id in ("map1", "map2"):
+        client.post("/runs/start", json={"player_name": player_data["name"], "password": player_data["password"], "map_id": map_id})
+
+    runs = client.get(f"/players/{player_data['id']}/runs").json()
+    assert [run["map_id"] for run in runs] == ["map1", "map2"]
+    assert runs[0]["player"]["name"] == "run_lister"
+    assert runs[0]["status"] == "in_progress"
+    assert client.get("/runs").json() == runs
+    assert runs[0] == client.get(f"/runs/{runs[0]['id']}").json()
+
+    with TestingSessionLocal() as db:
+        listed = crud.get_runs(db)
+        assert len(db.identity_map) == 0
+    assert [run.model_dump(mode="json") for run in listed] == runs
@@ -0,0 +1,89 @@
+# This file contains tests for the typeahead player search.
+# It verifies how matches are ranked, and that the search index follows
+# players as they are created, renamed and deleted.
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+ADMIN_AUTH = ("admin", "admin")
+
+def search(q, limit=10):
+    """Returns the names matched by a typeahead search."""
+    response = client.get("/players/search", params={"q": q, "limit": limit})
+    assert response.status_code == 200
+    return [match["name"] for match in response.json()]
+
+def test_search_ranks_name_prefixes_before_words():
+    """
+    Names starting with the query must come before names with a word
+    inside them that starts with it.
+    """
+    for name in ["SwiftFox", "Foxtrot", "Fox", "IronWolf", "BoldFoxglove"]:
+        client.post("/players", json={"name": name})
+
+    assert search("fox") == ["Fox", "Foxtrot", "SwiftFox", "BoldFoxglove"]
+    assert search("FOX", limit=2) == ["Fox", "Foxtrot"]
+    assert search("wolf") == ["IronWolf"]
+    assert search("zebra") == []
+
+def test_search_follows_create_rename_and_delete():
+    """
+    The index must be updated by every change to a player's name.
+    """
+    client.post("/players", json={"name": "SilentHawk"})
+    assert search("hawk") == ["SilentHawk"]
+
+    player = client.post("/players", json={"name": "StormLion"}).json()
+    assert search("lion") == ["StormLion"]
+
+    client.patch(f"/admin/players/{player['id']}", json={"name": "StormTiger"}, auth=ADMIN_AUTH)
+    assert search("lion") == []
+    assert search("storm") == ["StormTiger"]
+
+    client.delete(f"/players/{player['id']}")
+    assert search("storm") == []
+    assert search("hawk") == ["SilentHawk"]
@@ -0,0 +1,166 @@
+# This file contains tests for stale-while-revalidate analytics.
+# It verifies that stale results are served while refreshing, that
+# database errors and locks fall back to stale results within their limit,
+# and that writes lead to cached results being refreshed.
+
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+import models
+import swr
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+def locked(db):
+    """A query that fails as if the database were write-locked."""
+    raise OperationalError("SELECT", {}, Exception("database is locked"))
+
+def test_stale_result_is_served_while_refreshing():
+    """
+    A stale result must be served immediately, and replaced in the
+    background.
+    """
+    cache = swr.StaleWhileRevalidate("test", fresh_seconds=0.05, max_stale_seconds=60)
+    calls = []
+    def compute(db):
+        calls.append(1)
+        return len(calls)
+
+    db = TestingSessionLocal()
+    try:
+        assert cache.get(db, "key", compute) == (1, 0.0)
+        value, age = cache.get(db, "key", compute)
+        assert value == 1 and age < 0.05
+
+        time.sleep(0.1)
+        value, age = cache.get(db, "key", compute)
+        assert value == 1 and age >= 0.05
+        for _ in range(50):
+            if cache.get(db, "key", compute)[0] == 2:
+                break
+            time.sleep(0.01)
+        assert cache.get(db, "key", compute)[0] == 2
+    finally:
+        db.close()
+
+def test_database_errors_fall_back_to_stale_results():
+    """
+    If the database fails, a result within its maximum staleness must be
+    served instead; an older one must not.
+    """
+    cache = swr.StaleWhileRevalidate("test", fresh_seconds=0, max_stale_seconds=0.2)
+    db = TestingSessionLocal()
+    try:
+        cache.get(db, "key", lambda db: "good")
+        cache.invalidate()
+        value, age = cache.get(db, "key", locked)
+        assert value == "good"
+
+        time.sleep(0.3)
+        with pytest.raises(OperationalError):
+            cache.get(db, "key", locked)
+    finally:
+        db.close()
+
+def wait_for_summary_names(expected):
+    """Reads the players summary until the background refresh catches up."""
+    for _ in range(100):
+        names = [player["name"] for player in client.get("/analytics/players-summary").json()]
+        if names == expected:
+            return names
+        time.sleep(0.01)
+    return names
+
+def test_writes_invalidate_cached_summaries():
+    """
+    Player and run changes, including bulk deletes, must be picked up by a
+    background refresh right after the write, rather than waiting for the
+    result to go stale, without the read itself waiting for it.
+    """
+    client.post("/players", json={"name": "Alice"})
+    response = client.get("/analytics/players-summary")
+    assert response.headers["Age"] == "0"
+    assert [player["name"] for player in response.json()] == ["Alice"]
+
+    client.post("/players", json={"name": "Bob"})
+    assert wait_for_summary_names(["Alice", "Bob"]) == ["Alice", "Bob"]
+
+    db = TestingSessionLocal()
+    try:
+        db.query(models.Player).filter(models.Player.name == "Bob").delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+    assert wait_for_summary_names(["Alice"]) == ["Alice"]
+
+def test_locked_database_serves_the_stale_result(monkeypatch):
+    """
+    While another connection holds the write lock, a dirty result must be
+    served without waiting, and a read with nothing cached must give up
+    after the lock timeout rather than the connection's busy timeout.
+    """
+    monkeypatch.setattr(swr.settings, "swr_lock_timeout_seconds", 0.1)
+    cache = swr.StaleWhileRevalidate("test", fresh_seconds=60, max_stale_seconds=60)
+    def count_players(db):
+        return db.query(models.Player).count()
+
+    db = TestingSessionLocal()
+    writer = engine.raw_connection()
+    try:
+        assert cache.get(db, "key", count_players) == (0, 0.0)
+        cache.invalidate()
+        writer.execute("BEGIN EXCLUSIVE")
+
+        started = time.monotonic()
+        assert cache.get(db, "key", count_players)[0] == 0
+        with pytest.raises(OperationalError):
+            cache.get(db, "other", count_players)
+        assert time.monotonic() - started < 2
+    finally:
+        writer.rollback()
+        writer.close()
+        db.close()
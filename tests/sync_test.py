@@ -0,0 +1,127 @@
+# This file contains tests for delta sync.
+# It verifies that changes, deletions and bulk deletions are returned after
+# a cursor, that pages never skip a change, and that pruned tombstones
+# force a fresh sync.
+
+import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+import models
+import sync
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+ADMIN_AUTH = ("admin", "admin")
+
+def changes(since, limit=1000):
+    """Fetches the changes after a cursor."""
+    response = client.get("/sync", params={"since": since, "limit": limit})
+    assert response.status_code == 200
+    return response.json()
+
+def test_sync_returns_only_changes_after_cursor():
+    """
+    A client must receive new, changed and deleted rows since its cursor,
+    and nothing else.
+    """
+    alice = client.post("/players", json={"name": "Alice"}).json()
+    bob = client.post("/players", json={"name": "Bob"}).json()
+    run = client.post("/runs/start", json={"player_name": "Alice", "password": alice["password"], "map_id": "forest"}).json()
+
+    first = changes(0)
+    assert [player["name"] for player in first["players"]] == ["Alice", "Bob"]
+    assert [synced["id"] for synced in first["runs"]] == [run["run_id"]]
+    assert first["has_more"] is False
+
+    # Nothing has changed since the returned cursor.
+    unchanged = changes(first["cursor"])
+    assert unchanged["players"] == [] and unchanged["runs"] == []
+    assert unchanged["cursor"] == first["cursor"]
+
+    client.patch(f"/runs/{run['run_id']}", json={"duration_seconds": 120, "status": "died"})
+    client.delete(f"/players/{bob['id']}")
+    second = changes(first["cursor"])
+    assert second["players"] == []
+    assert [synced["duration_seconds"] for synced in second["runs"]] == [120]
+    assert second["deleted_player_ids"] == [bob["id"]]
+
+def test_bulk_deletes_leave_tombstones_and_pages_do_not_skip():
+    """
+    Rows removed by bulk deletes must be reported, and paging through the
+    changes must see every one of them exactly once.
+    """
+    for name in ["A", "B", "C", "D"]:
+        client.post("/players", json={"name": name})
+    cursor = changes(0)["cursor"]
+    client.post("/admin/players/bulk-delete", json={"created_after": "2000-01-01T00:00:00"}, auth=ADMIN_AUTH)
+
+    deleted = []
+    while True:
+        page = changes(cursor, limit=3)
+        deleted += page["deleted_player_ids"]
+        cursor = page["cursor"]
+        if not page["has_more"]:
+            break
+    assert len(deleted) == 4 and len(set(deleted)) == 4
+
+def test_pruned_tombstones_require_fresh_sync():
+    """
+    A cursor older than the pruned tombstones must be rejected with 410.
+    """
+    player = client.post("/players", json={"name": "Gone"}).json()
+    client.delete(f"/players/{player['id']}")
+
+    db = TestingSessionLocal()
+    try:
+        db.query(models.Tombstone).update({"deleted_at": datetime.datetime.now() - datetime.timedelta(days=60)})
+        db.commit()
+        assert sync.prune_tombstones(db, max_age_days=30) == 1
+    finally:
+        db.close()
+
+    assert client.get("/sync", params={"since": 0}).status_code == 410
+    latest = changes(2)
+    assert latest["deleted_player_ids"] == []
@@ -0,0 +1,159 @@
+# This file contains tests for the normalized run upgrades.
+# It verifies that run updates keep `run_upgrades` in sync, that old
+# runs can be backfilled, and that upgrade analytics are correct.
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+
+# --- Test Database Setup ---
+
+# Use an in-memory SQLite database for testing to ensure isolation.
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def setup_function():
+    """
+    Create all database tables before each test function is executed.
+    """
+    Base.metadata.create_all(bind=engine)
+
+def teardown_function():
+    """
+    Drop all database tables after each test function has executed.
+    This ensures a clean state for every test.
+    """
+    Base.metadata.drop_all(bind=engine)
+
+def override_get_db():
+    """
+    A dependency override that provides a test database session to the
+    API endpoints during testing.
+    """
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+# Apply the dependency override to the FastAPI app.
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+def start_run(player):
+    """Starts a run for an existing player and returns its ID."""
+    response = client.post("/runs/start", json={"player_name": player["name"], "password": player["password"], "map_id": "map1"})
+    return response.json()["run_id"]
+
+def upgrade_rows(run_id):
+    """Returns a run's normalized upgrades as a dictionary."""
+    import models
+    db = TestingSessionLocal()
+    try:
+        return {row.upgrade: row.level for row in db.query(models.RunUpgrade).filter(models.RunUpgrade.run_id == run_id)}
+    finally:
+        db.close()
+
+# --- Run Upgrade Tests ---
+
+def test_update_run_syncs_upgrade_rows():
+    """
+    Tests that each update replaces the run's normalized upgrades with the
+    ones that were sent, including removing upgrades that were dropped.
+    """
+    player = client.post("/players", json={"name": "upgrader"}).json()
+    run_id = start_run(player)
+
+    client.patch(f"/runs/{run_id}/update", json={"upgrades": {"speed": 1, "damage": 2}})
+    assert upgrade_rows(run_id) == {"speed": 1, "damage": 2}
+
+    client.patch(f"/runs/{run_id}/update", json={"upgrades": {"speed": 3}})
+    assert upgrade_rows(run_id) == {"speed": 3}
+
+    client.delete(f"/runs/{run_id}")
+    assert upgrade_rows(run_id) == {}
+
+def test_upgrade_analytics():
+    """
+    Tests the favourite upgrade and the upgrade-effectiveness endpoints.
+    """
+    player = client.post("/players", json={"name": "analyst"}).json()
+    first_run = start_run(player)
+    client.patch(f"/runs/{first_run}", json={"duration_seconds": 100, "kills_total": 10, "upgrades": {"speed": 1, "damage": 1}})
+    second_run = start_run(player)
+    client.patch(f"/runs/{second_run}", json={"duration_seconds": 300, "kills_total": 30, "upgrades": {"damage": 3}})
+
+    stats = client.get(f"/analytics/view_player_stats/{player['id']}").json()
+    assert stats["favourite_upgrade"] == "damage"
+
+    response = client.get(f"/analytics/player/{player['id']}/upgrade-effectiveness")
+    assert response.status_code == 200
+    by_upgrade = {entry["upgrade"]: entry for entry in response.json()}
+    assert by_upgrade["damage"]["runs"] == 2
+    assert by_upgrade["damage"]["average_level"] == 2
+    assert by_upgrade["damage"]["average_duration_seconds"] == 200
+    assert by_upgrade["speed"]["runs"] == 1
+    assert by_upgrade["speed"]["average_kills"] == 10
+
+    assert client.get("/analytics/upgrades").json() == response.json()
+    assert client.get("/analytics/player/9999/upgrade-effectiveness").status_code == 404
+
+def test_backfill_run_upgrades():
+    """
+    Tests that runs recorded with only the upgrades JSON are copied into
+    `run_upgrades` by the backfill, and that running it again does nothing.
+    """
+    import crud
+    import models
+    player = client.post("/players", json={"name": "legacy"}).json()
+
+    db = TestingSessionLocal()
+    try:
+        legacy_run = models.Run(player_id=player["id"], map_id="map1", upgrades={"armour": 2})
+        db.add(legacy_run)
+        db.commit()
+        assert crud.backfill_run_upgrades(db) == 1
+        assert crud.backfill_run_upgrades(db) == 0
+        assert upgrade_rows(legacy_run.id) == {"armour": 2}
+    finally:
+        db.close()
+
+def test_migrate_upgrades_an_old_database(tmp_path):
+    """
+    Tests that the migration step brings a database created before the
+    newer tables and columns existed up to date, and can be run again.
+    """
+    import sqlite3
+    import migrate
+    old_path = tmp_path / "old.db"
+    with sqlite3.connect(old_path) as old:
+        old.executescript("""
+            CREATE TABLE players (id INTEGER PRIMARY KEY, name VARCHAR UNIQUE NOT NULL, hashed_password VARCHAR NOT NULL, created_at DATETIME);
+            CREATE TABLE runs (id INTEGER PRIMARY KEY, player_id INTEGER NOT NULL, map_id VARCHAR, started_at DATETIME,
+                status VARCHAR(11), duration_seconds INTEGER, level INTEGER, xp INTEGER, kills_total INTEGER,
+                upgrades JSON, ended_at DATETIME, cause_of_death VARCHAR);
+            CREATE TABLE run_events (id INTEGER PRIMARY KEY, run_id INTEGER NOT NULL, event_type VARCHAR, value VARCHAR, timestamp DATETIME);
+            INSERT INTO players VALUES (1, 'veteran', 'hash', '2024-01-01 00:00:00');
+            INSERT INTO runs VALUES (1, 1, 'map1', '2024-01-01 00:00:00', 'died', 60, 1, 0, 3, '{"armour": 2}', NULL, NULL);
+        """)
+
+    old_engine = create_engine(f"sqlite:///{old_path}")
+    migrate.migrate(old_engine)
+    migrate.migrate(old_engine)
+    old_engine.dispose()
+
+    with sqlite3.connect(old_path) as migrated:
+        assert migrated.execute("SELECT run_id, upgrade, level FROM run_upgrades").fetchall() == [(1, "armour", 2)]
+        assert migrated.execute("SELECT change_seq IS NOT NULL FROM runs").fetchone() == (1,)
+        table_sql = migrated.execute("SELECT sql FROM sqlite_master WHERE name = 'run_events'").fetchone()[0]
+        assert "AUTOINCREMENT" in table_sql.upper()
+        assert migrated.execute("SELECT count(*) FROM sqlite_master WHERE name = 'jobs'").fetchone() == (1,)
@@ -0,0 +1,262 @@
+# This file keeps the progress of each run as a time series, so that
+# survival, kill and XP curves can be drawn after the run has finished.
+# Every progress update a game sends (about every 30 seconds) appends one
+# sample of (duration, kills, xp, level) to the run's series.
+#
+# A series is a single `run_progress` row per run, not a row per sample:
+# each sample is stored as the difference from the one before, as four
+# zigzag varints, so a typical sample takes four to six bytes. The last
+# sample is kept in plain columns, so a new one can be appended without
+# decoding the series. New samples go into a short `tail` first and are
+# only moved onto the end of `data` once the tail is full, so a progress
+# update writes a few bytes rather than the whole series.
+#
+# The curves of each map are kept in memory by `MapCurveIndex`, so they
+# are not rebuilt from every run's series on each request.
+
+import bisect
+import itertools
+import operator
+import re
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session, defer
+
+import indexes
+import models
+import schemas
+from event_store import read_varint, unzigzag, write_varint, zigzag
+
+# The fields of a sample, in the order they are stored.
+FIELDS = ("duration_seconds", "kills_total", "xp", "level")
+
+# The size the tail of a series can reach before it is moved into `data`.
+TAIL_BYTES = 256
+
+def _sample(run: models.Run) -> Tuple[int, ...]:
+    return tuple(getattr(run, field) or 0 for field in FIELDS)
+
+def record_sample(db: Session, run: models.Run):
+    """
+    Appends the run's current progress to its series, unless nothing has
+    changed since the last sample. The caller is responsible for committing.
+    """
+    series = (
+        db.query(models.RunProgress)
+        .options(defer(models.RunProgress.data))
+        .filter(models.RunProgress.run_id == run.id)
+        .first()
+    )
+    if series is None:
+        series = models.RunProgress(
+            run_id=run.id, sample_count=0, data=b"", tail=b"",
+            last_duration_seconds=0, last_kills_total=0, last_xp=0, last_level=0,
+        )
+        db.add(series)
+    sample = _sample(run)
+    last = tuple(getattr(series, f"last_{field}") for field in FIELDS)
+    if series.sample_count and sample == last:
+        return
+    encoded = bytearray()
+    for value, previous in zip(sample, last):
+        write_varint(encoded, zigzag(value - previous))
+    tail = bytes(series.tail or b"") + bytes(encoded)
+    if len(tail) >= TAIL_BYTES:
+        series.data = bytes(series.data) + tail
+        tail = b""
+    series.tail = tail
+    series.sample_count += 1
+    for field, value in zip(FIELDS, sample):
+        setattr(series, f"last_{field}", value)
+
+def series_data(series: models.RunProgress) -> bytes:
+    """
+    Returns the whole of a stored series, tail included.
+    """
+    return bytes(series.data) + bytes(series.tail or b"")
+
+# A varint is any run of bytes with the high bit set, then one without.
+_VARINT = re.compile(rb"[\x80-\xff]*[\x00-\x7f]")
+
+def _short_varints() -> Dict[bytes, int]:
+    table = {}
+    for value in range(1 << 14):
+        encoded = bytearray()
+        write_varint(encoded, value)
+        table[bytes(encoded)] = unzigzag(value)
+    return table
+
+# The signed value of every one and two byte varint, which is nearly every
+# delta between samples sent 30 seconds apart.
+_SHORT_VARINTS = _short_varints()
+
+def _decode_deltas(data: bytes) -> array:
+    try:
+        # Split and looked up by the regex engine and `map`, not byte by byte.
+        return array("q", map(_SHORT_VARINTS.__getitem__, _VARINT.findall(data)))
+    except KeyError:
+        deltas = array("q")
+        position = 0
+        while position < len(data):
+            value, position = read_varint(data, position)
+            deltas.append(unzigzag(value))
+        return deltas
+
+def decode(data: bytes) -> Dict[str, array]:
+    """
+    Decodes a series into one array per field, in sample order.
+    """
+    deltas = _decode_deltas(data)
+    width = len(FIELDS)
+    return {
+        field: array("q", itertools.accumulate(deltas[index::width]))
+        for index, field in enumerate(FIELDS)
+    }
+
+def get_run_curve(db: Session, run_id: int) -> Optional[schemas.RunCurve]:
+    """
+    Returns a run's progress samples, or None if the run does not exist.
+    """
+    if db.get(models.Run, run_id) is None:
+        return None
+    series = db.get(models.RunProgress, run_id)
+    columns = decode(series_data(series)) if series else {field: array("q") for field in FIELDS}
+    return schemas.RunCurve(
+        run_id=run_id,
+        duration_seconds=columns["duration_seconds"].tolist(),
+        kills_total=columns["kills_total"].tolist(),
+        xp=columns["xp"].tolist(),
+        level=columns["level"].tolist(),
+    )
+
+class MapCurveIndex(indexes.DerivedIndex):
+    """
+    Keeps the curves of every map as the changes they go through over
+    time. Each finished run adds one to the runs alive at 0 seconds, the
+    change in each of its values at each of its sample times, and takes
+    itself away again just after its final duration. The curves at any
+    time are then the running totals of the changes up to it. Those totals
+    are worked out with `itertools.accumulate` when a map is first read
+    after a change, and each bucket is then a binary search into them,
+    whatever buckets are asked for.
+
+    Like the quantile sketches, a run is counted as it was when it
+    finished; deleting runs discards the index, so that it is rebuilt.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._clear()
+
+    def _clear(self):
+        # map -> time -> change in (alive, kills, xp, level) at that time.
+        self._changes: Dict[str, Dict[int, List[int]]] = {}
+        # map -> (times in order, running totals of each field from before
+        # the first of them), until the map next changes.
+        self._totals: Dict[str, Tuple[List[int], List[array]]] = {}
+        self._runs: Dict[str, int] = {}
+
+    def _add(self, map_id: str, final_duration: Optional[int], data: bytes):
+        columns = decode(data)
+        durations = columns["duration_seconds"]
+        if not durations:
+            return
+        final_duration = max(final_duration or 0, durations[-1])
+        values = [columns[field] for field in FIELDS[1:]]
+        if max(durations) > final_duration:
+            # Samples after the final duration are left out.
+            kept = [duration <= final_duration for duration in durations]
+            durations = array("q", itertools.compress(durations, kept))
+            values = [array("q", itertools.compress(column, kept)) for column in values]
+        # Each sample's change from the one before, the first from zero.
+        deltas = [map(operator.sub, column, itertools.chain((0,), column)) for column in values]
+
+        changes = self._changes.setdefault(map_id, {})
+        self._totals.pop(map_id, None)
+        self._runs[map_id] = self._runs.get(map_id, 0) + 1
+        changes.setdefault(0, [0] * len(FIELDS))[0] += 1
+        for time, *sample in zip(durations, *deltas):
+            totals = changes.get(time)
+            if totals is None:
+                changes[time] = [0, *sample]
+            else:
+                totals[1] += sample[0]
+                totals[2] += sample[1]
+                totals[3] += sample[2]
+        totals = changes.setdefault(final_duration + 1, [0] * len(FIELDS))
+        totals[0] -= 1
+        for index, column in enumerate(values, start=1):
+            totals[index] -= column[-1] if column else 0
+
+    def _running_totals(self, map_id: str) -> Tuple[List[int], List[array]]:
+        cached = self._totals.get(map_id)
+        if cached is None:
+            changes = self._changes.get(map_id, {})
+            times = sorted(changes)
+            ordered = list(map(changes.__getitem__, times))
+            cached = self._totals[map_id] = (
+                times,
+                [
+                    array("q", itertools.accumulate(map(operator.itemgetter(index), ordered), initial=0))
+                    for index in range(len(FIELDS))
+                ],
+            )
+        return cached
+
+    def _load(self, db: Session):
+        rows = (
+            db.query(models.Run.map_id, models.Run.duration_seconds, models.RunProgress.data, models.RunProgress.tail)
+            .join(models.RunProgress, models.RunProgress.run_id == models.Run.id)
+            .filter(models.Run.status.in_(models.TERMINAL_STATUSES))
+            .yield_per(500)
+        )
+        for map_id, final_duration, data, tail in rows:
+            self._add(map_id, final_duration, bytes(data) + bytes(tail or b""))
+
+    def record(self, run: models.Run):
+        """
+        Adds a run that has just finished. Must only be called once per run.
+        """
+        with self._lock:
+            if not self._loaded or run.progress is None:
+                return
+            self._add(run.map_id, run.duration_seconds, series_data(run.progress))
+
+    def curve(self, db: Session, map_id: str, bucket_seconds: int, buckets: int) -> schemas.MapCurve:
+        """
+        Returns the curves of a map, sampled every `bucket_seconds`.
+        """
+        self.ensure_loaded(db)
+        with self._lock:
+            times, totals = self._running_totals(map_id)
+            run_count = self._runs.get(map_id, 0)
+        seconds = list(range(0, bucket_seconds * buckets, bucket_seconds))
+        # The totals at each bucket are those at the last change up to it;
+        # each column starts with the zero totals before the first change.
+        positions = [bisect.bisect_right(times, moment) for moment in seconds]
+        alive, kills, xp, level = (list(map(column.__getitem__, positions)) for column in totals)
+
+        def averages(values: List[int]) -> List[float]:
+            return [value / count if count else 0.0 for value, count in zip(values, alive)]
+
+        return schemas.MapCurve(
+            map_id=map_id,
+            runs=run_count,
+            seconds=seconds,
+            survival=[count / run_count if run_count else 0.0 for count in alive],
+            average_kills=averages(kills),
+            average_xp=averages(xp),
+            average_level=averages(level),
+        )
+
+curves = indexes.register(MapCurveIndex())
+
+def get_map_curve(db: Session, map_id: str, bucket_seconds: int = 30, buckets: int = 60) -> schemas.MapCurve:
+    """
+    Aggregates the finished runs of a map into curves sampled every
+    `bucket_seconds`: the share of runs still alive at each time, and the
+    average kills, xp and level of the runs alive then. A run's values at
+    a time are those of its last sample at or before it.
+    """
+    return curves.curve(db, map_id, bucket_seconds, buckets)